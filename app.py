@@ -5,9 +5,11 @@ import streamlit as st
 import json
 import os
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 import logging
-from utils.faiss_retriever import FaissRetriever
+from contextlib import nullcontext
+from utils.metrics import get_metrics
+from utils.profiling import profile, profiling_modes
+from utils.snippets import snippet as result_snippet
 
 # Load environment variables from .env file
 load_dotenv()
@@ -373,11 +375,50 @@ st.markdown('''
 </div>
 ''', unsafe_allow_html=True)
 
-# Initialize embedding model and retriever
-if 'embedding_model' not in st.session_state:
-    st.session_state.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-if 'faiss_retriever' not in st.session_state:
-    st.session_state.faiss_retriever = FaissRetriever()
+# Embedding model and retriever are created on first search, so the page renders
+# without waiting for torch, sentence-transformers and FAISS to import.
+# The encoder backend (torch, onnx, onnx-int8) comes from VECTOR_SEARCH_ENCODER.
+def get_embedding_model():
+    if 'embedding_model' not in st.session_state:
+        from utils.encoders import get_encoder
+        st.session_state.embedding_model = get_encoder(model_name='all-MiniLM-L6-v2')
+    return st.session_state.embedding_model
+
+@st.cache_resource
+def get_index_manager():
+    # One manager per server process, shared by all sessions, so a newly
+    # published index version reaches every session without a restart
+    from utils.index_versions import IndexManager
+    return IndexManager('data/embeddings').start()
+
+# Hits below this cosine similarity are not shown; fewer than 10 results means
+# nothing else was relevant enough
+MIN_SCORE = float(os.environ.get('VECTOR_SEARCH_MIN_SCORE', '0.2'))
+
+@st.cache_resource
+def get_reranker():
+    # Optional cross-encoder stage, enabled with VECTOR_SEARCH_RERANK (see utils.reranker)
+    from utils.reranker import reranker_from_env
+    return reranker_from_env()
+
+def get_profiling_modes():
+    # ?profile=1 in the URL captures a search when VECTOR_SEARCH_PROFILE allows it
+    try:
+        return profiling_modes(st.query_params.get('profile'))
+    except ValueError:
+        # A mistyped mode must not break search; run unprofiled
+        return ()
+
+def get_retriever():
+    shared_dir = os.environ.get('VECTOR_SEARCH_SHARED_INDEX')
+    if not shared_dir:
+        return get_index_manager()
+    if 'faiss_retriever' not in st.session_state:
+        # Attach to an index published in shared memory instead of loading a private copy.
+        # It is a snapshot: live updates show up only after utils.shared_index republishes it.
+        from utils.shared_index import SharedIndexRetriever
+        st.session_state.faiss_retriever = SharedIndexRetriever(shared_dir)
+    return st.session_state.faiss_retriever
 
 # Suggested search terms
 suggested_searches = [
@@ -393,6 +434,18 @@ suggested_searches = [
     "dialysis nutrition tips"
 ]
 
+@st.cache_resource
+def get_suggest_index(version):
+    # Titles of the live index version plus popular queries; rebuilt when the version changes
+    from utils.index_versions import version_dir
+    from utils.suggest import build_suggest_index
+    return build_suggest_index(str(version_dir('data/embeddings', version)),
+                               extra_queries=suggested_searches)
+
+def get_suggester():
+    version = None if os.environ.get('VECTOR_SEARCH_SHARED_INDEX') else get_index_manager().version
+    return get_suggest_index(version)
+
 # Initialize search query in session state
 if 'search_query' not in st.session_state:
     st.session_state.search_query = ""
@@ -401,6 +454,10 @@ if 'search_query' not in st.session_state:
 if 'suggestion_clicked' not in st.session_state:
     st.session_state.suggestion_clicked = None
 
+# Queries this session has already counted toward suggestions
+if 'recorded_queries' not in st.session_state:
+    st.session_state.recorded_queries = set()
+
 
 
 # Create a better search interface using Streamlit components
@@ -425,16 +482,18 @@ search_query = st.text_input(
 if search_query != st.session_state.search_query:
     st.session_state.search_query = search_query
 
-# Suggestions section
-st.markdown('''
+# Suggestions section: completions of the current query from the prefix index,
+# or the static popular searches when there are none
+suggestions = get_suggester().suggest(search_query, limit=len(suggested_searches)) if search_query else []
+st.markdown(f'''
 <div class="suggestions-container">
-    <div class="suggestions-title">Popular searches:</div>
+    <div class="suggestions-title">{'Related searches' if suggestions else 'Popular searches'}:</div>
     <div class="suggestions-grid">
 ''', unsafe_allow_html=True)
 
 # Create suggestion buttons in a grid layout
 cols = st.columns(2)
-for i, suggestion in enumerate(suggested_searches):
+for i, suggestion in enumerate(suggestions or suggested_searches):
     col_idx = i % 2
     with cols[col_idx]:
         if st.button(suggestion, key=f"suggest_{i}", use_container_width=True):
@@ -470,13 +529,12 @@ def render_results(results, search_query):
             display_url = url.replace('https://', '').replace('http://', '') if url else ''
             if display_url.endswith('/'):
                 display_url = display_url[:-1]
-            snippet = result.get('content', '')[:180]
-            if len(result.get('content', '')) > 180:
-                last_space = snippet.rfind(' ')
-                if last_space > 120:
-                    snippet = snippet[:last_space] + '...'
-                else:
-                    snippet = snippet + '...'
+            if 'score' in result:
+                score_label = f"Similarity: {result['score']:.3f}"
+            else:
+                score_label = f"Distance: {result.get('distance', 0):.3f}"
+            # Best-matching sentence from the precomputed offsets, else the start of the chunk
+            snippet = result_snippet(result, search_query, max_chars=180)
             st.markdown(f'''
             <div class="result">
                 <div class="result-url">
@@ -484,7 +542,7 @@ def render_results(results, search_query):
                 </div>
                 <a class="result-title" href="{url if url else '#'}" target="_blank">{title}</a>
                 <div class="result-snippet">{snippet}</div>
-                <div class="result-meta">Distance: {result.get('distance', 0):.3f}</div>
+                <div class="result-meta">{score_label}</div>
             </div>
             ''', unsafe_allow_html=True)
     else:
@@ -497,23 +555,53 @@ def render_results(results, search_query):
         ''', unsafe_allow_html=True)
 
 # Search logic and results
-if search_query:
-    with st.spinner("Searching..."):
-        try:
-            query_embedding = st.session_state.embedding_model.encode([search_query])
-            results = st.session_state.faiss_retriever.search(query_embedding, top_k=10)
-            st.session_state.search_results = results
-        except Exception as e:
-            st.error(f"Search error: {e}")
-            st.session_state.search_results = []
-            import traceback
-            st.session_state['last_traceback'] = traceback.format_exc()
-else:
-    st.session_state.search_results = []
-
-# Display results
-if st.session_state.get('search_results'):
-    render_results(st.session_state['search_results'], search_query)
+metrics = get_metrics()
+with metrics.trace(query=search_query) if search_query else nullcontext() as trace:
+    if search_query:
+        if st.session_state.get('results_query') == search_query:
+            # Reruns triggered by other widgets reuse the results of the same query
+            metrics.inc('cache_hits')
+            trace.set('cache_hit', True)
+        else:
+            metrics.inc('cache_misses')
+            with st.spinner("Searching..."):
+                try:
+                    with profile('search', get_profiling_modes(), query=search_query):
+                        with metrics.span('encode'):
+                            query_embedding = get_embedding_model().encode([search_query])
+                        reranker = get_reranker()
+                        with metrics.span('search'):
+                            results = get_retriever().search(query_embedding,
+                                                             top_k=max(10, reranker.top_n) if reranker else 10,
+                                                             min_score=MIN_SCORE)
+                        if reranker:
+                            results = reranker.rerank(search_query, results)[:10]
+                    st.session_state.search_results = results
+                    st.session_state.results_query = search_query
+                    if results and search_query not in st.session_state.recorded_queries:
+                        # Counted once per session, so one user's repeats can't make a suggestion
+                        st.session_state.recorded_queries.add(search_query)
+                        get_suggester().record(search_query)
+                except Exception as e:
+                    st.error(f"Search error: {e}")
+                    st.session_state.search_results = []
+                    st.session_state.results_query = None
+                    trace.set('error', str(e))
+                    import traceback
+                    st.session_state['last_traceback'] = traceback.format_exc()
+    else:
+        st.session_state.search_results = []
+        st.session_state.results_query = None
+
+    # Display results (or the no-results message when nothing passed the cutoff)
+    if search_query and st.session_state.get('results_query') == search_query:
+        with metrics.span('render'):
+            render_results(st.session_state['search_results'], search_query)
+try:
+    metrics.export()
+except OSError as e:
+    # A full disk or unwritable metrics path must not break the page
+    print(f"Could not export metrics: {e}")
 
 # Optionally, for debugging, you can show the traceback in the UI (commented out by default):
 # if 'last_traceback' in st.session_state:
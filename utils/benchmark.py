@@ -0,0 +1,371 @@
+"""
+Reproducible performance benchmarks for the search stack.
+
+Covers FaissRetriever load time, single and batched search latency, binary
+prefilter recall and latency versus exact search, EmbeddingGenerator
+throughput, TextChunker throughput and peak RSS, against the shipped
+data/embeddings/faiss corpus and synthetic corpora of configurable size.
+Each scenario runs in its own process so its peak RSS is not polluted by the
+others. Results are written as JSON and can be compared against a baseline run:
+
+    python -m utils.benchmark --output bench.json
+    python -m utils.benchmark --sizes 10000 --compare bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_EMBEDDINGS_DIR = os.path.join(BASE_DIR, 'data', 'embeddings', 'faiss')
+DEFAULT_RAW_DIR = os.path.join(BASE_DIR, 'data', 'raw')
+
+
+def latency_summary(samples_ms: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (milliseconds) as mean and percentiles."""
+    if not samples_ms:
+        return {}
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'count': int(arr.size),
+        'mean_ms': float(arr.mean()),
+        'p50_ms': float(np.percentile(arr, 50)),
+        'p90_ms': float(np.percentile(arr, 90)),
+        'p95_ms': float(np.percentile(arr, 95)),
+        'p99_ms': float(np.percentile(arr, 99)),
+        'max_ms': float(arr.max()),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MiB (Linux reports KiB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def sample_queries(embeddings: np.ndarray, num_queries: int, seed: int = 0, projection=None) -> np.ndarray:
+    """
+    Build query vectors by perturbing random corpus vectors, so no model is needed.
+
+    When the corpus is stored projected, pass its projection: the queries are
+    mapped back to the encoder's dimension, which is what retrievers expect.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(embeddings), size=num_queries)
+    queries = np.asarray(embeddings[rows], dtype=np.float32)
+    queries = queries + rng.normal(0, 0.05, size=queries.shape).astype(np.float32)
+    if projection is not None:
+        return projection.invert(queries)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def write_synthetic_corpus(out_dir: str, num_vectors: int, dim: int = 384,
+                           seed: int = 0, block_size: int = 100_000) -> str:
+    """
+    Write a synthetic FAISS-ready directory (embeddings.npy + metadata.json).
+    Vectors are written block by block so 1M-vector corpora don't need to fit twice in RAM.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    embeddings_path = os.path.join(out_dir, 'embeddings.npy')
+    metadata_path = os.path.join(out_dir, 'metadata.json')
+    if os.path.exists(embeddings_path) and os.path.exists(metadata_path):
+        return out_dir
+    rng = np.random.default_rng(seed)
+    out = np.lib.format.open_memmap(embeddings_path, mode='w+', dtype=np.float32, shape=(num_vectors, dim))
+    for start in range(0, num_vectors, block_size):
+        block = rng.normal(size=(min(block_size, num_vectors - start), dim)).astype(np.float32)
+        out[start:start + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    out.flush()
+    del out
+    metadata = [{
+        'chunk_id': f"chunk_{i % 1000:03d}",
+        'category': f"synthetic-{i // 1000}",
+        'file_path': '',
+        'content': f"Synthetic chunk {i}",
+        'url': f"https://example.com/synthetic/{i // 1000}/",
+        'title': f"Synthetic page {i // 1000}",
+    } for i in range(num_vectors)]
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+    return out_dir
+
+
+def bench_retriever(embeddings_dir: str, num_queries: int = 200, top_k: int = 10,
+                    batch_sizes: List[int] = (8, 32), retriever_kwargs: Optional[Dict] = None) -> Dict:
+    """Measure FaissRetriever load time and search latency for one corpus."""
+    from utils.faiss_retriever import FaissRetriever
+
+    start = time.perf_counter()
+    retriever = FaissRetriever(embeddings_dir, **(retriever_kwargs or {}))
+    load_s = time.perf_counter() - start
+
+    queries = sample_queries(retriever.embeddings, num_queries, projection=retriever.projection)
+    # Warm up caches and FAISS thread pools before timing
+    retriever.search(queries[:1], top_k=top_k)
+
+    single = []
+    for q in queries:
+        start = time.perf_counter()
+        retriever.search(q[None, :], top_k=top_k)
+        single.append((time.perf_counter() - start) * 1000)
+
+    batched = {}
+    for batch_size in batch_sizes:
+        per_query = []
+        for start_row in range(0, num_queries, batch_size):
+            batch = queries[start_row:start_row + batch_size]
+            start = time.perf_counter()
+            retriever.search_batch(batch, top_k=top_k)
+            per_query.append((time.perf_counter() - start) * 1000 / len(batch))
+        summary = latency_summary(per_query)
+        summary['queries_per_s'] = 1000.0 / summary['mean_ms']
+        batched[str(batch_size)] = summary
+
+    single_summary = latency_summary(single)
+    single_summary['queries_per_s'] = 1000.0 / single_summary['mean_ms']
+    return {
+        'num_vectors': int(len(retriever.embeddings)),
+        'dim': int(retriever.embeddings.shape[1]),
+        'load_s': load_s,
+        'search_single': single_summary,
+        'search_batched': batched,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_prefilter(embeddings_dir: str, multipliers: List[int] = (2, 5, 10, 20), num_queries: int = 200,
+                    top_k: int = 10) -> Dict:
+    """Recall@top_k and latency of the binary prefilter against exact flat search."""
+    from utils.faiss_retriever import FaissRetriever
+
+    def timed_ids(retriever, queries):
+        samples, ids = [], []
+        for q in queries:
+            start = time.perf_counter()
+            results = retriever.search(q[None, :], top_k=top_k)
+            samples.append((time.perf_counter() - start) * 1000)
+            ids.append({(r['category'], r['chunk_id']) for r in results})
+        return latency_summary(samples), ids
+
+    exact = FaissRetriever(embeddings_dir)
+    queries = sample_queries(exact.embeddings, num_queries, projection=exact.projection)
+    exact.search(queries[:1], top_k=top_k)
+    exact_latency, exact_ids = timed_ids(exact, queries)
+    results = {'exact': exact_latency, 'multipliers': {}}
+    exact.close()
+
+    prefiltered = FaissRetriever(embeddings_dir, binary_prefilter=True)
+    results['code_bytes_per_vector'] = int(prefiltered.binary_index.code_size)
+    for multiplier in multipliers:
+        prefiltered.candidate_multiplier = multiplier
+        prefiltered.search(queries[:1], top_k=top_k)
+        latency, ids = timed_ids(prefiltered, queries)
+        recall = float(np.mean([len(a & b) / max(1, len(b)) for a, b in zip(ids, exact_ids)]))
+        results['multipliers'][str(multiplier)] = {'recall': recall, **latency}
+        print(f"  x{multiplier}: recall@{top_k} {recall:.3f}, p50 {latency['p50_ms']:.3f} ms "
+              f"(exact {exact_latency['p50_ms']:.3f} ms)")
+    return results
+
+
+def _load_raw_texts(raw_dir: str) -> List[str]:
+    texts = []
+    for filename in sorted(os.listdir(raw_dir)):
+        if filename.endswith('.txt'):
+            with open(os.path.join(raw_dir, filename), 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+    return texts
+
+
+def bench_chunker(raw_dir: str = DEFAULT_RAW_DIR, repeats: int = 3) -> Dict:
+    """Measure TextChunker throughput over the raw crawled pages."""
+    from utils.process_to_chunks import TextChunker
+
+    texts = _load_raw_texts(raw_dir)
+    chunker = TextChunker()
+    words = sum(len(t.split()) for t in texts)
+    timings = []
+    num_chunks = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        num_chunks = sum(len(chunker.chunk_text_with_overlap(t)) for t in texts)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        'documents': len(texts),
+        'words': words,
+        'chunks': num_chunks,
+        'best_s': best,
+        'documents_per_s': len(texts) / best,
+        'words_per_s': words / best,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_encoder(embeddings_dir: str = DEFAULT_EMBEDDINGS_DIR, num_chunks: int = 200,
+                  batch_size: int = 32) -> Dict:
+    """Measure EmbeddingGenerator model load time and chunks/sec, one-by-one and batched."""
+    from utils.generate_embeddings import EmbeddingGenerator
+
+    with open(os.path.join(embeddings_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+        texts = [m['content'] for m in json.load(f)][:num_chunks]
+
+    start = time.perf_counter()
+    generator = EmbeddingGenerator()
+    load_s = time.perf_counter() - start
+    generator.generate_embedding(texts[0])
+
+    start = time.perf_counter()
+    for text in texts:
+        generator.generate_embedding(text)
+    single_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator.model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    batched_s = time.perf_counter() - start
+    return {
+        'model': generator.model_name,
+        'chunks': len(texts),
+        'load_s': load_s,
+        'single_chunks_per_s': len(texts) / single_s,
+        'batched_chunks_per_s': len(texts) / batched_s,
+        'batch_size': batch_size,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_isolated(func, *args, **kwargs) -> Dict:
+    # A fresh spawned process per scenario keeps peak RSS figures independent
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(func, *args, **kwargs).result()
+
+
+def environment_info() -> Dict:
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+    }
+    try:
+        import faiss
+        info['faiss'] = faiss.__version__
+    except (ImportError, AttributeError):
+        pass
+    try:
+        info['git_commit'] = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def compare_results(baseline: Dict, current: Dict, tolerance: float = 0.10, prefix: str = '') -> List[str]:
+    """
+    Compare two benchmark result trees and list metrics that regressed by more than tolerance.
+    Keys ending in _ms, _s or _mb are lower-is-better; keys ending in _per_s are higher-is-better.
+    """
+    regressions = []
+    for key, value in current.items():
+        path = f"{prefix}{key}"
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict) and isinstance(old, dict):
+            regressions.extend(compare_results(old, value, tolerance, prefix=f"{path}."))
+            continue
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old == 0:
+            continue
+        change = (value - old) / old
+        if key.endswith('_per_s'):
+            if change < -tolerance:
+                regressions.append(f"{path}: {old:.3f} -> {value:.3f} ({change:+.1%})")
+        elif key.endswith(('_ms', '_s', '_mb')) and change > tolerance:
+            regressions.append(f"{path}: {old:.3f} -> {value:.3f} ({change:+.1%})")
+    return regressions
+
+
+def run_suite(args) -> Dict:
+    results = {'environment': environment_info(), 'corpora': {}}
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',') if b]
+
+    multipliers = [int(m) for m in args.prefilter_multipliers.split(',') if m]
+    results['prefilter'] = {}
+
+    print(f"Benchmarking shipped corpus: {args.embeddings_dir}")
+    results['corpora']['shipped'] = run_isolated(
+        bench_retriever, args.embeddings_dir, args.queries, args.top_k, batch_sizes)
+    if multipliers:
+        print("Benchmarking binary prefilter: shipped corpus")
+        results['prefilter']['shipped'] = run_isolated(
+            bench_prefilter, args.embeddings_dir, multipliers, args.queries, args.top_k)
+
+    if not args.skip_synthetic:
+        synthetic_root = args.synthetic_dir or tempfile.mkdtemp(prefix='vector_search_bench_')
+        for size in [int(s) for s in args.sizes.split(',') if s]:
+            corpus_dir = os.path.join(synthetic_root, f"synthetic_{size}")
+            print(f"Benchmarking synthetic corpus: {size} vectors")
+            write_synthetic_corpus(corpus_dir, size)
+            results['corpora'][f"synthetic_{size}"] = run_isolated(
+                bench_retriever, corpus_dir, args.queries, args.top_k, batch_sizes)
+            if multipliers:
+                print(f"Benchmarking binary prefilter: {size} vectors")
+                results['prefilter'][f"synthetic_{size}"] = run_isolated(
+                    bench_prefilter, corpus_dir, multipliers, args.queries, args.top_k)
+
+    print("Benchmarking TextChunker")
+    results['chunker'] = run_isolated(bench_chunker, args.raw_dir)
+
+    if not args.skip_encode:
+        print("Benchmarking EmbeddingGenerator")
+        results['encoder'] = run_isolated(bench_encoder, args.embeddings_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark load, encode, chunk and search performance.")
+    parser.add_argument('--embeddings-dir', default=DEFAULT_EMBEDDINGS_DIR)
+    parser.add_argument('--raw-dir', default=DEFAULT_RAW_DIR)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="Comma-separated synthetic corpus sizes")
+    parser.add_argument('--synthetic-dir', default=None, help="Where to cache synthetic corpora (default: temp dir)")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--batch-sizes', default='8,32')
+    parser.add_argument('--prefilter-multipliers', default='2,5,10,20',
+                        help="Binary prefilter candidate multipliers to compare against exact search ('' to skip)")
+    parser.add_argument('--skip-synthetic', action='store_true')
+    parser.add_argument('--skip-encode', action='store_true', help="Skip the model-dependent encoder benchmark")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON results to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"Results saved to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions beyond tolerance.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Near-duplicate chunk elimination between chunking and indexing.
+
+The crawled site repeats a lot of boilerplate (navigation, footers, newsletter
+archives, recipe templates) and chunk overlap adds more, so many chunks end up
+with almost identical text and embeddings. ChunkDeduplicator groups those
+chunks and keeps one vector per group, recording every member as a source.
+"""
+
+import os
+import json
+import zlib
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+# Mersenne prime used for the MinHash permutations. Shingle hashes are reduced
+# below it so a * x + b always fits in an unsigned 64-bit integer.
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+class ChunkDeduplicator:
+    """
+    Find and collapse near-duplicate chunks.
+
+    Two chunks are treated as duplicates when the MinHash estimate of the
+    Jaccard similarity of their word shingles reaches jaccard_threshold, or,
+    if cosine_threshold is set and embeddings are given, when the cosine
+    similarity of their embeddings reaches cosine_threshold. Every member of a
+    cluster is a duplicate of the cluster's representative itself, so chains
+    of slightly different chunks are not merged into one.
+    """
+
+    def __init__(self, jaccard_threshold: float = 0.9, cosine_threshold: Optional[float] = 0.98,
+                 num_perm: int = 128, bands: int = 32, shingle_size: int = 5, seed: int = 42,
+                 max_neighbors: int = 16, exact_limit: int = 20_000):
+        """
+        Initialize the deduplicator.
+
+        Args:
+            jaccard_threshold: Minimum estimated Jaccard similarity of shingle sets
+            cosine_threshold: Minimum embedding cosine similarity, or None to disable
+            num_perm: Number of MinHash permutations per signature
+            bands: Number of LSH bands (must divide num_perm)
+            shingle_size: Number of words per shingle
+            seed: Random seed for the hash permutations
+            max_neighbors: Nearest embeddings checked per chunk against cosine_threshold
+            exact_limit: Up to this many chunks the neighbor search is exact, above it HNSW
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.jaccard_threshold = jaccard_threshold
+        self.cosine_threshold = cosine_threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.max_neighbors = max_neighbors
+        self.exact_limit = exact_limit
+        rng = np.random.default_rng(seed)
+        self._perm_a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        if len(words) < self.shingle_size:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[i:i + self.shingle_size])
+                        for i in range(len(words) - self.shingle_size + 1)}
+        hashes = [zlib.crc32(s.encode('utf-8')) & _MERSENNE_PRIME for s in shingles]
+        return np.array(hashes, dtype=np.uint64)
+
+    def minhash_signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Compute a MinHash signature for every text.
+
+        Args:
+            texts: Chunk texts
+
+        Returns:
+            Array of shape (len(texts), num_perm)
+        """
+        signatures = np.full((len(texts), self.num_perm), _MERSENNE_PRIME, dtype=np.uint64)
+        for i, text in enumerate(texts):
+            hashes = self._shingle_hashes(text)
+            if hashes.size == 0:
+                continue
+            permuted = (np.outer(hashes, self._perm_a) + self._perm_b) % _MERSENNE_PRIME
+            signatures[i] = permuted.min(axis=0)
+        return signatures
+
+    def _lsh_buckets(self, signatures: np.ndarray) -> Tuple[List[List[int]], List[List[int]]]:
+        """LSH buckets with more than one member, and the buckets each chunk is in."""
+        rows = self.num_perm // self.bands
+        buckets = []
+        item_buckets = [[] for _ in range(len(signatures))]
+        for band in range(self.bands):
+            band_buckets: Dict[bytes, List[int]] = {}
+            band_slice = signatures[:, band * rows:(band + 1) * rows]
+            for i in range(len(signatures)):
+                band_buckets.setdefault(band_slice[i].tobytes(), []).append(i)
+            for members in band_buckets.values():
+                if len(members) > 1:
+                    for i in members:
+                        item_buckets[i].append(len(buckets))
+                    buckets.append(members)
+        return buckets, item_buckets
+
+    def _embedding_neighbors(self, embeddings: np.ndarray, block_size: int = 4096) -> List[set]:
+        """For every chunk, the chunks whose embeddings reach cosine_threshold among its nearest neighbors."""
+        import faiss
+
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        if len(vectors) <= self.exact_limit:
+            index = faiss.IndexFlatIP(vectors.shape[1])
+        else:
+            # Graph search: about n log n comparisons instead of all n^2 pairs
+            index = faiss.IndexHNSWFlat(vectors.shape[1], 16, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = max(64, 2 * self.max_neighbors)
+        index.add(vectors)
+        k = min(self.max_neighbors + 1, len(vectors))
+        neighbors = [set() for _ in range(len(vectors))]
+        for start in range(0, len(vectors), block_size):
+            sims, ids = index.search(vectors[start:start + block_size], k)
+            for row, col in zip(*np.nonzero(sims >= self.cosine_threshold)):
+                i, j = start + int(row), int(ids[row, col])
+                if j >= 0 and j != i:
+                    neighbors[i].add(j)
+                    neighbors[j].add(i)
+        return neighbors
+
+    def find_clusters(self, texts: List[str], embeddings: Optional[np.ndarray] = None) -> List[List[int]]:
+        """
+        Group chunk indices into clusters of near-duplicates.
+
+        Chunks are visited in order; the first one not yet in a cluster becomes
+        a representative and takes every later unclustered chunk that is a
+        near-duplicate of it.
+
+        Args:
+            texts: Chunk texts
+            embeddings: Optional embeddings aligned with texts
+
+        Returns:
+            List of clusters, each a sorted list of indices; the first index
+            of each cluster is its representative
+        """
+        signatures = self.minhash_signatures(texts)
+        buckets, item_buckets = self._lsh_buckets(signatures)
+        neighbors = None
+        if embeddings is not None and self.cosine_threshold is not None and len(texts):
+            neighbors = self._embedding_neighbors(embeddings)
+        clustered = np.zeros(len(texts), dtype=bool)
+        clusters = []
+        for rep in range(len(texts)):
+            if clustered[rep]:
+                continue
+            candidates = {j for b in item_buckets[rep] for j in buckets[b] if j > rep and not clustered[j]}
+            members = set()
+            if candidates:
+                candidates = np.fromiter(candidates, dtype=np.int64)
+                similarity = np.mean(signatures[candidates] == signatures[rep], axis=1)
+                members.update(candidates[similarity >= self.jaccard_threshold].tolist())
+            if neighbors is not None:
+                members.update(j for j in neighbors[rep] if j > rep and not clustered[j])
+            members = [rep] + sorted(members)
+            clustered[members] = True
+            clusters.append(members)
+        return clusters
+
+    def deduplicate(self, metadata: List[Dict], embeddings: np.ndarray) -> Tuple[List[Dict], np.ndarray, Dict]:
+        """
+        Collapse near-duplicate chunks into one vector each.
+
+        Args:
+            metadata: FAISS metadata entries (must contain 'content')
+            embeddings: Embeddings aligned with metadata
+
+        Returns:
+            Tuple of (kept metadata, kept embeddings, report). Every kept
+            entry gets a 'sources' list pointing at all chunks it stands for.
+        """
+        texts = [m.get('content', '') for m in metadata]
+        clusters = self.find_clusters(texts, embeddings)
+        kept_metadata = []
+        kept_rows = []
+        for members in clusters:
+            rep = members[0]
+            meta = {**metadata[rep]}
+            meta['sources'] = []
+            for i in members:
+                # Entries that were already deduplicated carry their own sources
+                meta['sources'].extend(metadata[i].get('sources') or [{
+                    'chunk_id': metadata[i].get('chunk_id'),
+                    'category': metadata[i].get('category'),
+                    'url': metadata[i].get('url'),
+                    'title': metadata[i].get('title'),
+                }])
+            kept_metadata.append(meta)
+            kept_rows.append(rep)
+        kept_embeddings = np.asarray(embeddings, dtype=np.float32)[kept_rows]
+        before, after = len(metadata), len(kept_metadata)
+        bytes_per_vector = kept_embeddings.shape[1] * 4 if kept_embeddings.ndim == 2 else 0
+        report = {
+            'chunks_before': before,
+            'chunks_after': after,
+            'chunks_removed': before - after,
+            'reduction_pct': round(100.0 * (before - after) / before, 2) if before else 0.0,
+            'duplicate_clusters': sum(1 for members in clusters if len(members) > 1),
+            'largest_cluster': max((len(members) for members in clusters), default=0),
+            'vector_bytes_saved': (before - after) * bytes_per_vector,
+        }
+        return kept_metadata, kept_embeddings, report
+
+
+def print_report(report: Dict):
+    """Print a dedup report in the same style as the pipeline scripts."""
+    print("\nDeduplication:")
+    print(f"  Chunks before: {report['chunks_before']}")
+    print(f"  Chunks after: {report['chunks_after']}")
+    print(f"  Removed: {report['chunks_removed']} ({report['reduction_pct']:.1f}%)")
+    print(f"  Duplicate clusters: {report['duplicate_clusters']} (largest: {report['largest_cluster']})")
+    print(f"  Vector memory saved: {report['vector_bytes_saved'] / 1024:.1f} KiB")
+
+
+def main():
+    """Deduplicate an existing FAISS-ready directory in place."""
+    faiss_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'embeddings', 'faiss')
+    embeddings = np.load(os.path.join(faiss_dir, 'embeddings.npy'))
+    with open(os.path.join(faiss_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    kept_metadata, kept_embeddings, report = ChunkDeduplicator().deduplicate(metadata, embeddings)
+    print_report(report)
+
+    np.save(os.path.join(faiss_dir, 'embeddings.npy'), kept_embeddings)
+    with open(os.path.join(faiss_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(kept_metadata, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(faiss_dir, 'dedup_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Pluggable query encoders.
+
+Two backends produce the same embeddings for the same model:
+
+- 'torch': the sentence-transformers model running on PyTorch (default)
+- 'onnx' / 'onnx-int8': the model's transformer exported to ONNX (optionally
+  with dynamic int8 quantization) and run with ONNX Runtime. Tokenization,
+  pooling and normalization are reproduced in NumPy, so serving needs neither
+  torch nor sentence-transformers once the model has been exported.
+
+The backend is picked with get_encoder(backend) or the VECTOR_SEARCH_ENCODER
+environment variable. Export and compare from the command line:
+
+    python -m utils.encoders --export --quantize
+    python -m utils.encoders --compare onnx onnx-int8
+"""
+
+import os
+import re
+import json
+import time
+import inspect
+import argparse
+import numpy as np
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_ONNX_DIR = os.path.join(BASE_DIR, 'models', 'onnx')
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+class SentenceTransformerEncoder:
+    """
+    Encoder backed by sentence-transformers on PyTorch.
+    """
+    backend = 'torch'
+
+    def __init__(self, model_name: str = DEFAULT_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=batch_size, show_progress_bar=False,
+                                       convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+def _model_dir(model_name: str, onnx_dir: str) -> str:
+    return os.path.join(onnx_dir, re.sub(r'[^a-zA-Z0-9_.-]', '-', model_name))
+
+
+def export_onnx(model_name: str = DEFAULT_MODEL, onnx_dir: str = DEFAULT_ONNX_DIR,
+                quantize: bool = False, opset: int = 17) -> str:
+    """
+    Export a sentence-transformers model to ONNX.
+
+    Writes model.onnx (and model.int8.onnx when quantize is set), the tokenizer
+    files and an encoder_config.json describing pooling and normalization.
+
+    Args:
+        model_name: sentence-transformers model name or path
+        onnx_dir: Root directory for exported models
+        quantize: Also write a dynamically int8-quantized copy
+        opset: ONNX opset version
+
+    Returns:
+        Directory containing the exported model
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = _model_dir(model_name, onnx_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    pooling = 'mean'
+    normalize = False
+    for module in st_model:
+        name = type(module).__name__
+        if name == 'Pooling' and getattr(module, 'pooling_mode_cls_token', False):
+            pooling = 'cls'
+        elif name == 'Normalize':
+            normalize = True
+
+    sample = tokenizer(["export sample"], padding=True, return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    model_path = os.path.join(out_dir, 'model.onnx')
+    # Everything is written under a temporary name and renamed into place, model last,
+    # so a concurrent OnnxEncoder never loads a partial export
+    tmp_model_path = f"{model_path}.tmp-{os.getpid()}"
+    # Newer torch defaults to the dynamo exporter; the TorchScript one handles dynamic_axes directly
+    export_kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(_Wrapper(transformer), tuple(sample[name] for name in input_names), tmp_model_path,
+                          input_names=input_names, output_names=['last_hidden_state'],
+                          dynamic_axes=dynamic_axes, opset_version=opset, **export_kwargs)
+    tokenizer.save_pretrained(out_dir)
+    config_path = os.path.join(out_dir, 'encoder_config.json')
+    with open(f"{config_path}.tmp-{os.getpid()}", 'w', encoding='utf-8') as f:
+        json.dump({'model_name': model_name, 'pooling': pooling, 'normalize': normalize,
+                   'max_seq_length': st_model.max_seq_length, 'input_names': input_names}, f, indent=2)
+    os.replace(f"{config_path}.tmp-{os.getpid()}", config_path)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(out_dir, 'model.int8.onnx')
+        quantize_dynamic(tmp_model_path, f"{int8_path}.tmp-{os.getpid()}", weight_type=QuantType.QInt8)
+        os.replace(f"{int8_path}.tmp-{os.getpid()}", int8_path)
+    os.replace(tmp_model_path, model_path)
+    print(f"Exported {model_name} to {out_dir}")
+    return out_dir
+
+
+class OnnxEncoder:
+    """
+    Encoder running an exported model with ONNX Runtime on CPU.
+    """
+    backend = 'onnx'
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, onnx_dir: str = DEFAULT_ONNX_DIR,
+                 quantized: bool = False, num_threads: Optional[int] = None):
+        """
+        Initialize the encoder from a model exported with export_onnx().
+
+        Args:
+            model_name: sentence-transformers model name or path
+            onnx_dir: Root directory for exported models
+            quantized: Use the dynamically int8-quantized model
+            num_threads: ONNX Runtime intra-op threads (default: runtime's choice)
+
+        Raises:
+            FileNotFoundError: If the model hasn't been exported
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantized = quantized
+        self.backend = 'onnx-int8' if quantized else 'onnx'
+        model_dir = _model_dir(model_name, onnx_dir)
+        model_file = 'model.int8.onnx' if quantized else 'model.onnx'
+        if not os.path.exists(os.path.join(model_dir, model_file)):
+            # Exporting needs torch and takes minutes; do it ahead of time, not in a serving process
+            raise FileNotFoundError(
+                f"No exported ONNX model at {os.path.join(model_dir, model_file)}. Export it with: "
+                f"python -m utils.encoders --export{' --quantize' if quantized else ''} --model {model_name}")
+        with open(os.path.join(model_dir, 'encoder_config.json'), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                            providers=['CPUExecutionProvider'])
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.config['max_seq_length'], return_tensors='np')
+        feeds = {name: tokens[name].astype(np.int64) for name in self.config['input_names']}
+        hidden = self.session.run(None, feeds)[0]
+        if self.config['pooling'] == 'cls':
+            pooled = hidden[:, 0]
+        else:
+            mask = tokens['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config['normalize']:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        batches = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+
+def get_encoder(backend: Optional[str] = None, model_name: str = DEFAULT_MODEL, **kwargs):
+    """
+    Create a query encoder.
+
+    Args:
+        backend: 'torch', 'onnx' or 'onnx-int8'; defaults to VECTOR_SEARCH_ENCODER or 'torch'
+        model_name: sentence-transformers model name or path
+    """
+    backend = backend or os.environ.get('VECTOR_SEARCH_ENCODER', 'torch')
+    if backend == 'torch':
+        return SentenceTransformerEncoder(model_name)
+    if backend in ('onnx', 'onnx-int8'):
+        return OnnxEncoder(model_name, quantized=backend == 'onnx-int8', **kwargs)
+    raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+
+
+def compare_encoders(reference, candidate, texts: List[str], batch_size: int = 32) -> Dict:
+    """
+    Check embedding parity and compare speed of two encoders.
+
+    Returns cosine similarity statistics between the two encoders' embeddings,
+    single-query latency percentiles and batched throughput for each.
+    """
+    from utils.benchmark import latency_summary
+
+    ref = reference.encode(texts, batch_size=batch_size)
+    cand = candidate.encode(texts, batch_size=batch_size)
+    cosine = np.sum(ref * cand, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+
+    def speed(encoder):
+        encoder.encode(texts[:1])
+        single = []
+        for text in texts:
+            start = time.perf_counter()
+            encoder.encode([text])
+            single.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        encoder.encode(texts, batch_size=batch_size)
+        return {'single': latency_summary(single),
+                'batched_texts_per_s': len(texts) / (time.perf_counter() - start)}
+
+    return {
+        'reference': reference.backend,
+        'candidate': candidate.backend,
+        'cosine_min': float(cosine.min()),
+        'cosine_mean': float(cosine.mean()),
+        'speed': {reference.backend: speed(reference), candidate.backend: speed(candidate)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and compare query encoder backends.")
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--export', action='store_true', help="Export the model to ONNX")
+    parser.add_argument('--quantize', action='store_true', help="Also write an int8-quantized model")
+    parser.add_argument('--compare', nargs='*', default=None, metavar='BACKEND',
+                        help="Backends to compare against torch (default: onnx onnx-int8)")
+    parser.add_argument('--queries', default=os.path.join(BASE_DIR, 'data', 'eval', 'queries.json'))
+    parser.add_argument('--output', default=None, help="Write JSON comparison to this file")
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx(args.model, quantize=args.quantize)
+    if args.compare is None:
+        return
+
+    with open(args.queries, 'r', encoding='utf-8') as f:
+        texts = [q['query'] for q in json.load(f)]
+    # Pad the query set with chunk-sized texts so batched throughput is meaningful
+    with open(os.path.join(BASE_DIR, 'data', 'embeddings', 'faiss', 'metadata.json'), 'r', encoding='utf-8') as f:
+        texts += [m['content'] for m in json.load(f)[:54]]
+
+    reference = get_encoder('torch', args.model)
+    reports = []
+    for backend in args.compare or ['onnx', 'onnx-int8']:
+        report = compare_encoders(reference, get_encoder(backend, args.model), texts)
+        reports.append(report)
+        ref_speed, cand_speed = report['speed'][report['reference']], report['speed'][report['candidate']]
+        print(f"\n{report['candidate']} vs {report['reference']}:")
+        print(f"  cosine similarity: min {report['cosine_min']:.5f}, mean {report['cosine_mean']:.5f}")
+        print(f"  single query p50: {ref_speed['single']['p50_ms']:.2f} ms -> {cand_speed['single']['p50_ms']:.2f} ms")
+        print(f"  single query p95: {ref_speed['single']['p95_ms']:.2f} ms -> {cand_speed['single']['p95_ms']:.2f} ms")
+        print(f"  batched throughput: {ref_speed['batched_texts_per_s']:.1f} -> "
+              f"{cand_speed['batched_texts_per_s']:.1f} texts/s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Retrieval quality and latency evaluation.
+
+Runs a labeled query set (query -> relevant page URLs, seeded from the app's
+suggested searches in data/eval/queries.json) through one or more retriever
+configurations and reports recall@k, MRR and nDCG@k together with p50/p95
+search latency and peak RSS, so index and model changes can be judged on both
+quality and speed:
+
+    python -m utils.evaluate
+    python -m utils.evaluate --configs my_configs.json --output eval.json
+
+A configs file is a JSON list of objects with a "name", an optional
+"embeddings_dir", optional "retriever_kwargs" and an optional "class" (dotted
+path, defaults to utils.faiss_retriever.FaissRetriever).
+
+--dims sweeps the stored vector size: for each dimension a PCA-projected copy
+of the index is written to a temporary directory and evaluated alongside the
+configurations (see utils.projection):
+
+    python -m utils.evaluate --dims 384,256,128,64,32
+
+A config with a "rerank" object (CrossEncoderReranker arguments) reranks the
+vector hits with a cross-encoder; --rerank adds such a copy of every
+configuration and prints the ranking gain against the latency it adds (see
+utils.reranker):
+
+    python -m utils.evaluate --rerank --rerank-budget-ms 300
+"""
+
+import os
+import json
+import time
+import tempfile
+import argparse
+import importlib
+import numpy as np
+from typing import Dict, List, Optional
+
+from utils.benchmark import latency_summary, peak_rss_mb, run_isolated
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUERIES_PATH = os.path.join(BASE_DIR, 'data', 'eval', 'queries.json')
+DEFAULT_EMBEDDINGS_DIR = os.path.join(BASE_DIR, 'data', 'embeddings', 'faiss')
+DEFAULT_RETRIEVER_CLASS = 'utils.faiss_retriever.FaissRetriever'
+
+
+def normalize_url(url: Optional[str]) -> str:
+    if not url:
+        return ''
+    return url.strip().lower().rstrip('/')
+
+
+def load_queries(path: str = DEFAULT_QUERIES_PATH) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def encode_queries(queries: List[str], cache_path: Optional[str] = None,
+                   model_name: str = 'all-MiniLM-L6-v2', backend: Optional[str] = None) -> np.ndarray:
+    """
+    Encode the query texts once, optionally caching them in a .npy file so
+    configurations can be evaluated without loading the model again.
+    """
+    if cache_path and os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if len(cached) == len(queries):
+            return cached
+    from utils.encoders import get_encoder
+    embeddings = get_encoder(backend, model_name).encode(queries)
+    if cache_path:
+        np.save(cache_path, embeddings)
+    return embeddings
+
+
+def ranked_urls(results: List[Dict]) -> List[str]:
+    """
+    Turn chunk results into a ranked list of distinct page URLs.
+    A deduplicated chunk contributes the URLs of all of its sources at its rank.
+    """
+    seen = set()
+    urls = []
+    for result in results:
+        sources = result.get('sources') or [result]
+        for source in sources:
+            url = normalize_url(source.get('url'))
+            if url and url not in seen:
+                seen.add(url)
+                urls.append(url)
+    return urls
+
+
+def recall_at_k(ranked: List[str], relevant: set, k: int) -> float:
+    if not relevant:
+        return 0.0
+    return len(set(ranked[:k]) & relevant) / len(relevant)
+
+
+def reciprocal_rank(ranked: List[str], relevant: set) -> float:
+    for rank, url in enumerate(ranked, start=1):
+        if url in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: List[str], relevant: set, k: int) -> float:
+    dcg = sum(1.0 / np.log2(rank + 1) for rank, url in enumerate(ranked[:k], start=1) if url in relevant)
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def _load_class(dotted_path: str):
+    module_name, class_name = dotted_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def evaluate_config(config: Dict, queries: List[Dict], query_embeddings: np.ndarray,
+                    top_k: int = 10, ks: List[int] = (1, 5, 10), repeats: int = 5) -> Dict:
+    """Evaluate one retriever configuration on the labeled queries."""
+    retriever_class = _load_class(config.get('class', DEFAULT_RETRIEVER_CLASS))
+    start = time.perf_counter()
+    retriever = retriever_class(config.get('embeddings_dir', DEFAULT_EMBEDDINGS_DIR),
+                                **config.get('retriever_kwargs', {}))
+    load_s = time.perf_counter() - start
+    embeddings = getattr(retriever, 'embeddings', None)
+    reranker = None
+    search_k = top_k
+    if config.get('rerank') is not None:
+        from utils.reranker import CrossEncoderReranker
+        reranker = CrossEncoderReranker(**config['rerank'])
+        reranker.warmup()
+        search_k = max(top_k, reranker.top_n)
+
+    per_query = []
+    latencies = []
+    rerank_latencies = []
+    for item, embedding in zip(queries, query_embeddings):
+        relevant = {normalize_url(u) for u in item['relevant_urls']}
+        results = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = retriever.search(embedding[None, :], top_k=search_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if reranker is not None:
+            # Timed once per query: repeats would be served from the score cache
+            start = time.perf_counter()
+            results = reranker.rerank(item['query'], results)
+            rerank_latencies.append((time.perf_counter() - start) * 1000)
+        ranked = ranked_urls(results[:top_k])
+        row = {'query': item['query'], 'mrr': reciprocal_rank(ranked, relevant)}
+        for k in ks:
+            row[f'recall@{k}'] = recall_at_k(ranked, relevant, k)
+            row[f'ndcg@{k}'] = ndcg_at_k(ranked, relevant, k)
+        per_query.append(row)
+
+    metric_names = [name for name in per_query[0] if name != 'query'] if per_query else []
+    summary = {name: float(np.mean([row[name] for row in per_query])) for name in metric_names}
+    close = getattr(retriever, 'close', None)
+    if close:
+        close()
+    if reranker is not None:
+        reranker.close()
+    return {
+        'name': config.get('name', 'default'),
+        'load_s': load_s,
+        'quality': summary,
+        'latency': latency_summary(latencies),
+        'rerank_latency': latency_summary(rerank_latencies),
+        'peak_rss_mb': peak_rss_mb(),
+        'vectors_mb': embeddings.nbytes / 2**20 if embeddings is not None else None,
+        'per_query': per_query,
+    }
+
+
+def print_table(reports: List[Dict]):
+    header = (f"{'config':<24}{'recall@10':>10}{'mrr':>8}{'ndcg@10':>9}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'rss MB':>9}{'vec MB':>9}")
+    print(header)
+    print('-' * len(header))
+    for r in reports:
+        q, lat = r['quality'], r['latency']
+        print(f"{r['name']:<24}{q.get('recall@10', 0):>10.3f}{q.get('mrr', 0):>8.3f}{q.get('ndcg@10', 0):>9.3f}"
+              f"{lat.get('p50_ms', 0):>9.3f}{lat.get('p95_ms', 0):>9.3f}{r['peak_rss_mb']:>9.1f}"
+              f"{r.get('vectors_mb') or 0:>9.2f}")
+
+
+def print_rerank_gains(reports: List[Dict]):
+    """For each '<name>+rerank' report, the quality gained over '<name>' and the latency added."""
+    by_name = {r['name']: r for r in reports}
+    for r in reports:
+        base = by_name.get(r['name'][:-len('+rerank')]) if r['name'].endswith('+rerank') else None
+        if base is None or not r.get('rerank_latency'):
+            continue
+        gains = ', '.join(f"{name} {r['quality'][name] - base['quality'][name]:+.3f}"
+                          for name in ('recall@10', 'mrr', 'ndcg@10') if name in r['quality'])
+        added = r['rerank_latency']
+        print(f"{r['name']}: {gains}; adds p50 {added['p50_ms']:.1f} ms, p95 {added['p95_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency.")
+    parser.add_argument('--queries', default=DEFAULT_QUERIES_PATH, help="Labeled query file")
+    parser.add_argument('--configs', default=None, help="JSON list of retriever configurations")
+    parser.add_argument('--query-embeddings', default=None, help="Cache file for encoded queries (.npy)")
+    parser.add_argument('--encoder', default=None, help="Query encoder backend: torch, onnx or onnx-int8")
+    parser.add_argument('--dims', default=None,
+                        help="Comma-separated dimensions for a PCA recall-vs-dimension sweep")
+    parser.add_argument('--projection', choices=['pca', 'truncate'], default='pca')
+    parser.add_argument('--embeddings-dir', default=DEFAULT_EMBEDDINGS_DIR, help="Full-size index for --dims")
+    parser.add_argument('--rerank', action='store_true', help="Also evaluate each config with cross-encoder reranking")
+    parser.add_argument('--rerank-model', default=None)
+    parser.add_argument('--rerank-top-n', type=int, default=20)
+    parser.add_argument('--rerank-budget-ms', type=float, default=200.0)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5, help="Timed searches per query")
+    parser.add_argument('--output', default=None, help="Write JSON report to this file")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    query_embeddings = encode_queries([q['query'] for q in queries], args.query_embeddings, backend=args.encoder)
+    if args.configs:
+        with open(args.configs, 'r', encoding='utf-8') as f:
+            configs = json.load(f)
+    else:
+        # FaissRetriever searches by cosine similarity unless told otherwise
+        configs = [{'name': 'flat-cosine'}, {'name': 'flat-l2', 'retriever_kwargs': {'metric': 'l2'}}]
+    if args.dims:
+        from utils.projection import project_index
+        sweep_dir = tempfile.mkdtemp(prefix='vector_search_dims_')
+        for dim in [int(d) for d in args.dims.split(',') if d]:
+            out_dir = os.path.join(sweep_dir, f"{args.projection}_{dim}")
+            project_index(args.embeddings_dir, out_dir, dim, args.projection)
+            configs.append({'name': f"{args.projection}-{dim}", 'embeddings_dir': out_dir})
+    if args.rerank:
+        rerank = {'top_n': args.rerank_top_n, 'budget_ms': args.rerank_budget_ms}
+        if args.rerank_model:
+            rerank['model_name'] = args.rerank_model
+        configs += [{**c, 'name': f"{c.get('name', 'default')}+rerank", 'rerank': rerank}
+                    for c in configs if c.get('rerank') is None]
+
+    reports = []
+    for config in configs:
+        print(f"Evaluating {config.get('name', 'default')}...")
+        # Each configuration runs in its own process so peak RSS is per configuration
+        reports.append(run_isolated(evaluate_config, config, queries, query_embeddings,
+                                    args.top_k, repeats=args.repeats))
+    print()
+    print_table(reports)
+    if any(r.get('rerank_latency') for r in reports):
+        print()
+        print_rerank_gains(reports)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nReport saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,437 @@
+import os
 import numpy as np
 import faiss
 import json
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Optional
+from utils.metrics import get_metrics
+from utils.projection import load_projection, normalize_rows
+from utils.snippets import annotate_best_sentences, load_sentence_vectors
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer use only
+    fcntl = None
+
+WAL_FILE = 'wal.jsonl'
+
+
+def binary_codes(vectors: np.ndarray) -> np.ndarray:
+    """Pack the sign bit of each dimension into uint8 codes for Hamming search."""
+    return np.packbits(np.atleast_2d(vectors) > 0, axis=1)
+
+
+def chunk_key(meta: Dict) -> str:
+    """Stable id of a chunk: '<category>/<chunk_id>', e.g. 'blog-festive-feasting/chunk_002'."""
+    return meta.get('chunk_key') or f"{meta.get('category')}/{meta.get('chunk_id')}"
+
+
+class _ReadWriteLock:
+    """Many concurrent searches, or one writer. Waiting writers go first, so a
+    steady stream of searches cannot starve updates."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 
 class FaissRetriever:
-    def __init__(self, embeddings_dir: str = 'data/embeddings/faiss'):
+    def __init__(self, embeddings_dir: str = 'data/embeddings/faiss', compact_ratio: float = 0.2,
+                 binary_prefilter: bool = False, candidate_multiplier: int = 10,
+                 metric: str = 'cosine', min_score: Optional[float] = None):
+        """
+        Load the index in embeddings_dir and replay its write-ahead log.
+
+        Args:
+            embeddings_dir: Directory with embeddings.npy and metadata.json
+            compact_ratio: Compact once this fraction of rows are tombstones
+            binary_prefilter: Search in two stages: a Hamming scan over sign-bit codes
+                picks top_k * candidate_multiplier candidates, which are then rescored
+                exactly against the float vectors
+            candidate_multiplier: Candidate pool size per requested result
+            metric: 'cosine' (vectors normalized, inner-product index, results carry a
+                'score' in [-1, 1]) or 'l2' (squared Euclidean distance)
+            min_score: Default similarity cutoff for cosine searches
+        """
+        if metric not in ('cosine', 'l2'):
+            raise ValueError(f"Unknown metric: {metric}")
         self.embeddings_dir = Path(embeddings_dir)
+        self.metric = metric
+        self.min_score = min_score
+        self.compact_ratio = compact_ratio
+        self.binary_prefilter = binary_prefilter
+        self.candidate_multiplier = candidate_multiplier
+        self.binary_index = None
         self.embeddings = None
         self.metadata = None
         self.index = None
+        self._rw = _ReadWriteLock()
+        self._write_lock = threading.RLock()
+        self._file_lock_depth = 0
         self._load_index()
 
+    def _base_identity(self):
+        # checkpoint() replaces metadata.json last, so a new inode or mtime means new base files
+        stat = os.stat(self.embeddings_dir / 'metadata.json')
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
     def _load_index(self):
-        embeddings_path = self.embeddings_dir / 'embeddings.npy'
-        metadata_path = self.embeddings_dir / 'metadata.json'
-        self.embeddings = np.load(embeddings_path)
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            self.metadata = json.load(f)
-        self.index = faiss.IndexFlatL2(self.embeddings.shape[1])
-        self.index.add(self.embeddings)
-
-    def search(self, query_embedding: np.ndarray, top_k: int = 10) -> List[Dict]:
+        """Load the base files and swap them in atomically with respect to searches, then replay the log."""
+        with self._write_lock, self._wal_file_lock():
+            # The file lock keeps a concurrent checkpoint() from replacing the files mid-read
+            base_identity = self._base_identity()
+            embeddings = np.load(self.embeddings_dir / 'embeddings.npy')
+            with open(self.embeddings_dir / 'metadata.json', 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            # Set when the stored vectors were reduced; queries and upserts are projected the same way
+            projection = load_projection(self.embeddings_dir)
+            # Per-sentence vectors for picking each hit's best sentence, when the build saved them
+            sentence_vectors = load_sentence_vectors(self.embeddings_dir, embeddings.shape[1])
+            state = self._build_rows(np.ascontiguousarray(embeddings, dtype=np.float32), metadata,
+                                     [chunk_key(m) for m in metadata])
+            with self._rw.write():
+                self.projection = projection
+                self.sentence_vectors = sentence_vectors
+                self.__dict__.update(state)
+            self._base_id = base_identity
+            self._wal_offset = 0
+            self._wal_inode = None
+            self.sync_wal()
+
+    def _build_rows(self, vectors: np.ndarray, metadata: List[Dict], keys: List[str]) -> Dict:
+        """Index and lookup tables for the given rows, ready to be swapped in by _set_rows()."""
+        # Vectors live in a buffer with spare capacity so upserts append in amortized O(1)
+        if self.metric == 'cosine':
+            vectors = normalize_rows(vectors)
+        index = (faiss.IndexFlatIP if self.metric == 'cosine' else faiss.IndexFlatL2)(vectors.shape[1])
+        if len(vectors):
+            index.add(vectors)
+        binary_index = None
+        if self.binary_prefilter:
+            # One bit per dimension: 384 floats (1536 bytes) become 48 bytes
+            binary_index = faiss.IndexBinaryFlat(vectors.shape[1])
+            if len(vectors):
+                binary_index.add(binary_codes(vectors))
+        return {
+            '_vectors': vectors,
+            '_size': len(vectors),
+            'embeddings': vectors[:len(vectors)],
+            'metadata': metadata,
+            '_row_keys': keys,
+            '_key_to_row': {key: row for row, key in enumerate(keys)},
+            '_deleted': set(),
+            '_params': None,
+            'index': index,
+            'binary_index': binary_index,
+        }
+
+    def _set_rows(self, vectors: np.ndarray, metadata: List[Dict], keys: List[str]):
+        # Callers hold self._rw.write()
+        self.__dict__.update(self._build_rows(vectors, metadata, keys))
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 10,
+               min_score: Optional[float] = None) -> List[Dict]:
+        return self.search_batch(query_embedding, top_k, min_score)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     min_score: Optional[float] = None) -> List[List[Dict]]:
+        """
+        Search for the top_k nearest chunks of each query.
+
+        With the cosine metric, results below min_score (default: self.min_score)
+        are dropped, so fewer than top_k may be returned.
+        """
         if self.index is None or self.metadata is None:
             raise ValueError("FAISS index or metadata not loaded.")
-        D, I = self.index.search(query_embedding.astype(np.float32), top_k)
-        results = []
-        for idx, dist in zip(I[0], D[0]):
-            meta = self.metadata[idx]
-            meta['distance'] = float(dist)
-            results.append(meta)
-        return results 
\ No newline at end of file
+        metrics = get_metrics()
+        queries = np.atleast_2d(query_embeddings).astype(np.float32)
+        if self.projection is not None:
+            queries = self.projection.apply(queries)
+        cosine = self.metric == 'cosine'
+        if cosine:
+            queries = normalize_rows(queries)
+        min_score = self.min_score if min_score is None else min_score
+        threshold = min_score if cosine and min_score is not None else None
+        with self._rw.read():
+            k = min(top_k, self.index.ntotal - len(self._deleted))
+            if k <= 0:
+                return [[] for _ in queries]
+            params = self._search_params()
+            if self.binary_index is not None:
+                D, I = self._prefilter_search(queries, k, params)
+            else:
+                with metrics.span('faiss_search'):
+                    D, I = self.index.search(queries, k, params=params)
+            with metrics.span('metadata'):
+                batch_results = []
+                for query, ids, dists in zip(queries, I, D):
+                    results = []
+                    for idx, dist in zip(ids, dists):
+                        # FAISS pads with -1 when top_k exceeds the number of live vectors
+                        if idx < 0:
+                            continue
+                        if threshold is not None and dist < threshold:
+                            # Scores are sorted, so nothing after this one qualifies either
+                            break
+                        if cosine:
+                            results.append({**self.metadata[idx], 'score': float(dist), 'distance': 1.0 - float(dist)})
+                        else:
+                            results.append({**self.metadata[idx], 'distance': float(dist)})
+                    annotate_best_sentences(results, query, self.sentence_vectors)
+                    batch_results.append(results)
+        return batch_results
+
+    def _search_params(self):
+        # Callers hold self._rw.read(). Tombstoned rows are excluded inside FAISS
+        # rather than over-fetched and dropped afterwards. The selector is rebuilt
+        # only after a delete; the inner selector is kept alongside the parameters
+        # because IDSelectorNot does not own it.
+        import faiss
+
+        if not self._deleted:
+            return None
+        cached = self._params
+        if cached is None:
+            inner = faiss.IDSelectorBatch(np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)))
+            cached = self._params = (faiss.SearchParameters(sel=faiss.IDSelectorNot(inner)), inner)
+        return cached[0]
+
+    def _prefilter_search(self, queries: np.ndarray, k: int, params=None):
+        metrics = get_metrics()
+        num_candidates = min(k * self.candidate_multiplier, self.binary_index.ntotal - len(self._deleted))
+        with metrics.span('binary_search'):
+            _, candidates = self.binary_index.search(binary_codes(queries), num_candidates, params=params)
+        with metrics.span('rescore'):
+            # Exact scores against the float vectors of the candidates only, in the
+            # same convention as self.index.search: similarity for cosine, squared L2 otherwise
+            valid = candidates >= 0
+            vectors = self._vectors[np.where(valid, candidates, 0)]
+            dots = np.einsum('bkd,bd->bk', vectors, queries)
+            if self.metric == 'cosine':
+                keys = -dots
+            else:
+                keys = np.einsum('bkd,bkd->bk', vectors, vectors) - 2 * dots
+                keys += np.einsum('bd,bd->b', queries, queries)[:, None]
+            keys[~valid] = np.inf
+            order = np.argsort(keys, axis=1)[:, :k]
+            D = np.take_along_axis(keys, order, axis=1)
+            I = np.where(np.isfinite(D), np.take_along_axis(candidates, order, axis=1), -1)
+        return (-D if self.metric == 'cosine' else D), I
+
+    # Live updates
+    #
+    # Every change is appended to wal.jsonl before it is applied, keyed by the
+    # stable chunk key, so replaying the log is idempotent. Upserts append a new
+    # row and tombstone the old one; deletes only tombstone. Tombstoned rows are
+    # skipped at search time and dropped by compact(). checkpoint() folds the
+    # log into embeddings.npy/metadata.json and starts a new log file; other
+    # processes notice the new file and reload.
+
+    def keys(self) -> List[str]:
+        with self._rw.read():
+            return list(self._key_to_row)
+
+    def upsert(self, key: str, embedding: np.ndarray, metadata: Dict):
+        """Insert or replace the chunk with the given stable key."""
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        # The log holds the encoder's vector; _apply() projects it, exactly once
+        expected = self.projection.input_dim if self.projection is not None else self.index.d
+        if embedding.shape[0] != expected:
+            raise ValueError(f"Embedding has {embedding.shape[0]} dims, index expects {expected}")
+        self._log({'op': 'upsert', 'key': key, 'embedding': embedding.tolist(), 'metadata': metadata})
+
+    def delete(self, key: str) -> bool:
+        """Delete the chunk with the given stable key. Returns False if it doesn't exist."""
+        with self._write_lock:
+            if key not in self._key_to_row:
+                return False
+            self._log({'op': 'delete', 'key': key})
+            return True
+
+    @contextmanager
+    def _wal_file_lock(self):
+        # Callers hold self._write_lock; nested use must not flock a second descriptor
+        if fcntl is None or self._file_lock_depth:
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+            return
+        try:
+            lock_file = open(self.embeddings_dir / f"{WAL_FILE}.lock", 'a')
+        except OSError:
+            # Read-only index directory: nothing here can write, so there is nothing to exclude
+            lock_file = None
+        try:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+        finally:
+            if lock_file is not None:
+                lock_file.close()  # releases the flock
+
+    def _log(self, entry: Dict):
+        with self._write_lock, self._wal_file_lock():
+            # Apply other writers' entries first so ours lands after them
+            self.sync_wal()
+            wal_path = self.embeddings_dir / WAL_FILE
+            with open(wal_path, 'ab') as f:
+                f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+                offset = f.tell()
+            with self._rw.write():
+                self._apply(entry)
+            self._wal_offset = offset
+            self._wal_inode = os.stat(wal_path).st_ino
+            self._maybe_compact()
+
+    def sync_wal(self) -> int:
+        """Apply log entries written since the last sync (e.g. by another process). Returns the count."""
+        wal_path = self.embeddings_dir / WAL_FILE
+        with self._write_lock:
+            try:
+                base_changed = self._base_identity() != self._base_id
+            except FileNotFoundError:
+                base_changed = False
+            try:
+                stat = os.stat(wal_path)
+            except FileNotFoundError:
+                stat = None
+            if base_changed or (stat is not None and self._wal_inode is not None
+                                and stat.st_ino != self._wal_inode):
+                # Another process checkpointed: the base files changed, start over
+                self._load_index()
+                return 0
+            if stat is None:
+                return 0
+            self._wal_inode = stat.st_ino
+            if stat.st_size <= self._wal_offset:
+                return 0
+            with open(wal_path, 'rb') as f:
+                f.seek(self._wal_offset)
+                data = f.read()
+            # Ignore a trailing partial line from a writer that is still appending
+            end = data.rfind(b'\n') + 1
+            entries = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+            if entries:
+                with self._rw.write():
+                    for entry in entries:
+                        self._apply(entry)
+            self._wal_offset += end
+            self._maybe_compact()
+            return len(entries)
+
+    def _apply(self, entry: Dict):
+        key = entry['key']
+        old_row = self._key_to_row.pop(key, None)
+        if old_row is not None:
+            self._deleted.add(old_row)
+            self._params = None
+        if entry['op'] != 'upsert':
+            return
+        vector = np.asarray(entry['embedding'], dtype=np.float32)[None, :]
+        if self.projection is not None:
+            # Logged vectors are unprojected, including logs copied from an unprojected directory
+            vector = self.projection.apply(vector)
+        if self.metric == 'cosine':
+            vector = normalize_rows(vector)
+        if self._size == len(self._vectors):
+            grown = np.empty((max(2 * len(self._vectors), 1024), self._vectors.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size] = vector
+        self.index.add(vector)
+        if self.binary_index is not None:
+            self.binary_index.add(binary_codes(vector))
+        self.metadata.append(entry['metadata'])
+        self._row_keys.append(key)
+        self._key_to_row[key] = self._size
+        self._size += 1
+        self.embeddings = self._vectors[:self._size]
+
+    def _maybe_compact(self):
+        if self._size and len(self._deleted) > self.compact_ratio * self._size:
+            self.compact()
+
+    def compact(self):
+        """Drop tombstoned rows and rebuild the index."""
+        with self._write_lock, self._rw.write():
+            if not self._deleted:
+                return
+            live = [row for row in range(self._size) if row not in self._deleted]
+            self._set_rows(np.ascontiguousarray(self._vectors[live]),
+                           [self.metadata[row] for row in live],
+                           [self._row_keys[row] for row in live])
+
+    def checkpoint(self):
+        """Fold the write-ahead log into embeddings.npy and metadata.json and start a new log."""
+        with self._write_lock, self._wal_file_lock():
+            self.sync_wal()
+            self.compact()
+            metadata = [{**meta, 'chunk_key': key} if chunk_key(meta) != key else meta
+                        for meta, key in zip(self.metadata, self._row_keys)]
+            tmp_embeddings = self.embeddings_dir / 'embeddings.npy.tmp'
+            tmp_metadata = self.embeddings_dir / 'metadata.json.tmp'
+            with open(tmp_embeddings, 'wb') as f:
+                np.save(f, self.embeddings)
+            with open(tmp_metadata, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_embeddings, self.embeddings_dir / 'embeddings.npy')
+            os.replace(tmp_metadata, self.embeddings_dir / 'metadata.json')
+            # A new file (new inode) tells other processes to reload the base files.
+            # Replaying an old log on top of the new base is harmless: entries are idempotent.
+            tmp_wal = self.embeddings_dir / f"{WAL_FILE}.tmp"
+            open(tmp_wal, 'wb').close()
+            os.replace(tmp_wal, self.embeddings_dir / WAL_FILE)
+            self._wal_offset = 0
+            self._wal_inode = os.stat(self.embeddings_dir / WAL_FILE).st_ino
+            self._base_id = self._base_identity()
+
+    def close(self):
+        # Drop the index and arrays so their memory is freed even if a caller still holds the retriever
+        self.index = None
+        self.binary_index = None
+        self.embeddings = None
+        self.metadata = None
+        self._vectors = None
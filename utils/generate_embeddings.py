@@ -1,9 +1,15 @@
 import os
 import json
-import torch
+import argparse
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
+from typing import Optional
+from utils.dedup import ChunkDeduplicator, print_report
+from utils.index_versions import publish_version
+from utils.profiling import parse_modes, profile, profiling_modes
+from utils.process_to_chunks import split_sentences
+from utils.snippets import SENTENCE_VECTORS_FILE
+from utils.projection import PROJECTION_FILE, normalize_rows, train_projection
 
 class EmbeddingGenerator:
     """
@@ -17,6 +23,8 @@ class EmbeddingGenerator:
         Args:
             model_name: Name of the pre-trained model from sentence-transformers
         """
+        # Imported here so importing this module doesn't pull in torch
+        from sentence_transformers import SentenceTransformer
         self.model_name = model_name
         self.model = SentenceTransformer(model_name)
         print(f"Loaded model: {model_name}")
@@ -31,6 +39,7 @@ class EmbeddingGenerator:
         Returns:
             Numpy array containing the embedding
         """
+        import torch
         with torch.no_grad():
             embedding = self.model.encode(text, show_progress_bar=False)
         # Handle both Tensor and numpy array return types
@@ -38,10 +47,18 @@ class EmbeddingGenerator:
             return embedding.cpu().numpy()
         return embedding  # Already a numpy array
     
-    def process_chunks_directory(self, chunks_dir: str, output_dir: str):
+    def process_chunks_directory(self, chunks_dir: str, output_dir: str,
+                                 deduplicator: Optional[ChunkDeduplicator] = None,
+                                 projection_dim: Optional[int] = None, projection_method: str = 'pca',
+                                 sentence_embeddings: bool = False):
         """
         Process all chunks in a directory structure and generate embeddings.
-        For each chunk, loads url and title from the chunk's parent metadata (from chunking step).
+        For each chunk, loads url, title and sentence offsets from the chunk's parent metadata (from chunking step).
+        If a deduplicator is given, near-duplicate chunks are collapsed before the FAISS data is saved.
+        If projection_dim is given, the FAISS vectors are reduced to that many dimensions and the
+        projection is saved with them (see utils.projection).
+        If sentence_embeddings is set, every sentence is embedded too and saved as float16 in a
+        side array, so searches can pick each hit's best sentence (see utils.snippets).
         """
         # Create embeddings directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
@@ -56,7 +73,7 @@ class EmbeddingGenerator:
             with open(chunking_metadata_path, 'r', encoding='utf-8') as f:
                 chunking_metadata = json.load(f)
         
-        def get_url_title(chunk_file_path):
+        def get_chunk_metadata(chunk_file_path):
             # Extract category and chunk filename from the absolute path
             path_parts = chunk_file_path.replace('\\', '/').split('/')
             chunk_filename = path_parts[-1]  # e.g., "chunk_000.txt"
@@ -74,9 +91,9 @@ class EmbeddingGenerator:
                 
                 if (metadata_chunk_file == expected_chunk_file or 
                     metadata_normalized == expected_chunk_file_normalized):
-                    return m.get('url'), m.get('title')
+                    return m
             
-            return None, None
+            return {}
         
         # Walk through the chunks directory
         for root, dirs, files in os.walk(chunks_dir):
@@ -113,8 +130,13 @@ class EmbeddingGenerator:
                 # Generate embedding
                 embedding = self.generate_embedding(content)
                 
-                # Get url and title from chunking metadata
-                url, title = get_url_title(file_path)
+                # Get url, title and sentence offsets from chunking metadata
+                chunk_metadata = get_chunk_metadata(file_path)
+                url, title = chunk_metadata.get('url'), chunk_metadata.get('title')
+                offsets = chunk_metadata.get('sentence_offsets')
+                if not offsets or offsets[-1][1] > len(content):
+                    # Chunked before offsets were recorded
+                    offsets = split_sentences(content)
                 
                 # Create metadata
                 chunk_data = {
@@ -124,6 +146,7 @@ class EmbeddingGenerator:
                     'content': content,
                     'url': url,
                     'title': title,
+                    'sentence_offsets': offsets,
                     'embedding': embedding.tolist()  # Convert to list for JSON serialization
                 }
                 
@@ -162,7 +185,8 @@ class EmbeddingGenerator:
                     'file_path': item['file_path'],
                     'content': item['content'],
                     'url': item.get('url'),
-                    'title': item.get('title')
+                    'title': item.get('title'),
+                    'sentence_offsets': item.get('sentence_offsets')
                 }
                 faiss_metadata.append(meta)
         
@@ -172,8 +196,35 @@ class EmbeddingGenerator:
         
         # Save embeddings as numpy array
         embeddings_array = np.array(faiss_embeddings, dtype=np.float32)
+        
+        # Collapse near-duplicate chunks so they don't waste memory or crowd results
+        if deduplicator is not None and len(faiss_metadata):
+            faiss_metadata, embeddings_array, dedup_report = deduplicator.deduplicate(faiss_metadata, embeddings_array)
+            print_report(dedup_report)
+            with open(os.path.join(faiss_dir, 'dedup_report.json'), 'w', encoding='utf-8') as f:
+                json.dump(dedup_report, f, indent=2)
+        
+        projection = None
+        if projection_dim and len(embeddings_array):
+            projection = train_projection(embeddings_array, projection_dim, projection_method)
+            embeddings_array = projection.apply(embeddings_array)
+            projection.save(faiss_dir)
+            print(f"Projected embeddings from {projection.input_dim} to {projection.dim} dims ({projection_method})")
+        elif os.path.exists(os.path.join(faiss_dir, PROJECTION_FILE)):
+            # Don't let a projection from an earlier build apply to full-size vectors
+            os.remove(os.path.join(faiss_dir, PROJECTION_FILE))
+        
+        # Unit length (after any projection) so the inner-product index scores cosine similarity
+        embeddings_array = normalize_rows(embeddings_array).astype(np.float32)
+        
         np.save(os.path.join(faiss_dir, 'embeddings.npy'), embeddings_array)
         
+        sentence_vectors_path = os.path.join(faiss_dir, SENTENCE_VECTORS_FILE)
+        if sentence_embeddings and len(faiss_metadata):
+            self.save_sentence_embeddings(faiss_metadata, sentence_vectors_path, projection)
+        elif os.path.exists(sentence_vectors_path):
+            os.remove(sentence_vectors_path)
+        
         # Save metadata
         with open(os.path.join(faiss_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
             json.dump(faiss_metadata, f, ensure_ascii=False, indent=2)
@@ -181,9 +232,28 @@ class EmbeddingGenerator:
         print(f"Successfully processed {len(faiss_metadata)} chunks.")
         print(f"Embeddings saved to {output_dir}")
         print(f"FAISS-ready data saved to {faiss_dir}")
+    
+    def save_sentence_embeddings(self, metadata: list, path: str, projection=None, batch_size: int = 64):
+        """
+        Embed every sentence of every chunk into one float16 array, in the same space as the
+        chunk vectors, and point each chunk's metadata at its rows with 'sentence_rows' [start, end).
+        """
+        sentences = []
+        for meta in metadata:
+            start = len(sentences)
+            sentences.extend(meta['content'][s:e] for s, e in meta.get('sentence_offsets') or [])
+            meta['sentence_rows'] = [start, len(sentences)]
+        vectors = np.asarray(self.model.encode(sentences, batch_size=batch_size, show_progress_bar=False),
+                             dtype=np.float32)
+        if projection is not None:
+            vectors = projection.apply(vectors)
+        np.save(path, normalize_rows(vectors).astype(np.float16))
+        print(f"Saved {len(sentences)} sentence embeddings to {path}")
 
 
-def main():
+def build(args):
+    """Embed all chunks and publish the result as a new index version."""
+
     # Configuration
     chunks_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'chunks')
     embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'embeddings')
@@ -191,8 +261,33 @@ def main():
     # Initialize embedding generator
     embedding_generator = EmbeddingGenerator()
     
-    # Process all chunks
-    embedding_generator.process_chunks_directory(chunks_dir, embeddings_dir)
+    # Process all chunks, collapsing near-duplicates before indexing
+    embedding_generator.process_chunks_directory(chunks_dir, embeddings_dir, deduplicator=ChunkDeduplicator(),
+                                                 projection_dim=args.project_dim,
+                                                 projection_method=args.projection,
+                                                 sentence_embeddings=args.sentence_embeddings)
+    
+    # Publish the build as a new index version; running servers pick it up without a restart
+    version = publish_version(os.path.join(embeddings_dir, 'faiss'), embeddings_dir)
+    print(f"Published index version {version}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate embeddings for all chunks and publish a new index version.")
+    parser.add_argument('--project-dim', type=int, default=None,
+                        help="Reduce stored vectors to this many dimensions")
+    parser.add_argument('--projection', choices=['pca', 'truncate'], default='pca')
+    parser.add_argument('--sentence-embeddings', action='store_true',
+                        help="Also embed each sentence (float16 side array) for query-aware snippets")
+    parser.add_argument('--profile', nargs='?', const='all', default=None,
+                        help="Profile the run into profiles/: all, or a list of cprofile,sample,memory "
+                             "(default: VECTOR_SEARCH_PROFILE)")
+    args = parser.parse_args()
+    modes = parse_modes(args.profile) if args.profile else profiling_modes()
+    with profile('generate_embeddings', modes, args=vars(args)) as profile_stem:
+        build(args)
+    if profile_stem:
+        print(f"Profile written to {profile_stem}.*")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+"""
+Versioned index directories with atomic hot-swap.
+
+Each build is published as data/embeddings/versions/<version>/ and the file
+data/embeddings/CURRENT names the live version. CURRENT is replaced
+atomically, so readers see either the old or the new name, never a partial one.
+
+IndexManager serves searches from the current version and runs a background
+watcher: when CURRENT changes it loads the new version, warms it, and swaps it
+in for new queries. Queries already running keep the retriever they started
+with; the old version is closed and released once the last of them finishes.
+The watcher also replays live updates other processes appended to the
+current version's write-ahead log (see FaissRetriever.upsert).
+
+    python -m utils.index_versions publish data/embeddings/faiss
+    python -m utils.index_versions list
+    python -m utils.index_versions activate 20250101-120000
+    python -m utils.index_versions check 20250101-120000
+"""
+
+import os
+import shutil
+import argparse
+import numpy as np
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROOT = os.path.join(BASE_DIR, 'data', 'embeddings')
+POINTER_FILE = 'CURRENT'
+VERSIONS_DIR = 'versions'
+# Used when no version has been published yet
+LEGACY_DIR = 'faiss'
+
+
+def list_versions(root: str = DEFAULT_ROOT) -> List[str]:
+    versions_dir = Path(root) / VERSIONS_DIR
+    if not versions_dir.is_dir():
+        return []
+    return sorted(p.name for p in versions_dir.iterdir() if p.is_dir() and not p.name.startswith('.'))
+
+
+def current_version(root: str = DEFAULT_ROOT) -> Optional[str]:
+    try:
+        with open(Path(root) / POINTER_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(root: str, version: Optional[str]) -> Path:
+    if version is None:
+        return Path(root) / LEGACY_DIR
+    return Path(root) / VERSIONS_DIR / version
+
+
+def set_current(root: str, version: str):
+    """Atomically point CURRENT at version."""
+    if not version_dir(root, version).is_dir():
+        raise FileNotFoundError(f"Index version not found: {version}")
+    tmp_path = Path(root) / f"{POINTER_FILE}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, Path(root) / POINTER_FILE)
+
+
+def publish_version(src_dir: str, root: str = DEFAULT_ROOT, version: Optional[str] = None,
+                    activate: bool = True) -> str:
+    """
+    Copy a freshly built index directory into a new version and optionally make it current.
+
+    Args:
+        src_dir: Directory with embeddings.npy, metadata.json and any side files
+        root: Embeddings root holding versions/ and CURRENT
+        version: Version name (default: timestamp)
+        activate: Point CURRENT at the new version
+
+    Returns:
+        The version name
+    """
+    version = version or datetime.now().strftime('%Y%m%d-%H%M%S')
+    dest = version_dir(root, version)
+    if dest.exists():
+        raise FileExistsError(f"Index version already exists: {version}")
+    tmp_dest = dest.parent / f".{version}.tmp"
+    shutil.copytree(src_dir, tmp_dest)
+    # Rename so the watcher never sees a partially copied version
+    os.rename(tmp_dest, dest)
+    if activate:
+        set_current(root, version)
+    return version
+
+
+def prune_versions(root: str = DEFAULT_ROOT, keep: int = 3) -> List[str]:
+    """Delete all but the newest keep versions, never the current one. Returns removed versions."""
+    current = current_version(root)
+    removable = [v for v in list_versions(root) if v != current]
+    removed = removable[:max(0, len(removable) - max(0, keep - 1))]
+    for version in removed:
+        shutil.rmtree(version_dir(root, version), ignore_errors=True)
+    return removed
+
+
+def _default_loader(path: str):
+    from utils.ondisk_index import is_ondisk_index
+    if is_ondisk_index(path):
+        from utils.ondisk_index import OnDiskRetriever
+        return OnDiskRetriever(path)
+    from utils.faiss_retriever import FaissRetriever
+    return FaissRetriever(path)
+
+
+def warm_up(retriever):
+    """
+    Touch the index and metadata so the first real query isn't slow.
+
+    Stored vectors may be projected, so the queries are built at the encoder's
+    dimension, which is what search_batch() expects.
+    """
+    embeddings = getattr(retriever, 'embeddings', None)
+    if embeddings is not None and len(embeddings):
+        projection = getattr(retriever, 'projection', None)
+        dim = projection.input_dim if projection is not None else embeddings.shape[1]
+        queries = np.random.default_rng(0).standard_normal((8, dim)).astype(np.float32)
+        retriever.search_batch(queries, top_k=10)
+    return retriever
+
+
+class _LoadedVersion:
+    __slots__ = ('version', 'retriever', 'in_flight', 'retired')
+
+    def __init__(self, version, retriever):
+        self.version = version
+        self.retriever = retriever
+        self.in_flight = 0
+        self.retired = False
+
+
+class IndexManager:
+    """
+    Serves searches from the current index version and hot-swaps new versions in.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, loader: Callable = _default_loader,
+                 poll_interval_s: float = 5.0):
+        """
+        Args:
+            root: Embeddings root holding versions/ and CURRENT
+            loader: Callable taking a version directory and returning a retriever
+            poll_interval_s: How often the watcher checks CURRENT
+        """
+        self.root = root
+        self.loader = loader
+        self.poll_interval_s = poll_interval_s
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.swaps = 0
+        self.last_error = None
+        # A version that failed to load is not retried until CURRENT names another one
+        self._failed_version = None
+        version = current_version(root)
+        self._active = _LoadedVersion(version, self._load(version))
+
+    def _load(self, version: Optional[str]):
+        return warm_up(self.loader(str(version_dir(self.root, version))))
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._active.version
+
+    def check_for_update(self) -> bool:
+        """Load and swap in the version named by CURRENT if it changed. Returns True on swap."""
+        version = current_version(self.root)
+        if version == self._active.version or version == self._failed_version:
+            return False
+        try:
+            retriever = self._load(version)
+        except Exception as e:
+            # Keep serving the old version if the new one is broken
+            self.last_error = f"{version}: {e}"
+            self._failed_version = version
+            print(f"Failed to load index version {version}, keeping {self._active.version}: {e}")
+            return False
+        self._failed_version = None
+        with self._lock:
+            old = self._active
+            self._active = _LoadedVersion(version, retriever)
+            old.retired = True
+            release_now = old.in_flight == 0
+            self.swaps += 1
+        if release_now:
+            self._release(old)
+        print(f"Swapped index version {old.version} -> {version}")
+        return True
+
+    @staticmethod
+    def _release(entry: _LoadedVersion):
+        close = getattr(entry.retriever, 'close', None)
+        if close:
+            close()
+        entry.retriever = None
+
+    @contextmanager
+    def acquire(self):
+        """Pin the current version for the duration of a query."""
+        with self._lock:
+            entry = self._active
+            entry.in_flight += 1
+        try:
+            yield entry.retriever
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+                release = entry.retired and entry.in_flight == 0
+            if release:
+                self._release(entry)
+
+    def search(self, query_embedding, top_k: int = 10, **kwargs) -> List[Dict]:
+        with self.acquire() as retriever:
+            return retriever.search(query_embedding, top_k=top_k, **kwargs)
+
+    def search_batch(self, query_embeddings, top_k: int = 10, **kwargs) -> List[List[Dict]]:
+        with self.acquire() as retriever:
+            return retriever.search_batch(query_embeddings, top_k=top_k, **kwargs)
+
+    def sync_updates(self) -> int:
+        """Apply live updates written to the current version by other processes."""
+        with self.acquire() as retriever:
+            sync_wal = getattr(retriever, 'sync_wal', None)
+            return sync_wal() if sync_wal else 0
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval_s):
+            if not self.check_for_update():
+                try:
+                    self.sync_updates()
+                except Exception as e:
+                    self.last_error = f"sync: {e}"
+
+    def start(self) -> 'IndexManager':
+        """Start the background watcher thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='index-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage versioned index directories.")
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="List versions")
+    publish = sub.add_parser('publish', help="Publish a built index directory as a new version")
+    publish.add_argument('src_dir')
+    publish.add_argument('--version', default=None)
+    publish.add_argument('--no-activate', action='store_true')
+    activate = sub.add_parser('activate', help="Make a version current (also used to roll back)")
+    activate.add_argument('version')
+    check = sub.add_parser('check', help="Load and warm a version the way the server does, without activating it")
+    check.add_argument('version', nargs='?', default=None, help="Default: the current version")
+    prune = sub.add_parser('prune', help="Delete old versions")
+    prune.add_argument('--keep', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        current = current_version(args.root)
+        for version in list_versions(args.root):
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.command == 'publish':
+        version = publish_version(args.src_dir, args.root, args.version, activate=not args.no_activate)
+        print(f"Published version {version}")
+    elif args.command == 'activate':
+        set_current(args.root, args.version)
+        print(f"Current version: {args.version}")
+    elif args.command == 'check':
+        version = args.version or current_version(args.root)
+        retriever = warm_up(_default_loader(str(version_dir(args.root, version))))
+        projection = getattr(retriever, 'projection', None)
+        dims = f"{projection.input_dim} -> {projection.dim} dims" if projection is not None else "unprojected"
+        print(f"Version {version or LEGACY_DIR} loads and answers queries ({len(retriever.metadata)} chunks, {dims})")
+        close = getattr(retriever, 'close', None)
+        if close:
+            close()
+    elif args.command == 'prune':
+        for version in prune_versions(args.root, args.keep):
+            print(f"Removed {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Add, replace or remove a single page in the live index without rebuilding it.
+
+The page is chunked and embedded like the batch pipeline and written to the
+current index version through FaissRetriever.upsert/delete, which log every
+change to the version's write-ahead log. Running apps pick the change up on
+their next watcher poll (IndexManager.sync_updates).
+
+    python -m utils.live_update add https://dccdialysis.com/blog/new-post/ --text-file post.txt --title "New post"
+    python -m utils.live_update delete https://dccdialysis.com/blog/new-post/
+    python -m utils.live_update checkpoint
+"""
+
+import re
+import argparse
+from urllib.parse import urlparse
+
+from utils.faiss_retriever import FaissRetriever
+from utils.index_versions import DEFAULT_ROOT, current_version, version_dir
+
+
+def page_slug(url: str) -> str:
+    """Category name the crawler gives a page (see DCCSiteCrawler.slugify)."""
+    path = urlparse(url).path.strip('/')
+    if not path:
+        return "home"
+    return re.sub(r'[^a-zA-Z0-9_-]', '-', path).lower()[:80]
+
+
+def upsert_page(retriever: FaissRetriever, url: str, title: str, text: str, encoder,
+                chunker=None) -> int:
+    """
+    Chunk, embed and upsert one page, removing chunks left over from a longer previous version.
+
+    Returns:
+        Number of chunks written
+    """
+    from utils.process_to_chunks import TextChunker, sentence_offsets
+
+    chunker = chunker or TextChunker()
+    category = page_slug(url)
+    sentence_lists = chunker.chunk_sentences(text)
+    chunks = [" ".join(sentences) for sentences in sentence_lists]
+    embeddings = encoder.encode(chunks) if chunks else []
+    keys = set()
+    for i, (content, embedding) in enumerate(zip(chunks, embeddings)):
+        chunk_id = f"chunk_{i:03d}"
+        key = f"{category}/{chunk_id}"
+        retriever.upsert(key, embedding, {'chunk_id': chunk_id, 'category': category,
+                                          'content': content, 'url': url, 'title': title,
+                                          'sentence_offsets': sentence_offsets(sentence_lists[i])})
+        keys.add(key)
+    for key in retriever.keys():
+        if key.startswith(f"{category}/") and key not in keys:
+            retriever.delete(key)
+    return len(chunks)
+
+
+def delete_page(retriever: FaissRetriever, url: str) -> int:
+    """Delete every chunk of a page. Returns the number deleted."""
+    prefix = f"{page_slug(url)}/"
+    return sum(retriever.delete(key) for key in retriever.keys() if key.startswith(prefix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live add/update/delete of pages in the current index.")
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    parser.add_argument('--embeddings-dir', default=None,
+                        help="Index directory to update (default: the current version)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="Add or replace a page")
+    add.add_argument('url')
+    add.add_argument('--text-file', required=True)
+    add.add_argument('--title', default='')
+    add.add_argument('--encoder', default=None, help="Encoder backend: torch, onnx or onnx-int8")
+    add.add_argument('--model', default='all-MiniLM-L6-v2')
+    delete = sub.add_parser('delete', help="Remove a page")
+    delete.add_argument('url')
+    sub.add_parser('checkpoint', help="Fold the write-ahead log into the index files")
+    args = parser.parse_args()
+
+    embeddings_dir = args.embeddings_dir or str(version_dir(args.root, current_version(args.root)))
+    retriever = FaissRetriever(embeddings_dir)
+    if args.command == 'add':
+        from utils.encoders import get_encoder
+        with open(args.text_file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        count = upsert_page(retriever, args.url, args.title, text, get_encoder(args.encoder, args.model))
+        print(f"Upserted {count} chunks for {args.url} into {embeddings_dir}")
+    elif args.command == 'delete':
+        print(f"Deleted {delete_page(retriever, args.url)} chunks for {args.url}")
+    elif args.command == 'checkpoint':
+        retriever.checkpoint()
+        print(f"Checkpointed {embeddings_dir}: {len(retriever.metadata)} chunks")
+
+
+if __name__ == "__main__":
+    main()
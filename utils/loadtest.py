@@ -0,0 +1,389 @@
+"""
+Concurrent load test for the search stack.
+
+Replays a weighted query mix: the app's suggested searches (from
+data/eval/queries.json, Zipf-weighted so the first few dominate) plus a long
+tail built from page titles and content phrases. It runs against either the
+retriever in this process or the HTTP endpoint of utils.search_server, at a
+list of concurrency levels, so the point where latency collapses is visible:
+
+    python -m utils.loadtest inprocess --concurrency 1,4,16 --duration 20
+    python -m utils.loadtest http --url http://127.0.0.1:8000 --concurrency 8,32,64
+    python -m utils.loadtest http --qps 50,100,200 --concurrency 64 --output load.json
+    python -m utils.loadtest inprocess --compare load.json
+
+With --concurrency alone each worker sends back to back (closed loop). With
+--qps requests are scheduled at a fixed rate (open loop) and latency is
+measured from the scheduled time, so queueing delay is included when the
+target can't keep up. CPU and memory of the target process(es) are sampled
+over time (Linux /proc).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils.benchmark import compare_results, environment_info, latency_summary, sample_queries
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUERIES_PATH = os.path.join(BASE_DIR, 'data', 'eval', 'queries.json')
+DEFAULT_EMBEDDINGS_DIR = os.path.join(BASE_DIR, 'data', 'embeddings', 'faiss')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+# --compare flags an error rate above the baseline's by more than tolerance plus this much
+ERROR_RATE_SLACK = 0.001
+
+
+class QueryMix:
+    """
+    Weighted sampler over head queries (Zipf over their rank) and a uniform long tail.
+    """
+
+    def __init__(self, head: List[str], tail: List[str], head_fraction: float = 0.7,
+                 zipf_s: float = 1.0, seed: int = 0):
+        self.head = head
+        self.tail = tail or head
+        self.head_fraction = head_fraction if tail else 1.0
+        weights = np.array([1.0 / (rank ** zipf_s) for rank in range(1, len(head) + 1)])
+        self.head_cdf = np.cumsum(weights / weights.sum())
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> str:
+        with self._lock:
+            if self._rng.random() < self.head_fraction:
+                return self.head[min(int(np.searchsorted(self.head_cdf, self._rng.random())), len(self.head) - 1)]
+            return self._rng.choice(self.tail)
+
+    @property
+    def queries(self) -> List[str]:
+        return list(dict.fromkeys(self.head + self.tail))
+
+
+def build_query_mix(queries_path: str = DEFAULT_QUERIES_PATH, embeddings_dir: str = DEFAULT_EMBEDDINGS_DIR,
+                    tail_size: int = 200, head_fraction: float = 0.7, seed: int = 0) -> QueryMix:
+    """Head from the labeled suggested searches, tail from page titles and content phrases."""
+    with open(queries_path, 'r', encoding='utf-8') as f:
+        head = [item['query'] for item in json.load(f)]
+    rng = random.Random(seed)
+    tail = []
+    metadata_path = os.path.join(embeddings_dir, 'metadata.json')
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        titles = sorted({(m.get('title') or '').split(' - ')[0].strip() for m in metadata} - {''})
+        tail.extend(titles)
+        for meta in rng.sample(metadata, min(len(metadata), tail_size)):
+            words = (meta.get('content') or '').split()
+            if len(words) >= 4:
+                start = rng.randrange(len(words) - 3)
+                tail.append(' '.join(words[start:start + rng.randint(2, 4)]).lower().strip('.,;:!?'))
+    rng.shuffle(tail)
+    return QueryMix(head, tail[:tail_size], head_fraction, seed=seed)
+
+
+# Targets: callables that run one query and return the number of results
+
+def inprocess_target(embeddings_dir: str, encoder_backend: Optional[str], mix: QueryMix,
+                     retriever_kwargs: Optional[Dict] = None, top_k: int = 10) -> Callable[[str], int]:
+    """
+    Search a FaissRetriever in this process. With encoder_backend 'none' every
+    query text maps to a fixed perturbed corpus vector, so no model is needed;
+    otherwise queries are encoded per request like the app does.
+    """
+    from utils.faiss_retriever import FaissRetriever
+
+    retriever = FaissRetriever(embeddings_dir, **(retriever_kwargs or {}))
+    if encoder_backend == 'none':
+        texts = mix.queries
+        vectors = dict(zip(texts, sample_queries(retriever.embeddings, len(texts),
+                                                    projection=retriever.projection)))
+
+        def run(query: str) -> int:
+            return len(retriever.search(vectors[query], top_k=top_k))
+        return run
+
+    from utils.encoders import get_encoder
+    encoder = get_encoder(encoder_backend)
+
+    def run(query: str) -> int:
+        return len(retriever.search(encoder.encode([query]), top_k=top_k))
+    return run
+
+
+def http_target(base_url: str, top_k: int = 10, timeout_s: float = 10.0) -> Callable[[str], int]:
+    """GET /search on a running utils.search_server."""
+    def run(query: str) -> int:
+        url = f"{base_url.rstrip('/')}/search?{urllib.parse.urlencode({'q': query, 'k': top_k})}"
+        with urllib.request.urlopen(url, timeout=timeout_s) as response:
+            return len(json.loads(response.read())['results'])
+    return run
+
+
+# Resource sampling
+
+def _proc_children(pid: int) -> List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children', 'r') as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_usage(pid: int) -> Dict[str, float]:
+    """CPU seconds and RSS (MiB) of pid and its direct children (e.g. forked server workers)."""
+    cpu_s = rss_mb = 0.0
+    for p in [pid] + _proc_children(pid):
+        try:
+            with open(f'/proc/{p}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+            cpu_s += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f'/proc/{p}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss_mb += int(line.split()[1]) / 1024.0
+        except (OSError, IndexError, ValueError):
+            continue
+    return {'cpu_s': cpu_s, 'rss_mb': rss_mb}
+
+
+class _Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies_ms = []
+        self.errors = Counter()
+        self.completed = 0
+        self.empty_results = 0
+        self.window = []
+
+    def record(self, latency_ms: float, error: Optional[str] = None, num_results: int = 0):
+        with self.lock:
+            if error:
+                self.errors[error] += 1
+            else:
+                self.latencies_ms.append(latency_ms)
+                self.window.append(latency_ms)
+                self.completed += 1
+                self.empty_results += num_results == 0
+
+    def drain_window(self) -> List[float]:
+        with self.lock:
+            window, self.window = self.window, []
+            return window
+
+
+def run_load(target: Callable[[str], int], mix: QueryMix, concurrency: int, duration_s: float,
+             qps: Optional[float] = None, warmup_s: float = 2.0, sample_interval_s: float = 1.0,
+             pids: Optional[List[int]] = None) -> Dict:
+    """
+    Drive target with the query mix for duration_s and summarize.
+
+    Args:
+        target: Callable running one query
+        mix: Query sampler
+        concurrency: Worker threads
+        duration_s: Measured duration (after warmup)
+        qps: Open-loop request rate; None for closed loop
+        pids: Processes whose CPU/memory to sample (default: this one)
+    """
+    pids = pids or [os.getpid()]
+    recorder = _Recorder()
+    stop = threading.Event()
+
+    def execute(query: str, scheduled: float):
+        try:
+            num_results = target(query)
+            recorder.record((time.perf_counter() - scheduled) * 1000, num_results=num_results)
+        except Exception as e:
+            recorder.record(0.0, error=type(e).__name__)
+
+    # Warm up outside the measurement, at full concurrency so every server worker
+    # gets past its cold start (lazy model load): each thread runs until warmup_s has
+    # passed and it has completed at least one request, giving up after a minute of errors
+    warmup_end = time.perf_counter() + warmup_s
+
+    def warm():
+        succeeded = False
+        while not succeeded or time.perf_counter() < warmup_end:
+            try:
+                target(mix.sample())
+                succeeded = True
+            except Exception:
+                if time.perf_counter() > warmup_end + 60:
+                    return
+                time.sleep(0.1)
+
+    if warmup_s > 0:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(warm)
+
+    timeline = []
+    usage_before = [process_tree_usage(pid) for pid in pids]
+
+    def sample_resources():
+        last = usage_before
+        last_t = time.perf_counter()
+        last_errors = 0
+        while not stop.wait(sample_interval_s):
+            now = time.perf_counter()
+            usage = [process_tree_usage(pid) for pid in pids]
+            window = recorder.drain_window()
+            errors = sum(recorder.errors.values())
+            interval = now - last_t
+            timeline.append({
+                't_s': round(now - start, 3),
+                'throughput_qps': len(window) / interval,
+                'p50_ms': float(np.percentile(window, 50)) if window else None,
+                'p99_ms': float(np.percentile(window, 99)) if window else None,
+                'errors': errors - last_errors,
+                'cpu_percent': 100.0 * sum(u['cpu_s'] - l['cpu_s'] for u, l in zip(usage, last)) / interval,
+                'rss_mb': sum(u['rss_mb'] for u in usage),
+            })
+            last, last_t, last_errors = usage, now, errors
+
+    start = time.perf_counter()
+    sampler = threading.Thread(target=sample_resources, name='loadtest-sampler', daemon=True)
+    sampler.start()
+    end = start + duration_s
+    if qps:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            interval = 1.0 / qps
+            scheduled = start
+            while scheduled < end:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(execute, mix.sample(), scheduled)
+                scheduled += interval
+    else:
+        def worker():
+            while time.perf_counter() < end:
+                execute(mix.sample(), time.perf_counter())
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+    usage_after = [process_tree_usage(pid) for pid in pids]
+
+    total_errors = sum(recorder.errors.values())
+    total = recorder.completed + total_errors
+    summary = latency_summary(recorder.latencies_ms)
+    return {
+        'concurrency': concurrency,
+        'target_qps': qps,
+        'duration_s': elapsed,
+        'requests': total,
+        'throughput_per_s': recorder.completed / elapsed,
+        'error_rate': total_errors / total if total else 0.0,
+        'errors': dict(recorder.errors),
+        'empty_result_rate': recorder.empty_results / recorder.completed if recorder.completed else 0.0,
+        'latency': summary,
+        'cpu_percent': 100.0 * sum(a['cpu_s'] - b['cpu_s'] for a, b in zip(usage_after, usage_before)) / elapsed,
+        'peak_rss_mb': max([row['rss_mb'] for row in timeline] + [sum(u['rss_mb'] for u in usage_after)]),
+        'timeline': timeline,
+    }
+
+
+def print_summary(runs: List[Dict]):
+    header = f"{'conc':>5}{'qps tgt':>9}{'thru/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err %':>7}{'cpu %':>8}{'rss MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for run in runs:
+        lat = run['latency']
+        print(f"{run['concurrency']:>5}{run['target_qps'] or '-':>9}{run['throughput_per_s']:>9.1f}"
+              f"{lat.get('p50_ms', 0):>9.2f}{lat.get('p95_ms', 0):>9.2f}{lat.get('p99_ms', 0):>9.2f}"
+              f"{100 * run['error_rate']:>7.2f}{run['cpu_percent']:>8.1f}{run['peak_rss_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the retriever or the HTTP search endpoint.")
+    parser.add_argument('target', choices=['inprocess', 'http'])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="Search server base URL (http target)")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="Search server parent pid to sample CPU/memory from (http target)")
+    parser.add_argument('--embeddings-dir', default=DEFAULT_EMBEDDINGS_DIR)
+    parser.add_argument('--encoder', default=None,
+                        help="inprocess query encoder: torch, onnx, onnx-int8, or none for synthetic vectors")
+    parser.add_argument('--queries', default=DEFAULT_QUERIES_PATH, help="Head queries (labeled query file)")
+    parser.add_argument('--head-fraction', type=float, default=0.7, help="Share of requests from head queries")
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated worker counts")
+    parser.add_argument('--qps', default=None, help="Comma-separated open-loop request rates")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per step")
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON results to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    mix = build_query_mix(args.queries, args.embeddings_dir, head_fraction=args.head_fraction)
+    if args.target == 'inprocess':
+        target = inprocess_target(args.embeddings_dir, args.encoder, mix, top_k=args.top_k)
+        pids = [os.getpid()]
+    else:
+        target = http_target(args.url, args.top_k)
+        pids = [args.server_pid] if args.server_pid else [os.getpid()]
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(',') if c]
+    steps = ([(concurrency_levels[-1], float(q)) for q in args.qps.split(',') if q] if args.qps
+             else [(c, None) for c in concurrency_levels])
+    runs = []
+    for concurrency, qps in steps:
+        print(f"Running {args.target}: concurrency {concurrency}"
+              f"{f', {qps:g} qps' if qps else ''} for {args.duration:g}s")
+        runs.append(run_load(target, mix, concurrency, args.duration, qps, warmup_s=args.warmup, pids=pids))
+    print()
+    print_summary(runs)
+
+    results = {
+        'environment': environment_info(),
+        'target': args.target,
+        'url': args.url if args.target == 'http' else None,
+        'query_mix': {'head': len(mix.head), 'tail': len(mix.tail), 'head_fraction': mix.head_fraction},
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        # Compare steps pairwise by position; timelines and the configured duration are not compared
+        regressions = []
+        for i, (old, new) in enumerate(zip(baseline.get('runs', []), runs)):
+            strip = lambda run: {k: v for k, v in run.items() if k not in ('timeline', 'duration_s')}
+            regressions.extend(compare_results(strip(old), strip(new), args.tolerance, prefix=f"runs[{i}]."))
+            # Absolute slack: a baseline without errors would otherwise allow none at all
+            old_rate, new_rate = old.get('error_rate', 0.0), new['error_rate']
+            if new_rate > old_rate * (1 + args.tolerance) + ERROR_RATE_SLACK:
+                regressions.append(f"runs[{i}].error_rate: {old_rate:.4f} -> {new_rate:.4f}")
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions beyond tolerance.")
+
+
+if __name__ == "__main__":
+    main()
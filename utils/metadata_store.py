@@ -0,0 +1,77 @@
+"""
+Packed, memory-mapped chunk metadata.
+
+metadata.json has to be parsed in full by every process that loads it. The
+packed form stores one JSON record per line in metadata.jsonl plus an int64
+offsets array in metadata_offsets.npy, so a reader memory-maps both files and
+decodes only the records it returns. Processes mapping the same files share
+the pages through the OS page cache.
+"""
+
+import os
+import json
+import mmap
+import numpy as np
+from typing import Dict, Iterable, List
+
+RECORDS_FILE = 'metadata.jsonl'
+OFFSETS_FILE = 'metadata_offsets.npy'
+
+
+def write_metadata_store(metadata: Iterable[Dict], out_dir: str) -> int:
+    """
+    Write metadata records in packed form.
+
+    Args:
+        metadata: Metadata records, in index row order
+        out_dir: Directory to write metadata.jsonl and metadata_offsets.npy to
+
+    Returns:
+        Number of records written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    offsets = [0]
+    with open(os.path.join(out_dir, RECORDS_FILE), 'wb') as f:
+        for record in metadata:
+            line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(out_dir, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+    return len(offsets) - 1
+
+
+class MetadataStore:
+    """
+    Read-only, list-like view of packed metadata.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self._file = open(os.path.join(store_dir, RECORDS_FILE), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap can't map an empty file
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> Dict:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return json.loads(self._data[start:end])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def get_many(self, indices: Iterable[int]) -> List[Dict]:
+        return [self[idx] for idx in indices]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
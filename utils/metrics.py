@@ -0,0 +1,253 @@
+"""
+Lightweight tracing and metrics for the search path.
+
+Stages are timed with spans, aggregated into per-stage latency histograms and
+counters (requests, QPS, cache hits, errors), and can be exported as Prometheus
+text (e.g. for the node_exporter textfile collector) or appended to a local
+JSON-lines log with one trace per request.
+
+Metrics are off unless one of these environment variables is set:
+
+    VECTOR_SEARCH_METRICS=1               collect in memory only
+    VECTOR_SEARCH_METRICS_PROM=<path>     write Prometheus text to <path>
+    VECTOR_SEARCH_METRICS_LOG=<path>      append one JSON trace per request
+
+When disabled, span() and trace() return a shared no-op context manager, so the
+instrumentation costs a function call and an attribute check per stage.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            yield bound, running
+
+
+class _NullContext:
+    """Shared no-op context manager used when metrics are disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NULL = _NullContext()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'SearchMetrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics._record_span(self.name, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class _Trace:
+    __slots__ = ('metrics', 'fields', 'spans', 'start')
+
+    def __init__(self, metrics: 'SearchMetrics', fields: Dict):
+        self.metrics = metrics
+        self.fields = fields
+        self.spans = {}
+
+    def set(self, key, value):
+        self.fields[key] = value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.metrics._local.trace = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics._local.trace = None
+        self.metrics._record_trace(self, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class SearchMetrics:
+    """
+    Per-process registry of stage histograms and counters.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, prometheus_path: Optional[str] = None,
+                 log_path: Optional[str] = None, qps_window_s: float = 60.0):
+        """
+        Args:
+            enabled: Force metrics on or off; by default enabled when any metrics env var is set
+            prometheus_path: File to write Prometheus text to on export()
+            log_path: JSON-lines file that receives one trace per request
+            qps_window_s: Window used for the QPS gauge
+        """
+        self.prometheus_path = prometheus_path or os.environ.get('VECTOR_SEARCH_METRICS_PROM')
+        self.log_path = log_path or os.environ.get('VECTOR_SEARCH_METRICS_LOG')
+        if enabled is None:
+            enabled = bool(os.environ.get('VECTOR_SEARCH_METRICS') or self.prometheus_path or self.log_path)
+        self.enabled = enabled
+        self.qps_window_s = qps_window_s
+        self.started_at = time.time()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._request_times = deque()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_export = 0.0
+
+    def span(self, name: str):
+        """Time a stage of the current request."""
+        if not self.enabled:
+            return _NULL
+        return _Span(self, name)
+
+    def trace(self, **fields):
+        """Wrap one request; spans inside it are also recorded in the request's trace."""
+        if not self.enabled:
+            return _NULL
+        return _Trace(self, fields)
+
+    def inc(self, name: str, value: float = 1):
+        """Increment a counter, e.g. inc('cache_hits')."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _record_span(self, name: str, seconds: float, failed: bool):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(seconds)
+            if failed:
+                key = f'errors{{stage="{name}"}}'
+                self.counters[key] = self.counters.get(key, 0) + 1
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.spans[name] = trace.spans.get(name, 0.0) + seconds * 1000
+
+    def _record_trace(self, trace: _Trace, seconds: float, failed: bool):
+        now = time.time()
+        with self._lock:
+            self.histograms.setdefault('request', Histogram()).observe(seconds)
+            self.counters['requests'] = self.counters.get('requests', 0) + 1
+            if failed:
+                self.counters['errors{stage="request"}'] = self.counters.get('errors{stage="request"}', 0) + 1
+            self._request_times.append(now)
+            self._prune_request_times(now)
+        if self.log_path:
+            record = {'ts': now, 'total_ms': seconds * 1000, 'error': failed,
+                      'spans_ms': trace.spans, **trace.fields}
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def _prune_request_times(self, now: float):
+        # Callers hold self._lock; keeps the deque to one window even if qps() is never read
+        cutoff = now - self.qps_window_s
+        while self._request_times and self._request_times[0] < cutoff:
+            self._request_times.popleft()
+
+    def qps(self) -> float:
+        """Requests per second over the last qps_window_s seconds."""
+        with self._lock:
+            self._prune_request_times(time.time())
+            recent = len(self._request_times)
+        window = min(self.qps_window_s, max(time.time() - self.started_at, 1e-9))
+        return recent / window
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            stages = {name: {'count': h.count, 'sum_ms': h.total * 1000,
+                             'mean_ms': (h.total / h.count * 1000) if h.count else 0.0}
+                      for name, h in self.histograms.items()}
+            counters = dict(self.counters)
+        return {'uptime_s': time.time() - self.started_at, 'qps': self.qps(),
+                'counters': counters, 'stages': stages}
+
+    def to_prometheus(self, prefix: str = 'vector_search') -> str:
+        qps = self.qps()
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Time spent in each search stage.",
+            f"# TYPE {prefix}_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                for bound, count in h.cumulative():
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{name}"}} {h.total}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{name}"}} {h.count}')
+            counter_names = {}
+            for key, value in sorted(self.counters.items()):
+                base = key.split('{', 1)[0]
+                counter_names.setdefault(base, []).append((key[len(base):], value))
+        for base, series in counter_names.items():
+            lines.append(f"# TYPE {prefix}_{base}_total counter")
+            for labels, value in series:
+                lines.append(f"{prefix}_{base}_total{labels} {value}")
+        lines.append(f"# TYPE {prefix}_qps gauge")
+        lines.append(f"{prefix}_qps {qps}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, min_interval_s: float = 1.0):
+        """Write Prometheus text to prometheus_path, at most once per min_interval_s."""
+        if not self.enabled or not self.prometheus_path:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._last_export < min_interval_s:
+                return
+            self._last_export = now
+        # Per-writer temp name: other threads (or processes sharing the path) may export at once
+        tmp_path = f"{self.prometheus_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            # Atomic replace so a scraper never sees a half-written file
+            os.replace(tmp_path, self.prometheus_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+metrics = SearchMetrics()
+
+
+def get_metrics() -> SearchMetrics:
+    """Process-wide metrics registry."""
+    return metrics
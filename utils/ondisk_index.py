@@ -0,0 +1,340 @@
+"""
+Disk-resident index for corpora larger than RAM.
+
+build_ondisk_index() turns an embeddings directory into an IVF index whose
+inverted lists live in index.ivfdata and are memory-mapped at search time
+(FAISS OnDiskInvertedLists). Vectors are added block by block from a
+memory-mapped embeddings.npy, so building never holds the whole corpus in RAM
+either. Metadata is packed into a MetadataStore and read by offset.
+
+A query only touches the nprobe lists nearest to it, so memory use is bounded
+by what the OS page cache keeps resident and latency by how many of those
+pages are already cached. bench_page_cache() measures that trade-off.
+
+    python -m utils.ondisk_index build data/embeddings/faiss /tmp/ondisk
+    python -m utils.index_versions publish /tmp/ondisk
+    python -m utils.ondisk_index bench /tmp/ondisk --queries-from data/embeddings/faiss
+
+IndexManager loads directories containing index.ivf with OnDiskRetriever.
+"""
+
+import os
+import json
+import mmap
+import time
+import ctypes
+import ctypes.util
+import shutil
+import argparse
+import resource
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.metadata_store import MetadataStore, write_metadata_store
+from utils.metrics import get_metrics
+from utils.projection import PROJECTION_FILE, load_projection, normalize_rows
+from utils.snippets import SENTENCE_VECTORS_FILE, annotate_best_sentences, load_sentence_vectors
+
+INDEX_FILE = 'index.ivf'
+LISTS_FILE = 'index.ivfdata'
+CONFIG_FILE = 'ondisk.json'
+
+
+def default_nlist(num_vectors: int) -> int:
+    # ~4*sqrt(n) lists, but keep enough training points per centroid
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+def build_ondisk_index(embeddings_dir: str, out_dir: str, nlist: Optional[int] = None,
+                       nprobe: int = 16, train_size: int = 100_000, block_size: int = 100_000,
+                       metric: str = 'cosine', seed: int = 0) -> str:
+    """
+    Build an IVF index with on-disk inverted lists from embeddings.npy and metadata.json.
+
+    Args:
+        embeddings_dir: Directory with embeddings.npy and metadata.json
+        out_dir: Directory to create (replaced if it exists)
+        nlist: Number of inverted lists (default: ~4*sqrt(n))
+        nprobe: Lists searched per query, stored as the serving default
+        train_size: Vectors sampled to train the coarse quantizer
+        block_size: Vectors added per block
+        metric: 'cosine' (normalized vectors, inner product) or 'l2'
+
+    Returns:
+        out_dir
+    """
+    import faiss
+    from faiss.contrib.ondisk import merge_ondisk
+
+    src = Path(embeddings_dir)
+    embeddings = np.load(src / 'embeddings.npy', mmap_mode='r')
+    num_vectors, dim = embeddings.shape
+    nlist = nlist or default_nlist(num_vectors)
+    tmp_dir = Path(f"{out_dir}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(num_vectors, size=min(train_size, num_vectors), replace=False))
+    cosine = metric == 'cosine'
+    prepare = (lambda x: normalize_rows(np.asarray(x, dtype=np.float32))) if cosine else (lambda x: x)
+    if cosine:
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+    print(f"Training {nlist} lists on {len(sample)} of {num_vectors} vectors")
+    index.train(np.ascontiguousarray(prepare(embeddings[sample]), dtype=np.float32))
+    trained_path = str(tmp_dir / 'trained.index')
+    faiss.write_index(index, trained_path)
+
+    # Add each block to its own small index on disk, then merge them into one lists file
+    block_paths = []
+    for start in range(0, num_vectors, block_size):
+        block = np.ascontiguousarray(prepare(embeddings[start:start + block_size]), dtype=np.float32)
+        block_index = faiss.read_index(trained_path)
+        block_index.add_with_ids(block, np.arange(start, start + len(block), dtype=np.int64))
+        block_path = str(tmp_dir / f"block_{len(block_paths):04d}.index")
+        faiss.write_index(block_index, block_path)
+        block_paths.append(block_path)
+        del block_index
+    index = faiss.read_index(trained_path)
+    merge_ondisk(index, block_paths, str(tmp_dir / LISTS_FILE))
+    faiss.write_index(index, str(tmp_dir / INDEX_FILE))
+    del index
+    for path in block_paths + [trained_path]:
+        os.remove(path)
+
+    with open(src / 'metadata.json', 'r', encoding='utf-8') as f:
+        count = write_metadata_store(json.load(f), str(tmp_dir))
+    if count != num_vectors:
+        shutil.rmtree(tmp_dir)
+        raise ValueError(f"{count} metadata records for {num_vectors} vectors in {embeddings_dir}")
+    for side_file in (PROJECTION_FILE, SENTENCE_VECTORS_FILE):
+        if (src / side_file).exists():
+            shutil.copy2(src / side_file, tmp_dir)
+    with open(tmp_dir / CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'num_vectors': int(num_vectors), 'dim': int(dim), 'nlist': nlist, 'nprobe': nprobe,
+                   'metric': metric}, f, indent=2)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp_dir, out_dir)
+    return out_dir
+
+
+def is_ondisk_index(index_dir: str) -> bool:
+    return (Path(index_dir) / INDEX_FILE).exists()
+
+
+class OnDiskRetriever:
+    def __init__(self, index_dir: str, nprobe: Optional[int] = None, min_score: Optional[float] = None):
+        """
+        Open an index written by build_ondisk_index(). Only the coarse quantizer
+        is loaded into memory; inverted lists and metadata are memory-mapped.
+
+        Args:
+            index_dir: Directory written by build_ondisk_index()
+            nprobe: Lists searched per query (default: the value stored at build time)
+            min_score: Default similarity cutoff for cosine indexes
+        """
+        self.index_dir = Path(index_dir)
+        self.min_score = min_score
+        # Vectors stay on disk; there is no in-memory embeddings array
+        self.embeddings = None
+        self.index = None
+        self.metadata = None
+        self._load_index(nprobe)
+
+    def _load_index(self, nprobe: Optional[int]):
+        import faiss
+
+        with open(self.index_dir / CONFIG_FILE, 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        # ONDISK_SAME_DIR resolves index.ivfdata next to index.ivf wherever the directory was moved
+        self.index = faiss.read_index(str(self.index_dir / INDEX_FILE), faiss.IO_FLAG_ONDISK_SAME_DIR)
+        self.index.nprobe = nprobe or self.config['nprobe']
+        self.metadata = MetadataStore(str(self.index_dir))
+        self.projection = load_projection(self.index_dir)
+        self.sentence_vectors = load_sentence_vectors(self.index_dir, self.index.d)
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 10,
+               min_score: Optional[float] = None) -> List[Dict]:
+        return self.search_batch(query_embedding, top_k, min_score)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     min_score: Optional[float] = None) -> List[List[Dict]]:
+        if self.index is None:
+            raise ValueError("On-disk index not loaded.")
+        metrics = get_metrics()
+        queries = np.ascontiguousarray(np.atleast_2d(query_embeddings), dtype=np.float32)
+        if self.projection is not None:
+            queries = self.projection.apply(queries)
+        # Indexes built before the metric was recorded are L2
+        cosine = self.config.get('metric', 'l2') == 'cosine'
+        if cosine:
+            queries = normalize_rows(queries)
+        min_score = self.min_score if min_score is None else min_score
+        threshold = min_score if cosine and min_score is not None else None
+        with metrics.span('faiss_search'):
+            D, I = self.index.search(queries, top_k)
+        with metrics.span('metadata'):
+            batch_results = []
+            for query, ids, dists in zip(queries, I, D):
+                results = []
+                for idx, dist in zip(ids, dists):
+                    # -1 when the probed lists hold fewer than top_k vectors
+                    if idx < 0:
+                        continue
+                    if threshold is not None and dist < threshold:
+                        break
+                    if cosine:
+                        results.append({**self.metadata[int(idx)], 'score': float(dist), 'distance': 1.0 - float(dist)})
+                    else:
+                        results.append({**self.metadata[int(idx)], 'distance': float(dist)})
+                annotate_best_sentences(results, query, self.sentence_vectors)
+                batch_results.append(results)
+        return batch_results
+
+    def close(self):
+        self.index = None
+        if self.metadata is not None:
+            self.metadata.close()
+            self.metadata = None
+
+
+# Page cache measurement (Linux)
+
+def page_cache_residency(path: str) -> float:
+    """Fraction of the file's pages currently in the OS page cache, via mincore(2)."""
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return 1.0
+        # A private mapping is writable from Python, which ctypes needs for the address
+        mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+        try:
+            num_pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            vec = (ctypes.c_ubyte * num_pages)()
+            anchor = ctypes.c_char.from_buffer(mapped)
+            try:
+                if libc.mincore(ctypes.c_void_p(ctypes.addressof(anchor)), ctypes.c_size_t(size), vec):
+                    raise OSError(ctypes.get_errno(), "mincore failed")
+            finally:
+                del anchor
+        finally:
+            mapped.close()
+    return float(np.count_nonzero(np.frombuffer(vec, dtype=np.uint8) & 1)) / num_pages
+
+
+def set_page_cache_fraction(path: str, fraction: float):
+    """Evict the file from the page cache, then ask the kernel to prefetch its first fraction."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        # Dirty pages (e.g. from a fresh build) can't be evicted until written back
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        if fraction > 0:
+            length = int(size * fraction)
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+            # WILLNEED is asynchronous; reading makes the warm-up deterministic
+            os.lseek(fd, 0, os.SEEK_SET)
+            remaining = length
+            while remaining > 0:
+                chunk = os.read(fd, min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+    finally:
+        os.close(fd)
+
+
+def bench_page_cache(index_dir: str, queries: np.ndarray, fractions: List[float] = (0.0, 0.25, 0.5, 0.75, 1.0),
+                     top_k: int = 10, nprobe: Optional[int] = None) -> List[Dict]:
+    """
+    Search latency of an on-disk index as a function of how much of it is in the page cache.
+
+    For each fraction the lists file is evicted and partly re-read, then every
+    query is timed once. Major page faults (reads that had to go to disk) are
+    counted per query. The hit rate is estimated from mincore(2): pages that
+    became resident during the run are misses, out of the pages spanned by the
+    lists the queries probed.
+    """
+    from utils.benchmark import latency_summary
+
+    lists_path = str(Path(index_dir) / LISTS_FILE)
+    results = []
+    for fraction in fractions:
+        set_page_cache_fraction(lists_path, fraction)
+        retriever = OnDiskRetriever(index_dir, nprobe=nprobe)
+        resident_before = page_cache_residency(lists_path)
+        faults_before = resource.getrusage(resource.RUSAGE_SELF).ru_majflt
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            retriever.search(query[None, :], top_k=top_k)
+            samples.append((time.perf_counter() - start) * 1000)
+        major_faults = resource.getrusage(resource.RUSAGE_SELF).ru_majflt - faults_before
+        resident_after = page_cache_residency(lists_path)
+        # Each query scans about nprobe/nlist of the lists file
+        pages_per_query = (os.path.getsize(lists_path) / mmap.PAGESIZE
+                           * retriever.index.nprobe / retriever.config['nlist'])
+        retriever.close()
+        accesses = pages_per_query * len(queries)
+        # Pages read in from disk during the run; readahead counts, a fault may read many pages
+        misses = max(0.0, resident_after - resident_before) * os.path.getsize(lists_path) / mmap.PAGESIZE
+        results.append({
+            'cached_fraction_target': fraction,
+            'resident_before': resident_before,
+            'resident_after': resident_after,
+            'major_faults_per_query': major_faults / len(queries),
+            'cache_hit_rate': max(0.0, 1.0 - misses / accesses) if accesses else 1.0,
+            **latency_summary(samples),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and benchmark disk-resident IVF indexes.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Build an on-disk index from an embeddings directory")
+    build.add_argument('embeddings_dir')
+    build.add_argument('out_dir')
+    build.add_argument('--nlist', type=int, default=None)
+    build.add_argument('--nprobe', type=int, default=16)
+    build.add_argument('--block-size', type=int, default=100_000)
+    build.add_argument('--metric', choices=['cosine', 'l2'], default='cosine')
+    bench = sub.add_parser('bench', help="Latency versus page-cache hit rate")
+    bench.add_argument('index_dir')
+    bench.add_argument('--queries-from', required=True,
+                       help="Embeddings directory to sample query vectors from")
+    bench.add_argument('--queries', type=int, default=200)
+    bench.add_argument('--nprobe', type=int, default=None)
+    bench.add_argument('--fractions', default='0,0.25,0.5,0.75,1')
+    bench.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_ondisk_index(args.embeddings_dir, args.out_dir, args.nlist, args.nprobe,
+                           block_size=args.block_size, metric=args.metric)
+        print(f"Built on-disk index in {args.out_dir}")
+    elif args.command == 'bench':
+        from utils.benchmark import sample_queries
+        embeddings = np.load(Path(args.queries_from) / 'embeddings.npy', mmap_mode='r')
+        queries = sample_queries(embeddings, args.queries, projection=load_projection(args.queries_from))
+        results = bench_page_cache(args.index_dir, queries, [float(f) for f in args.fractions.split(',') if f],
+                                   nprobe=args.nprobe)
+        print(f"{'cached':>7} {'resident':>9} {'hit rate':>9} {'faults/q':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for row in results:
+            print(f"{row['cached_fraction_target']:>7.2f} {row['resident_before']:>9.2f} "
+                  f"{row['cache_hit_rate']:>9.3f} {row['major_faults_per_query']:>9.2f} "
+                  f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'index_dir': args.index_dir, 'results': results}, f, indent=2)
+            print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
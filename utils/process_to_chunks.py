@@ -1,15 +1,102 @@
 import os
-import nltk
+import argparse
 import numpy as np
-from nltk.tokenize import sent_tokenize
 import json
 
-# Download required NLTK data
-try:
-    nltk.download('punkt', quiet=True)
-    nltk.download('punkt_tab', quiet=True)
-except Exception as e:
-    print(f"Warning: Could not download NLTK data: {e}")
+NLTK_RESOURCES = {'punkt': 'tokenizers/punkt', 'punkt_tab': 'tokenizers/punkt_tab'}
+
+_sent_tokenize = None
+_sent_tokenize_resolved = False
+
+
+def ensure_nltk_data(download: bool = False) -> bool:
+    """
+    Check that the NLTK sentence tokenizer data is available locally.
+    Nothing is fetched over the network unless download is True (or the
+    VECTOR_SEARCH_NLTK_DOWNLOAD environment variable is set).
+
+    Returns:
+        True if the data is available
+    """
+    global _sent_tokenize_resolved
+    import nltk
+    download = download or bool(os.environ.get('VECTOR_SEARCH_NLTK_DOWNLOAD'))
+    available = True
+    for name, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            if download:
+                try:
+                    nltk.download(name, quiet=True)
+                    continue
+                except Exception as e:
+                    print(f"Warning: Could not download NLTK data '{name}': {e}")
+            available = False
+    # Re-resolve the tokenizer after data may have been added
+    _sent_tokenize_resolved = False
+    return available
+
+
+def get_sent_tokenize():
+    """
+    Return NLTK's sent_tokenize if its data is installed, otherwise None.
+    Resolved once per process so NLTK is only imported on first use.
+    """
+    global _sent_tokenize, _sent_tokenize_resolved
+    if not _sent_tokenize_resolved:
+        _sent_tokenize_resolved = True
+        _sent_tokenize = None
+        try:
+            from nltk.tokenize import sent_tokenize
+            # NLTK before 3.8.2 loads 'punkt', later versions 'punkt_tab'; let it find its own
+            sent_tokenize("Probe sentence. Another one.")
+            _sent_tokenize = sent_tokenize
+        except (ImportError, LookupError):
+            print("Warning: NLTK punkt data not found, using simple sentence split. "
+                  "Run with --download-nltk to fetch it.")
+    return _sent_tokenize
+
+def sentence_offsets(sentences: list) -> list:
+    """
+    [start, end) character offsets of each sentence in " ".join(sentences).
+    """
+    offsets = []
+    start = 0
+    for sentence in sentences:
+        offsets.append([start, start + len(sentence)])
+        start += len(sentence) + 1
+    return offsets
+
+
+def split_sentences(text: str) -> list:
+    """
+    [start, end) character offsets of the sentences of text, e.g. a chunk saved
+    before offsets were recorded. Whitespace between sentences is not covered.
+    """
+    sent_tokenize = get_sent_tokenize()
+    try:
+        if sent_tokenize is None:
+            raise LookupError("NLTK punkt data not available")
+        sentences = sent_tokenize(text)
+    except Exception:
+        sentences = [s.strip() + '.' for s in text.split('.') if s.strip()]
+    offsets = []
+    position = 0
+    for sentence in sentences:
+        start = text.find(sentence, position)
+        if start < 0:
+            # The simple split adds a '.' that may not be in the text
+            start = text.find(sentence.rstrip('.'), position)
+            if start < 0:
+                continue
+            end = start + len(sentence.rstrip('.'))
+        else:
+            end = start + len(sentence)
+        offsets.append([start, end])
+        position = end
+    return offsets or ([[0, len(text)]] if text.strip() else [])
+
 
 class TextChunker:
     """
@@ -37,18 +124,34 @@ class TextChunker:
         Returns:
             List of text chunks
         """
+        return [" ".join(sentences) for sentences in self.chunk_sentences(text)]
+    
+    def chunk_sentences(self, text: str) -> list:
+        """
+        Chunk text like chunk_text_with_overlap, keeping each chunk's sentences.
+        
+        Args:
+            text: Input text to chunk
+            
+        Returns:
+            List of chunks, each a list of sentences; a chunk's text is " ".join(sentences)
+        """
         if not text or not text.strip():
             return []
         
+        sent_tokenize = get_sent_tokenize()
         try:
+            if sent_tokenize is None:
+                raise LookupError("NLTK punkt data not available")
             sentences = sent_tokenize(text)
         except Exception as e:
-            print(f"Warning: NLTK tokenization failed, using simple split: {e}")
+            if sent_tokenize is not None:
+                print(f"Warning: NLTK tokenization failed, using simple split: {e}")
             # Fallback to simple sentence splitting
             sentences = [s.strip() + '.' for s in text.split('.') if s.strip()]
         
         if not sentences:
-            return [text] if text.strip() else []
+            return [[text]] if text.strip() else []
         
         chunks = []
         current_chunk = []
@@ -62,9 +165,8 @@ class TextChunker:
             # If adding this sentence would exceed max_tokens and we have content
             if current_tokens + sentence_tokens > self.chunk_size and current_chunk:
                 # Save current chunk
-                chunk_text = " ".join(current_chunk)
-                if chunk_text.strip():  # Only add non-empty chunks
-                    chunks.append(chunk_text)
+                if " ".join(current_chunk).strip():  # Only add non-empty chunks
+                    chunks.append(list(current_chunk))
                 
                 # Start new chunk with overlap
                 overlap_chunk = []
@@ -88,9 +190,8 @@ class TextChunker:
             if sentence_tokens > self.chunk_size:
                 # If we have existing content, save it first
                 if current_chunk:
-                    chunk_text = " ".join(current_chunk)
-                    if chunk_text.strip():
-                        chunks.append(chunk_text)
+                    if " ".join(current_chunk).strip():
+                        chunks.append(list(current_chunk))
                     current_chunk = []
                     current_tokens = 0
                 
@@ -99,7 +200,7 @@ class TextChunker:
                 for k in range(0, len(words), self.chunk_size):
                     word_chunk = " ".join(words[k:k + self.chunk_size])
                     if word_chunk.strip():
-                        chunks.append(word_chunk)
+                        chunks.append([word_chunk])
             else:
                 current_chunk.append(sentence)
                 current_tokens += sentence_tokens
@@ -108,9 +209,8 @@ class TextChunker:
         
         # Add final chunk if it exists
         if current_chunk:
-            chunk_text = " ".join(current_chunk)
-            if chunk_text.strip():
-                chunks.append(chunk_text)
+            if " ".join(current_chunk).strip():
+                chunks.append(list(current_chunk))
         
         return chunks
     
@@ -151,7 +251,8 @@ class TextChunker:
                 if not raw_text.strip():
                     print(f"  Warning: {filename} is empty, skipping...")
                     continue
-                chunks = self.chunk_text_with_overlap(raw_text)
+                sentence_lists = self.chunk_sentences(raw_text)
+                chunks = [" ".join(sentences) for sentences in sentence_lists]
                 if not chunks:
                     print(f"  Warning: No chunks created for {filename}")
                     continue
@@ -171,7 +272,8 @@ class TextChunker:
                             "word_count": len(chunk.split()),
                             "char_count": len(chunk),
                             "url": url,
-                            "title": title
+                            "title": title,
+                            "sentence_offsets": sentence_offsets(sentence_lists[i])
                         })
                     except Exception as e:
                         print(f"  Error saving chunk {i} for {filename}: {e}")
@@ -184,6 +286,11 @@ class TextChunker:
 
 def main():
     """Main function to run the chunking process."""
+    parser = argparse.ArgumentParser(description="Chunk raw crawled pages.")
+    parser.add_argument('--download-nltk', action='store_true',
+                        help="Download missing NLTK tokenizer data before chunking")
+    args = parser.parse_args()
+    ensure_nltk_data(download=args.download_nltk)
     
     # Parameters
     input_folder = "data/raw"
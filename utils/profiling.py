@@ -0,0 +1,253 @@
+"""
+On-demand profiling of single searches and pipeline runs.
+
+A profiled run writes its artifacts to profiles/ (or VECTOR_SEARCH_PROFILE_DIR)
+under one stem, together with what triggered it, so a slow production request
+can be diagnosed without reproducing it:
+
+    <stem>.json         label, query/arguments, duration, modes, pid
+    <stem>.prof         cProfile stats (open with pstats or snakeviz)
+    <stem>.txt          top functions by cumulative time
+    <stem>.folded       sampled stacks in folded format (flamegraph.pl, speedscope)
+    <stem>.memory.txt   tracemalloc: top allocation sites during the run and peak
+
+Profiling is off unless VECTOR_SEARCH_PROFILE is set:
+
+    VECTOR_SEARCH_PROFILE=1                  profile every request / run (all modes)
+    VECTOR_SEARCH_PROFILE=cprofile,memory    profile every request with these modes
+    VECTOR_SEARCH_PROFILE=request            profile only requests that ask for it
+
+Requests ask with a flag (profile=1 or profile=sample in the search server's
+query string or the app's URL); it is ignored unless the variable is set, so
+production traffic can't turn profiling on by itself. Only one profile runs at
+a time; concurrent requests are served unprofiled. Modes are 'cprofile'
+(deterministic), 'sample' (stack sampling every VECTOR_SEARCH_PROFILE_SAMPLE_MS,
+default 5, low overhead) and 'memory' (tracemalloc).
+
+    python -m utils.profiling profiles/20250101-120000-search-123-1.json
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+MODES = ('cprofile', 'sample', 'memory')
+
+# One profile at a time: profilers hook the interpreter process-wide
+_active = threading.Lock()
+_counter = 0
+
+
+def parse_modes(value: Optional[str]) -> Tuple[str, ...]:
+    """Turn '1', 'all' or a comma-separated mode list into modes; empty or '0' means off."""
+    value = (value or '').strip().lower()
+    if not value or value in ('0', 'false', 'off'):
+        return ()
+    if value in ('1', 'true', 'on', 'all'):
+        return MODES
+    modes = tuple(m.strip() for m in value.split(',') if m.strip())
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError(f"Unknown profiling mode(s): {', '.join(sorted(unknown))}; expected {', '.join(MODES)}")
+    return modes
+
+
+def profiling_modes(requested: Optional[str] = None) -> Tuple[str, ...]:
+    """
+    Modes to profile with, from VECTOR_SEARCH_PROFILE and an optional per-request flag.
+
+    Args:
+        requested: Value of the request's profile flag, if any
+    """
+    setting = os.environ.get('VECTOR_SEARCH_PROFILE', '').strip().lower()
+    if not setting:
+        return ()
+    if setting == 'request':
+        return parse_modes(requested)
+    return parse_modes(requested) if requested else parse_modes(setting)
+
+
+class _StackSampler:
+    """Samples one thread's Python stack at a fixed interval and counts folded stacks."""
+
+    def __init__(self, thread_id: int, interval_s: float):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _write_memory_report(path: str, before, after, peak_bytes: int, top: int = 30):
+    # Leave out the sampler's own allocations
+    exclude = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(exclude).compare_to(before.filter_traces(exclude), 'lineno')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Peak traced memory: {peak_bytes / 2**20:.1f} MiB\n")
+        f.write(f"Net allocated during run: {sum(s.size_diff for s in stats) / 2**20:.1f} MiB\n\n")
+        f.write(f"Top {top} allocation sites by growth:\n")
+        for stat in stats[:top]:
+            f.write(f"{stat}\n")
+
+
+def _stem(profile_dir: str, label: str) -> str:
+    global _counter
+    _counter += 1
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}-{os.getpid()}-{_counter}"
+    return os.path.join(profile_dir, name)
+
+
+@contextmanager
+def profile(label: str, modes: Tuple[str, ...] = None, profile_dir: Optional[str] = None, **context):
+    """
+    Profile the enclosed block if any modes are enabled; otherwise do nothing.
+
+    Args:
+        label: Short name of what is profiled, e.g. 'search' or 'generate_embeddings'
+        modes: Profiling modes (default: from VECTOR_SEARCH_PROFILE)
+        profile_dir: Output directory (default: VECTOR_SEARCH_PROFILE_DIR or profiles/)
+        context: What triggered the run (query, arguments, ...), saved with the profile
+
+    Yields:
+        The artifact path stem, or None when not profiling
+    """
+    modes = profiling_modes() if modes is None else modes
+    if not modes or not _active.acquire(blocking=False):
+        yield None
+        return
+    try:
+        profile_dir = profile_dir or os.environ.get('VECTOR_SEARCH_PROFILE_DIR') or DEFAULT_PROFILE_DIR
+        os.makedirs(profile_dir, exist_ok=True)
+        stem = _stem(profile_dir, label)
+        sampler = profiler = None
+        started_tracing = False
+        if 'memory' in modes:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(25)
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.take_snapshot()
+        if 'sample' in modes:
+            interval_ms = float(os.environ.get('VECTOR_SEARCH_PROFILE_SAMPLE_MS', '5'))
+            sampler = _StackSampler(threading.get_ident(), interval_ms / 1000)
+            sampler.start()
+        if 'cprofile' in modes:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started_at = datetime.now()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield stem
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            duration_s = time.perf_counter() - start
+            # Stop every collector before writing anything, so no mode records another's output
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            if 'memory' in modes:
+                memory_after = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+            files = []
+            if profiler is not None:
+                profiler.dump_stats(stem + '.prof')
+                with open(stem + '.txt', 'w', encoding='utf-8') as f:
+                    pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+                files += [stem + '.prof', stem + '.txt']
+            if sampler is not None:
+                sampler.write(stem + '.folded')
+                files.append(stem + '.folded')
+            if 'memory' in modes:
+                _write_memory_report(stem + '.memory.txt', memory_before, memory_after, peak)
+                files.append(stem + '.memory.txt')
+            record = {'label': label, 'context': context, 'started_at': started_at.isoformat(),
+                      'duration_ms': duration_s * 1000, 'modes': list(modes), 'pid': os.getpid(),
+                      'error': error, 'samples': sampler.samples if sampler else None,
+                      'files': [os.path.basename(p) for p in files]}
+            with open(stem + '.json', 'w', encoding='utf-8') as f:
+                json.dump(record, f, indent=2, ensure_ascii=False, default=str)
+    finally:
+        _active.release()
+
+
+def summarize(meta_path: str, top: int = 15) -> Dict:
+    """Load a profile's metadata and print its hottest functions and sampled stacks."""
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        record = json.load(f)
+    stem = meta_path[:-len('.json')]
+    print(f"{record['label']} ({', '.join(record['modes'])}): {record['duration_ms']:.1f} ms, "
+          f"context {json.dumps(record['context'], ensure_ascii=False)}")
+    if os.path.exists(stem + '.prof'):
+        print()
+        pstats.Stats(stem + '.prof').sort_stats('cumulative').print_stats(top)
+    if os.path.exists(stem + '.folded'):
+        leaves = Counter()
+        with open(stem + '.folded', 'r', encoding='utf-8') as f:
+            for line in f:
+                stack, count = line.rsplit(' ', 1)
+                leaves[stack.rsplit(';', 1)[-1]] += int(count)
+        total = sum(leaves.values()) or 1
+        print(f"Hottest frames over {total} samples:")
+        for frame, count in leaves.most_common(top):
+            print(f"  {count / total:>6.1%}  {frame}")
+    if os.path.exists(stem + '.memory.txt'):
+        print()
+        with open(stem + '.memory.txt', 'r', encoding='utf-8') as f:
+            print(''.join(f.readlines()[:top + 4]))
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a captured profile.")
+    parser.add_argument('profile', help="The profile's .json metadata file")
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    summarize(args.profile, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Dimensionality reduction of stored embeddings.
+
+A projection maps the model's 384-dim vectors to fewer dimensions before they
+are indexed. It is saved as projection.npz next to embeddings.npy, and every
+retriever that loads the directory applies it to incoming query (and upsert)
+vectors, so documents and queries always live in the same space.
+
+Two methods:
+    pca       PCA trained on the corpus; keeps the directions with most variance
+    truncate  keep the first dims (for Matryoshka-trained models, whose leading
+              dimensions carry most of the information)
+
+    python -m utils.projection data/embeddings/faiss /tmp/faiss_128 --dim 128
+"""
+
+import os
+import shutil
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Optional
+
+from utils.snippets import SENTENCE_VECTORS_FILE
+
+PROJECTION_FILE = 'projection.npz'
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so inner product equals cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Projection:
+    """
+    Affine map x -> (x - mean) @ components.T.
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, method: str = 'pca'):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.method = method
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """Project vectors of input_dim dims."""
+        vectors = np.atleast_2d(vectors).astype(np.float32, copy=False)
+        if vectors.shape[1] != self.input_dim:
+            raise ValueError(f"Expected {self.input_dim}-dim vectors to project, got {vectors.shape[1]}")
+        return (vectors - self.mean) @ self.components.T
+
+    def invert(self, vectors: np.ndarray) -> np.ndarray:
+        """Map projected vectors back to input_dim dims; apply() of the result returns them unchanged."""
+        vectors = np.atleast_2d(vectors).astype(np.float32, copy=False)
+        return vectors @ self.components + self.mean
+
+    def save(self, directory: str):
+        np.savez(os.path.join(directory, PROJECTION_FILE), mean=self.mean,
+                 components=self.components, method=np.array(self.method))
+
+
+def train_projection(embeddings: np.ndarray, dim: int, method: str = 'pca',
+                     sample_size: int = 100_000, seed: int = 0) -> Projection:
+    """
+    Fit a projection to dim dimensions.
+
+    Args:
+        embeddings: Corpus vectors (may be memory-mapped)
+        dim: Output dimension
+        method: 'pca' or 'truncate'
+        sample_size: Vectors sampled to fit PCA
+    """
+    input_dim = embeddings.shape[1]
+    if not 0 < dim <= input_dim:
+        raise ValueError(f"Projection dim must be between 1 and {input_dim}, got {dim}")
+    if method == 'truncate':
+        return Projection(np.zeros(input_dim, dtype=np.float32),
+                          np.eye(input_dim, dtype=np.float32)[:dim], method)
+    if method != 'pca':
+        raise ValueError(f"Unknown projection method: {method}")
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(embeddings), size=min(sample_size, len(embeddings)), replace=False))
+    sample = np.asarray(embeddings[rows], dtype=np.float64)
+    mean = sample.mean(axis=0)
+    # Right singular vectors of the centered sample are the principal axes, largest variance first
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return Projection(mean, vt[:dim], method)
+
+
+def load_projection(directory: str) -> Optional[Projection]:
+    """The projection saved with an index directory, or None if it stores full-size vectors."""
+    path = Path(directory) / PROJECTION_FILE
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        return Projection(data['mean'], data['components'], str(data['method']))
+
+
+def project_index(embeddings_dir: str, out_dir: str, dim: int, method: str = 'pca',
+                  block_size: int = 100_000) -> Projection:
+    """
+    Write a projected copy of an index directory: embeddings.npy at dim dims,
+    projection.npz, sentence vectors (when present) projected the same way, and
+    the other files unchanged.
+    """
+
+    src = Path(embeddings_dir)
+    embeddings = np.load(src / 'embeddings.npy', mmap_mode='r')
+    if load_projection(embeddings_dir) is not None:
+        raise ValueError(f"{embeddings_dir} is already projected")
+    projection = train_projection(embeddings, dim, method)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(src):
+        if (name not in ('embeddings.npy', PROJECTION_FILE, SENTENCE_VECTORS_FILE)
+                and not name.endswith('.lock') and (src / name).is_file()):
+            shutil.copy2(src / name, Path(out_dir) / name)
+    out = np.lib.format.open_memmap(os.path.join(out_dir, 'embeddings.npy'), mode='w+',
+                                    dtype=np.float32, shape=(len(embeddings), dim))
+    for start in range(0, len(embeddings), block_size):
+        out[start:start + block_size] = projection.apply(embeddings[start:start + block_size])
+    out.flush()
+    del out
+    if (src / SENTENCE_VECTORS_FILE).exists():
+        # Stored like generate_embeddings does: projected, normalized, float16
+        sentences = np.load(src / SENTENCE_VECTORS_FILE, mmap_mode='r')
+        out = np.lib.format.open_memmap(os.path.join(out_dir, SENTENCE_VECTORS_FILE), mode='w+',
+                                        dtype=np.float16, shape=(len(sentences), dim))
+        for start in range(0, len(sentences), block_size):
+            block = projection.apply(np.asarray(sentences[start:start + block_size], dtype=np.float32))
+            out[start:start + block_size] = normalize_rows(block).astype(np.float16)
+        out.flush()
+        del out
+    projection.save(out_dir)
+    return projection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a dimensionality-reduced copy of an index directory.")
+    parser.add_argument('embeddings_dir')
+    parser.add_argument('out_dir')
+    parser.add_argument('--dim', type=int, required=True)
+    parser.add_argument('--method', choices=['pca', 'truncate'], default='pca')
+    args = parser.parse_args()
+    projection = project_index(args.embeddings_dir, args.out_dir, args.dim, args.method)
+    print(f"Projected {args.embeddings_dir} from {projection.input_dim} to {projection.dim} dims "
+          f"({args.method}) into {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Budgeted cross-encoder reranking.
+
+A cross-encoder reads the query and a chunk together and scores their
+relevance far better than vector similarity, but costs a transformer pass per
+pair. The reranker therefore scores only the top_n vector hits, in one batch,
+under a hard per-query time budget: if the batch is not done within budget_ms
+the query is answered in vector order. A batch that already started still
+finishes in the background and its scores are cached, keyed by (query, chunk),
+so a repeated query is reranked from the cache without running the model. At
+most max_pending batches are queued or running; past that, queries are answered
+in vector order without submitting more work.
+
+Enabled in the app and the search server with VECTOR_SEARCH_RERANK=1 (or a
+cross-encoder model name); VECTOR_SEARCH_RERANK_TOP_N and
+VECTOR_SEARCH_RERANK_BUDGET_MS override top_n and budget_ms. utils.evaluate
+--rerank reports the latency it adds against the ranking gain.
+
+    python -m utils.reranker "home dialysis options"
+"""
+
+import os
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional
+
+from utils.faiss_retriever import chunk_key
+from utils.metrics import get_metrics
+
+DEFAULT_RERANK_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+
+class CrossEncoderReranker:
+    """
+    Reorders the top vector hits by cross-encoder score within a time budget.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, top_n: int = 20, budget_ms: float = 200.0,
+                 cache_size: int = 10_000, max_length: int = 256, batch_size: int = 32,
+                 max_pending: int = 2):
+        """
+        Args:
+            model_name: sentence-transformers CrossEncoder name or path
+            top_n: Vector hits scored per query; the rest keep their vector order after them
+            budget_ms: Time a query waits for scores before falling back to vector order
+            cache_size: (query, chunk) scores kept, least recently used evicted first
+            max_length: Token limit for a query + chunk pair
+            batch_size: Pairs per model forward pass
+            max_pending: Batches queued or running before new queries skip reranking
+        """
+        self.model_name = model_name
+        self.top_n = top_n
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # One scorer thread: a batch already uses every core, so concurrent batches only queue
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rerank')
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, max_length=self.max_length, device='cpu')
+            return self._model
+
+    def warmup(self):
+        """Load the model and run one pair so the first query isn't charged for it."""
+        self.model.predict([('warmup', 'warmup')], show_progress_bar=False)
+
+    def _cached(self, query: str, keys: List[str]) -> Dict[str, float]:
+        found = {}
+        with self._cache_lock:
+            for key in keys:
+                score = self._cache.get((query, key))
+                if score is not None:
+                    self._cache.move_to_end((query, key))
+                    found[key] = score
+        return found
+
+    def _score(self, query: str, keys: List[str], texts: List[str]) -> Dict[str, float]:
+        scores = self.model.predict([(query, text) for text in texts], batch_size=self.batch_size,
+                                    show_progress_bar=False)
+        scored = {key: float(score) for key, score in zip(keys, scores)}
+        with self._cache_lock:
+            for key, score in scored.items():
+                self._cache[(query, key)] = score
+                self._cache.move_to_end((query, key))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scored
+
+    def scores(self, query: str, results: List[Dict], budget_ms: Optional[float] = None) -> Optional[Dict[str, float]]:
+        """
+        Cross-encoder scores for results keyed by chunk, or None if they were not ready within the budget.
+        """
+        metrics = get_metrics()
+        keys = [chunk_key(r) for r in results]
+        scores = self._cached(query, keys)
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+        metrics.inc('rerank_cache_hits', len(keys) - len(missing))
+        if not missing:
+            return scores
+        budget_s = (self.budget_ms if budget_ms is None else budget_ms) / 1000
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                # The scorer is behind; queueing more would only make every later query time out
+                metrics.inc('rerank_skipped')
+                return None
+            self._pending += 1
+        future = self._executor.submit(self._score, query, [keys[i] for i in missing],
+                                       [results[i].get('content', '') for i in missing])
+        future.add_done_callback(self._batch_done)
+        try:
+            scores.update(future.result(timeout=budget_s))
+        except TimeoutError:
+            # The batch still runs and fills the cache for the next time this query comes in
+            metrics.inc('rerank_timeouts')
+            return None
+        return scores
+
+    def _batch_done(self, future):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def rerank(self, query: str, results: List[Dict], budget_ms: Optional[float] = None) -> List[Dict]:
+        """
+        Reorder the first top_n results by cross-encoder score.
+
+        Reranked results get a 'rerank_score'. When the budget runs out the
+        results are returned unchanged.
+        """
+        if not results:
+            return results
+        head, tail = results[:self.top_n], results[self.top_n:]
+        with get_metrics().span('rerank'):
+            scores = self.scores(query, head, budget_ms)
+        if scores is None:
+            return results
+        reranked = [{**r, 'rerank_score': scores[chunk_key(r)]} for r in head]
+        # Stable sort: ties keep their vector order
+        reranked.sort(key=lambda r: -r['rerank_score'])
+        return reranked + tail
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def reranker_from_env() -> Optional[CrossEncoderReranker]:
+    """Warmed-up reranker configured by VECTOR_SEARCH_RERANK ('1' or a model name), or None when unset."""
+    setting = os.environ.get('VECTOR_SEARCH_RERANK', '').strip()
+    if not setting or setting == '0':
+        return None
+    model_name = DEFAULT_RERANK_MODEL if setting == '1' else setting
+    reranker = CrossEncoderReranker(model_name, top_n=int(os.environ.get('VECTOR_SEARCH_RERANK_TOP_N', '20')),
+                                    budget_ms=float(os.environ.get('VECTOR_SEARCH_RERANK_BUDGET_MS', '200')))
+    # Load the model now, not inside the first query's budget
+    reranker.warmup()
+    return reranker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rerank vector search results with a cross-encoder.")
+    parser.add_argument('query')
+    parser.add_argument('--embeddings-dir', default='data/embeddings/faiss')
+    parser.add_argument('--model', default=DEFAULT_RERANK_MODEL)
+    parser.add_argument('--encoder', default=None, help="Query encoder backend: torch, onnx or onnx-int8")
+    parser.add_argument('--top-n', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, default=200.0)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+
+    from utils.encoders import get_encoder
+    from utils.faiss_retriever import FaissRetriever
+    retriever = FaissRetriever(args.embeddings_dir)
+    reranker = CrossEncoderReranker(args.model, args.top_n, args.budget_ms)
+    reranker.warmup()
+    results = retriever.search(get_encoder(args.encoder).encode([args.query]), top_k=max(args.top_k, args.top_n))
+    for attempt in ('cold', 'cached'):
+        start = time.perf_counter()
+        reranked = reranker.rerank(args.query, results)
+        print(f"{attempt}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    vector_rank = {chunk_key(r): i for i, r in enumerate(results, start=1)}
+    for rank, r in enumerate(reranked[:args.top_k], start=1):
+        print(f"{rank:>3} (vector #{vector_rank[chunk_key(r)]:>2}) {r.get('rerank_score', float('nan')):>7.3f}  "
+              f"{r.get('title', '')}")
+    reranker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,98 @@ import requests
 from bs4 import BeautifulSoup
 import time
 import re
+import hashlib
 from urllib.parse import urljoin, urlparse
 import json
 
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+
+
+class BoilerplateDetector:
+    """
+    Learns DOM blocks that repeat across many crawled pages (header, menus,
+    footer, newsletter sign-up, ...) and strips them from each page.
+    A block is identified by its tag name and normalized text, so the same
+    menu rendered on every page gets the same fingerprint.
+    """
+    BLOCK_TAGS = ['header', 'nav', 'footer', 'aside', 'form', 'section', 'div',
+                  'ul', 'ol', 'table', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+    def __init__(self, min_page_fraction=0.3, min_pages=3, min_chars=20):
+        """
+        Args:
+            min_page_fraction: Fraction of pages a block must appear on to count as boilerplate
+            min_pages: Minimum number of pages a block must appear on
+            min_chars: Blocks with less text than this are never fingerprinted
+        """
+        self.min_page_fraction = min_page_fraction
+        self.min_pages = min_pages
+        self.min_chars = min_chars
+        self.page_counts = {}
+        self.num_pages = 0
+
+    def fingerprint(self, element):
+        text = re.sub(r'\s+', ' ', element.get_text(' ')).strip().lower()
+        if len(text) < self.min_chars:
+            return None
+        return hashlib.md5(f"{element.name}:{text}".encode('utf-8')).hexdigest()
+
+    def _fingerprints(self, soup):
+        fingerprints = set()
+        for element in soup.find_all(self.BLOCK_TAGS):
+            fp = self.fingerprint(element)
+            if fp:
+                fingerprints.add(fp)
+        return fingerprints
+
+    def add_page(self, soup):
+        """Count the blocks of one more page."""
+        self.num_pages += 1
+        for fp in self._fingerprints(soup):
+            self.page_counts[fp] = self.page_counts.get(fp, 0) + 1
+
+    def fit(self, soups):
+        """Count on how many pages each block fingerprint appears."""
+        self.page_counts = {}
+        self.num_pages = 0
+        for soup in soups:
+            self.add_page(soup)
+        return self
+
+    def is_boilerplate(self, fp):
+        count = self.page_counts.get(fp, 0)
+        return count >= self.min_pages and count >= self.min_page_fraction * self.num_pages
+
+    def strip(self, soup):
+        """Remove learned boilerplate blocks from soup in place. Returns the number removed."""
+        removed = 0
+        # find_all returns elements in document order, so parents are visited
+        # before their children and a removed block takes its subtree with it
+        for element in soup.find_all(self.BLOCK_TAGS):
+            if element.decomposed:
+                continue
+            fp = self.fingerprint(element)
+            if fp and self.is_boilerplate(fp):
+                element.decompose()
+                removed += 1
+        return removed
+
 
 class DCCSiteCrawler:
     """
     Crawler for dccdialysis.com that discovers and saves all internal pages.
     Each page is saved as both .txt (main text) and .json (url, title, text).
+    Raw HTML is written to html/ under the output directory as pages are
+    fetched, while their blocks are counted; once the whole site has been seen
+    the saved pages are read back one at a time, stripped of the blocks that
+    repeat across pages and written out.
     """
-    def __init__(self, base_url="https://dccdialysis.com", delay=1.0, out_dir=None):
+    def __init__(self, base_url="https://dccdialysis.com", delay=1.0, out_dir=None,
+                 parser=DEFAULT_PARSER, boilerplate_detector=None):
         self.base_url = base_url.rstrip('/')
         self.domain = urlparse(self.base_url).netloc
         self.session = requests.Session()
@@ -30,7 +112,10 @@ class DCCSiteCrawler:
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             out_dir = os.path.join(base_dir, "data", "raw")
         self.out_dir = out_dir
-        os.makedirs(self.out_dir, exist_ok=True)
+        self.html_dir = os.path.join(out_dir, "html")
+        os.makedirs(self.html_dir, exist_ok=True)
+        self.parser = parser
+        self.boilerplate_detector = boilerplate_detector or BoilerplateDetector()
 
     def clean_text(self, text):
         if not text:
@@ -47,6 +132,13 @@ class DCCSiteCrawler:
             print(f"Error fetching {url}: {e}")
             return None
 
+    def parse(self, html):
+        soup = BeautifulSoup(html, self.parser)
+        # Remove script/style up front so they never reach fingerprints or text
+        for tag in soup(["script", "style", "noscript"]):
+            tag.decompose()
+        return soup
+
     def extract_main_text(self, soup):
         # Try to find main content area
         for selector in ['main', '.main-content', '.content', 'article', 'body']:
@@ -79,10 +171,47 @@ class DCCSiteCrawler:
         parsed = urlparse(urljoin(self.base_url, url))
         return parsed.netloc == self.domain
 
+    def save_pages(self, pages):
+        """
+        Strip learned boilerplate from saved raw pages and save their text.
+        Prints token counts per page before and after stripping.
+
+        Args:
+            pages: (url, html_path) pairs; the detector must already have seen them
+        """
+        total_before = total_after = 0
+        for url, html_path in pages:
+            with open(html_path, 'r', encoding='utf-8') as f:
+                soup = self.parse(f.read())
+            title = self.extract_title(soup)
+            tokens_before = len(self.extract_main_text(soup).split())
+            self.boilerplate_detector.strip(soup)
+            text = self.extract_main_text(soup)
+            tokens_after = len(text.split())
+            total_before += tokens_before
+            total_after += tokens_after
+            print(f"  {url}: {tokens_before} -> {tokens_after} tokens")
+            slug = self.slugify(url)
+            # Save .txt
+            txt_path = os.path.join(self.out_dir, f"{slug}.txt")
+            with open(txt_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            # Save .json
+            json_path = os.path.join(self.out_dir, f"{slug}.json")
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump({"url": url, "title": title, "text": text,
+                           "token_count_raw": tokens_before, "token_count": tokens_after},
+                          f, ensure_ascii=False, indent=2)
+        if total_before:
+            print(f"Boilerplate stripping: {total_before} -> {total_after} tokens "
+                  f"({100.0 * (total_before - total_after) / total_before:.1f}% removed)")
+
     def crawl(self):
         queue = [self.base_url]
         self.visited = set()
-        print(f"Starting crawl at {self.base_url}")
+        self.boilerplate_detector.fit([])
+        pages = []
+        print(f"Starting crawl at {self.base_url} (parser: {self.parser})")
         while queue:
             url = queue.pop(0)
             if url in self.visited:
@@ -91,18 +220,13 @@ class DCCSiteCrawler:
             html = self.get_page(url)
             if not html:
                 continue
-            soup = BeautifulSoup(html, 'html.parser')
-            title = self.extract_title(soup)
-            text = self.extract_main_text(soup)
-            slug = self.slugify(url)
-            # Save .txt
-            txt_path = os.path.join(self.out_dir, f"{slug}.txt")
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write(text)
-            # Save .json
-            json_path = os.path.join(self.out_dir, f"{slug}.json")
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump({"url": url, "title": title, "text": text}, f, ensure_ascii=False, indent=2)
+            # Only the path is kept in memory; the page is read back for the boilerplate pass
+            html_path = os.path.join(self.html_dir, f"{self.slugify(url)}.html")
+            with open(html_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            soup = self.parse(html)
+            self.boilerplate_detector.add_page(soup)
+            pages.append((url, html_path))
             self.visited.add(url)
             # Find new links
             for a in soup.find_all('a', href=True):
@@ -113,6 +237,7 @@ class DCCSiteCrawler:
                     if link not in self.visited and link not in queue:
                         queue.append(link)
             time.sleep(self.delay)
+        self.save_pages(pages)
         print(f"Crawling complete. {len(self.visited)} pages saved to {self.out_dir}")
 
 
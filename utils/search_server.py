@@ -0,0 +1,246 @@
+"""
+Multi-process JSON search API.
+
+The parent process publishes the index into shared memory once, binds the
+listening socket and forks the workers. Each worker attaches to the shared
+index zero-copy (see utils.shared_index) and loads its own query encoder, so
+adding workers multiplies CPU, not index memory:
+
+    python -m utils.search_server --workers 4 --port 8000
+
+Endpoints:
+    GET /search?q=<query>&k=10[&min_score=0.3][&profile=1]
+                                 ranked results as JSON; hits below min_score are dropped;
+                                 profile captures this request (see utils.profiling)
+    GET /suggest?q=<prefix>&k=8  type-ahead completions from titles and past queries
+    GET /healthz                 liveness
+    GET /stats                   worker pid and private/shared memory usage
+    GET /metrics                 Prometheus text for the answering worker
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from utils.shared_index import DEFAULT_SHARED_DIR, publish_shared_index, memory_usage
+from utils.metrics import get_metrics
+from utils.profiling import profile, profiling_modes
+
+
+class SearchService:
+    """
+    Encoder and retriever for one worker, created lazily after fork.
+    """
+
+    def __init__(self, shared_dir: str, encoder_backend: str = None, model_name: str = 'all-MiniLM-L6-v2'):
+        self.shared_dir = shared_dir
+        self.encoder_backend = encoder_backend
+        self.model_name = model_name
+        self._encoder = None
+        self._retriever = None
+        self.suggester = None
+        self._reranker = None
+        self._reranker_loaded = False
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from utils.encoders import get_encoder
+            self._encoder = get_encoder(self.encoder_backend, self.model_name)
+        return self._encoder
+
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            from utils.shared_index import SharedIndexRetriever
+            self._retriever = SharedIndexRetriever(self.shared_dir)
+        return self._retriever
+
+    @property
+    def reranker(self):
+        # Optional cross-encoder stage from VECTOR_SEARCH_RERANK; created after fork like the encoder
+        if not self._reranker_loaded:
+            from utils.reranker import reranker_from_env
+            self._reranker = reranker_from_env()
+            self._reranker_loaded = True
+        return self._reranker
+
+    def search(self, query: str, top_k: int = 10, min_score: float = None):
+        metrics = get_metrics()
+        reranker = self.reranker
+        with metrics.trace(query=query):
+            with metrics.span('encode'):
+                embedding = self.encoder.encode([query])
+            with metrics.span('search'):
+                results = self.retriever.search(embedding, top_k=max(top_k, reranker.top_n) if reranker else top_k,
+                                                min_score=min_score)
+            if reranker:
+                results = reranker.rerank(query, results)[:top_k]
+        if results and self.suggester is not None:
+            # Per-worker popularity, suggested after MIN_QUERY_COUNT searches; restarts fall back to the trace log
+            self.suggester.record(query)
+        return results
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    service: SearchService = None
+
+    def _send(self, status: int, body, content_type: str = 'application/json'):
+        payload = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/search':
+            query = params.get('q', [''])[0].strip()
+            if not query:
+                self._send(400, {'error': "missing query parameter 'q'"})
+                return
+            try:
+                top_k = int(params.get('k', ['10'])[0])
+            except ValueError:
+                self._send(400, {'error': "'k' must be an integer"})
+                return
+            try:
+                min_score = float(params['min_score'][0]) if 'min_score' in params else None
+            except ValueError:
+                self._send(400, {'error': "'min_score' must be a number"})
+                return
+            try:
+                modes = profiling_modes(params.get('profile', [None])[0])
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+                return
+            start = time.perf_counter()
+            try:
+                with profile('search', modes, query=query, k=top_k, min_score=min_score) as profile_stem:
+                    results = self.service.search(query, top_k, min_score)
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+                return
+            body = {'query': query, 'results': results,
+                    'took_ms': (time.perf_counter() - start) * 1000, 'worker': os.getpid()}
+            if profile_stem:
+                body['profile'] = os.path.basename(profile_stem)
+            self._send(200, body)
+        elif url.path == '/suggest':
+            try:
+                limit = int(params.get('k', ['8'])[0])
+            except ValueError:
+                self._send(400, {'error': "'k' must be an integer"})
+                return
+            prefix = params.get('q', [''])[0]
+            suggestions = self.service.suggester.suggest(prefix, limit) if self.service.suggester else []
+            self._send(200, {'query': prefix, 'suggestions': suggestions})
+        elif url.path == '/healthz':
+            self._send(200, {'status': 'ok', 'worker': os.getpid()})
+        elif url.path == '/stats':
+            self._send(200, {'worker': os.getpid(), 'memory_kib': memory_usage()})
+        elif url.path == '/metrics':
+            self._send(200, get_metrics().to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        # Keep request logging out of the latency path
+        pass
+
+
+def _run_worker(sock: socket.socket, service: SearchService):
+    SearchRequestHandler.service = service
+    # Load and warm up the optional reranker before taking requests, not inside the first one's budget
+    service.reranker
+    server = ThreadingHTTPServer(sock.getsockname()[:2], SearchRequestHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    os._exit(0)
+
+
+def _spawn_worker(sock: socket.socket, service: SearchService) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        _run_worker(sock, service)
+    return pid
+
+
+def serve(host: str, port: int, workers: int, shared_dir: str, embeddings_dir: str = None,
+          encoder_backend: str = None, model_name: str = 'all-MiniLM-L6-v2'):
+    """Publish the index, then fork workers that share it and the listening socket."""
+    if embeddings_dir:
+        publish_shared_index(embeddings_dir, shared_dir)
+        print(f"Published {embeddings_dir} to {shared_dir}")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    service = SearchService(shared_dir, encoder_backend, model_name)
+    # Built before forking so workers share the index pages copy-on-write
+    from utils.suggest import build_suggest_index
+    service.suggester = build_suggest_index(embeddings_dir or shared_dir)
+    children = {_spawn_worker(sock, service) for _ in range(workers)}
+    print(f"Serving on http://{host}:{port} with {workers} workers")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            # Replace crashed workers so capacity stays constant
+            print(f"Worker {pid} exited, restarting", file=sys.stderr)
+            children.add(_spawn_worker(sock, service))
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve vector search over HTTP with forked workers.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--embeddings-dir', default='data/embeddings/faiss',
+                        help="Index to publish into shared memory before forking")
+    parser.add_argument('--shared-dir', default=DEFAULT_SHARED_DIR)
+    parser.add_argument('--no-publish', action='store_true',
+                        help="Attach to an index another loader already published")
+    parser.add_argument('--encoder', default=None, help="Query encoder backend: torch, onnx or onnx-int8")
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.shared_dir,
+          None if args.no_publish else args.embeddings_dir, args.encoder, args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""
+Sharded retrieval with scatter-gather search.
+
+The vectors in embeddings.npy are split into contiguous row ranges, one per
+shard. Each shard runs in its own process with its own FAISS index and serves
+searches over a multiprocessing connection (a Unix socket by default, or TCP
+so shards can later live on other machines). ShardedRetriever sends every
+query to all shards at once, waits for their partial top-k lists and merges
+them into a global top-k. Metadata stays in the coordinating process.
+
+Local shards:
+
+    retriever = ShardedRetriever('data/embeddings/faiss', num_shards=4)
+    results = retriever.search(query_embedding, top_k=10)
+    print(retriever.shard_stats())
+
+Remote shards started with `python -m utils.sharded_retriever serve ...` are
+used by passing their addresses instead of num_shards. Connections unpickle
+what they receive, so the authkey is what keeps anyone else from running code
+in a shard: local shards get a random one, and shards on a non-loopback
+address need one given explicitly (--authkey or VECTOR_SEARCH_SHARD_AUTHKEY)
+on both sides.
+"""
+
+import os
+import time
+import json
+import argparse
+import tempfile
+import threading
+import numpy as np
+from collections import deque
+from multiprocessing import AuthenticationError, get_context
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.metrics import get_metrics
+from utils.projection import load_projection, normalize_rows
+
+# Only for shards reachable from this machine alone; anything else needs a real secret
+LOOPBACK_AUTHKEY = b'vector-search'
+_LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def _is_loopback(address) -> bool:
+    # Unix socket paths are strings; TCP addresses are (host, port)
+    return isinstance(address, str) or str(address[0]) in _LOOPBACK_HOSTS or str(address[0]).startswith('127.')
+
+
+def shard_authkey(authkey: Optional[str] = None, addresses: Sequence = ()) -> bytes:
+    """
+    The authkey for shard connections: the given one, else VECTOR_SEARCH_SHARD_AUTHKEY.
+
+    Raises:
+        ValueError: If neither is set and any address is not on the loopback interface
+    """
+    authkey = authkey or os.environ.get('VECTOR_SEARCH_SHARD_AUTHKEY')
+    if authkey:
+        return authkey.encode('utf-8') if isinstance(authkey, str) else authkey
+    exposed = [address for address in addresses if not _is_loopback(address)]
+    if exposed:
+        raise ValueError(f"Shard connections to {exposed[0]} need an authkey: pass --authkey or set "
+                         f"VECTOR_SEARCH_SHARD_AUTHKEY (connections unpickle what they receive)")
+    return LOOPBACK_AUTHKEY
+
+
+def shard_bounds(num_rows: int, num_shards: int) -> List[Tuple[int, int]]:
+    """Split num_rows into num_shards contiguous, nearly equal row ranges."""
+    edges = np.linspace(0, num_rows, num_shards + 1).astype(int)
+    return [(int(edges[i]), int(edges[i + 1])) for i in range(num_shards)]
+
+
+def serve_shard(embeddings_path: str, start: int, end: int, address=None,
+                authkey: bytes = LOOPBACK_AUTHKEY, num_threads: int = 1, ready=None,
+                metric: str = 'cosine'):
+    """
+    Serve searches over rows [start, end) of embeddings_path until told to close.
+
+    Messages are tuples: ('search', queries, top_k) -> (scores or distances, global_ids, search_ms),
+    ('stats',) -> dict, ('close',) -> None. With the cosine metric the rows are
+    normalized into an inner-product index and replies carry similarities;
+    queries must arrive normalized.
+    """
+    import faiss
+
+    faiss.omp_set_num_threads(num_threads)
+    vectors = np.ascontiguousarray(np.load(embeddings_path, mmap_mode='r')[start:end], dtype=np.float32)
+    if metric == 'cosine':
+        vectors = normalize_rows(vectors)
+    index = (faiss.IndexFlatIP if metric == 'cosine' else faiss.IndexFlatL2)(vectors.shape[1])
+    index.add(vectors)
+    del vectors
+    served = 0
+    busy_s = 0.0
+
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        running = True
+        while running:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                # A client that failed the authkey challenge or hung up mid-handshake
+                continue
+            with conn:
+                while True:
+                    try:
+                        message = conn.recv()
+                        if message[0] == 'search':
+                            _, queries, top_k = message
+                            k = min(top_k, index.ntotal)
+                            t0 = time.perf_counter()
+                            if k > 0:
+                                D, I = index.search(queries, k)
+                            else:
+                                # An empty shard (more shards than rows) contributes nothing
+                                D = np.empty((len(queries), 0), dtype=np.float32)
+                                I = np.empty((len(queries), 0), dtype=np.int64)
+                            elapsed = time.perf_counter() - t0
+                            busy_s += elapsed
+                            served += len(queries)
+                            # Translate local row numbers into global ones
+                            I = np.where(I >= 0, I + start, -1)
+                            conn.send((D, I, elapsed * 1000))
+                        elif message[0] == 'stats':
+                            conn.send({'rows': [start, end], 'ntotal': int(index.ntotal), 'metric': metric,
+                                       'queries_served': served, 'busy_s': busy_s, 'pid': os.getpid()})
+                        elif message[0] == 'close':
+                            conn.send(None)
+                            running = False
+                            break
+                    except (OSError, EOFError):
+                        # The coordinator hung up, e.g. after timing out on us; wait for it to reconnect
+                        break
+
+
+class _ShardHandle:
+    def __init__(self, shard_id: int, address, authkey: bytes, process=None):
+        self.shard_id = shard_id
+        self.address = address
+        self.authkey = authkey
+        self.process = process
+        self.conn = Client(address, authkey=authkey)
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.healthy = True
+        self.closed = False
+        self.latencies_ms = deque(maxlen=1000)
+        self.search_ms = deque(maxlen=1000)
+        self._reconnecting = False
+
+    def fail(self, retry_s: float):
+        """Take the shard out and reconnect in the background; a late reply would desynchronize this connection."""
+        self.healthy = False
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if not self._reconnecting:
+            self._reconnecting = True
+            threading.Thread(target=self._reconnect, args=(retry_s,), daemon=True,
+                             name=f'shard-{self.shard_id}-reconnect').start()
+
+    def _reconnect(self, retry_s: float):
+        # The shard serves one connection at a time, so this waits until it finished the old one
+        while not self.closed and (self.process is None or self.process.is_alive()):
+            try:
+                self.conn = Client(self.address, authkey=self.authkey)
+            except (OSError, EOFError, AuthenticationError):
+                time.sleep(retry_s)
+                continue
+            self.reconnects += 1
+            self.healthy = True
+            break
+        self._reconnecting = False
+
+
+class ShardedRetriever:
+    def __init__(self, embeddings_dir: str = 'data/embeddings/faiss', num_shards: int = 2,
+                 addresses: Optional[Sequence] = None, authkey: Optional[bytes] = None,
+                 threads_per_shard: int = 1, timeout_s: float = 5.0,
+                 metric: str = 'cosine', min_score: Optional[float] = None):
+        """
+        Start local shard processes, or connect to already running shard servers.
+
+        Args:
+            embeddings_dir: Directory with embeddings.npy and metadata.json
+            num_shards: Number of local shard processes (ignored when addresses is given)
+            addresses: Addresses of running shard servers, e.g. [('10.0.0.5', 9000), ...]
+            authkey: Shared secret for the shard connections (default: random for local shards,
+                VECTOR_SEARCH_SHARD_AUTHKEY for remote ones; see shard_authkey())
+            threads_per_shard: FAISS threads per local shard process
+            timeout_s: How long to wait for a shard before answering without it; it is
+                reconnected in the background
+            metric: 'cosine' (normalized inner product, results carry a 'score') or 'l2';
+                remote shards must be served with the same metric
+            min_score: Default similarity cutoff for cosine searches
+        """
+        if metric not in ('cosine', 'l2'):
+            raise ValueError(f"Unknown metric: {metric}")
+        self.metric = metric
+        self.min_score = min_score
+        self.embeddings_dir = Path(embeddings_dir)
+        self.timeout_s = timeout_s
+        self.embeddings = np.load(self.embeddings_dir / 'embeddings.npy', mmap_mode='r')
+        with open(self.embeddings_dir / 'metadata.json', 'r', encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        # Shards hold the stored (possibly projected) vectors; queries are projected here once
+        self.projection = load_projection(self.embeddings_dir)
+        self._socket_dir = None
+        self.shards: List[_ShardHandle] = []
+        # Each shard has one connection and replies in order, so one caller at a time sends and gathers
+        self._lock = threading.Lock()
+        if addresses:
+            addresses = [tuple(address) if isinstance(address, list) else address for address in addresses]
+            authkey = shard_authkey(authkey, addresses)
+            for shard_id, address in enumerate(addresses):
+                self.shards.append(_ShardHandle(shard_id, address, authkey))
+        else:
+            self._start_local_shards(num_shards, authkey or os.urandom(32), threads_per_shard)
+
+    def _start_local_shards(self, num_shards: int, authkey: bytes, threads_per_shard: int):
+        ctx = get_context('spawn')
+        self._socket_dir = tempfile.mkdtemp(prefix='vector_search_shards_')
+        embeddings_path = str(self.embeddings_dir / 'embeddings.npy')
+        pending = []
+        # Every shard gets at least one row
+        num_shards = max(1, min(num_shards, len(self.embeddings)))
+        for shard_id, (start, end) in enumerate(shard_bounds(len(self.embeddings), num_shards)):
+            address = os.path.join(self._socket_dir, f'shard_{shard_id}.sock')
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=serve_shard, daemon=True,
+                                  args=(embeddings_path, start, end, address, authkey, threads_per_shard, child_conn,
+                                        self.metric))
+            process.start()
+            pending.append((shard_id, process, parent_conn))
+        for shard_id, process, parent_conn in pending:
+            if not parent_conn.poll(60):
+                raise RuntimeError(f"Shard {shard_id} did not start")
+            self.shards.append(_ShardHandle(shard_id, parent_conn.recv(), authkey, process))
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 10,
+               min_score: Optional[float] = None) -> List[Dict]:
+        return self.search_batch(query_embedding, top_k, min_score)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     min_score: Optional[float] = None) -> List[List[Dict]]:
+        """
+        Search every shard for the top_k nearest chunks of each query.
+
+        With the cosine metric, results below min_score (default: self.min_score)
+        are dropped, so fewer than top_k may be returned.
+        """
+        metrics = get_metrics()
+        queries = np.ascontiguousarray(np.atleast_2d(query_embeddings), dtype=np.float32)
+        if self.projection is not None:
+            queries = self.projection.apply(queries)
+        cosine = self.metric == 'cosine'
+        if cosine:
+            queries = normalize_rows(queries)
+        min_score = self.min_score if min_score is None else min_score
+        threshold = min_score if cosine and min_score is not None else None
+        with metrics.span('faiss_search'), self._lock:
+            D, I = self._scatter_gather(queries, top_k)
+        with metrics.span('metadata'):
+            batch_results = []
+            for ids, dists in zip(I, D):
+                results = []
+                for idx, dist in zip(ids, dists):
+                    if idx < 0:
+                        continue
+                    if threshold is not None and dist < threshold:
+                        # Scores are sorted, so nothing after this one qualifies either
+                        break
+                    if cosine:
+                        results.append({**self.metadata[idx], 'score': float(dist), 'distance': 1.0 - float(dist)})
+                    else:
+                        results.append({**self.metadata[idx], 'distance': float(dist)})
+                batch_results.append(results)
+        return batch_results
+
+    def _scatter_gather(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Callers hold self._lock. Scatter: every healthy shard gets the query before we wait on any of them
+        sent = []
+        for shard in self.shards:
+            if not shard.healthy:
+                continue
+            try:
+                shard.conn.send(('search', queries, top_k))
+                sent.append((shard, time.perf_counter()))
+            except (OSError, EOFError):
+                shard.errors += 1
+                shard.fail(self.timeout_s)
+        # Gather partial top-k lists
+        partial_D, partial_I = [], []
+        deadline = time.perf_counter() + self.timeout_s
+        for shard, sent_at in sent:
+            shard.requests += 1
+            try:
+                if not shard.conn.poll(max(0.0, deadline - time.perf_counter())):
+                    shard.timeouts += 1
+                    shard.fail(self.timeout_s)
+                    continue
+                D, I, search_ms = shard.conn.recv()
+            except (OSError, EOFError):
+                shard.errors += 1
+                shard.fail(self.timeout_s)
+                continue
+            shard.latencies_ms.append((time.perf_counter() - sent_at) * 1000)
+            shard.search_ms.append(search_ms)
+            partial_D.append(D)
+            partial_I.append(I)
+        if not partial_D:
+            raise RuntimeError("No shard answered the query.")
+        # Merge: per query, keep the top_k highest scores (smallest distances) across shards
+        D = np.concatenate(partial_D, axis=1)
+        I = np.concatenate(partial_I, axis=1)
+        sign = -1.0 if self.metric == 'cosine' else 1.0
+        keys = np.where(I >= 0, sign * D, np.inf)
+        order = np.argsort(keys, axis=1, kind='stable')[:, :top_k]
+        D = np.take_along_axis(D, order, axis=1)
+        I = np.take_along_axis(I, order, axis=1)
+        return D, np.where(np.isinf(np.take_along_axis(keys, order, axis=1)), -1, I)
+
+    def shard_stats(self) -> List[Dict]:
+        """Health and latency statistics per shard, as seen by the coordinator."""
+        from utils.benchmark import latency_summary
+
+        stats = []
+        for shard in self.shards:
+            entry = {
+                'shard': shard.shard_id,
+                'address': shard.address,
+                'healthy': shard.healthy and (shard.process is None or shard.process.is_alive()),
+                'requests': shard.requests,
+                'errors': shard.errors,
+                'timeouts': shard.timeouts,
+                'reconnects': shard.reconnects,
+                'round_trip': latency_summary(list(shard.latencies_ms)),
+                'search': latency_summary(list(shard.search_ms)),
+            }
+            with self._lock:
+                if shard.healthy:
+                    try:
+                        shard.conn.send(('stats',))
+                        if shard.conn.poll(self.timeout_s):
+                            entry['server'] = shard.conn.recv()
+                        else:
+                            # An unread reply would be taken for the next search's
+                            shard.timeouts += 1
+                            shard.fail(self.timeout_s)
+                            entry['healthy'] = False
+                    except (OSError, EOFError):
+                        shard.fail(self.timeout_s)
+                        entry['healthy'] = False
+            stats.append(entry)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._close_shards()
+        if self._socket_dir and os.path.isdir(self._socket_dir):
+            for name in os.listdir(self._socket_dir):
+                os.unlink(os.path.join(self._socket_dir, name))
+            os.rmdir(self._socket_dir)
+            self._socket_dir = None
+
+    def _close_shards(self):
+        for shard in self.shards:
+            shard.closed = True
+            try:
+                if shard.process is not None and shard.healthy:
+                    shard.conn.send(('close',))
+                    shard.conn.poll(1.0)
+                shard.conn.close()
+            except (OSError, EOFError):
+                pass
+            if shard.process is not None:
+                shard.process.join(timeout=5)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+        self.shards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a shard server or compare sharded search with a single index.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help="Serve one shard over TCP")
+    serve.add_argument('--embeddings-dir', default='data/embeddings/faiss')
+    serve.add_argument('--shard', type=int, required=True)
+    serve.add_argument('--num-shards', type=int, required=True)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, required=True)
+    serve.add_argument('--threads', type=int, default=1)
+    serve.add_argument('--metric', choices=['cosine', 'l2'], default='cosine',
+                       help="Must match the coordinator's metric")
+    serve.add_argument('--authkey', default=None,
+                       help="Shared secret (default: VECTOR_SEARCH_SHARD_AUTHKEY); required off loopback")
+    check = sub.add_parser('check', help="Compare local sharded search with FaissRetriever")
+    check.add_argument('--embeddings-dir', default='data/embeddings/faiss')
+    check.add_argument('--num-shards', type=int, default=4)
+    check.add_argument('--queries', type=int, default=100)
+    check.add_argument('--metric', choices=['cosine', 'l2'], default='cosine')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        embeddings_path = os.path.join(args.embeddings_dir, 'embeddings.npy')
+        num_rows = len(np.load(embeddings_path, mmap_mode='r'))
+        start, end = shard_bounds(num_rows, args.num_shards)[args.shard]
+        try:
+            authkey = shard_authkey(args.authkey, [(args.host, args.port)])
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Serving shard {args.shard} (rows {start}-{end}) on {args.host}:{args.port}")
+        serve_shard(embeddings_path, start, end, (args.host, args.port), authkey, num_threads=args.threads,
+                    metric=args.metric)
+        return
+
+    from utils.benchmark import sample_queries
+    from utils.faiss_retriever import FaissRetriever
+
+    single = FaissRetriever(args.embeddings_dir, metric=args.metric)
+    queries = sample_queries(single.embeddings, args.queries, projection=single.projection)
+    with ShardedRetriever(args.embeddings_dir, num_shards=args.num_shards, metric=args.metric) as sharded:
+        expected = single.search_batch(queries, top_k=10)
+        actual = sharded.search_batch(queries, top_k=10)
+        matches = sum([r['chunk_id'] for r in a] == [r['chunk_id'] for r in e]
+                      and [r['category'] for r in a] == [r['category'] for r in e]
+                      for a, e in zip(actual, expected))
+        print(f"{matches}/{len(queries)} queries returned identical top-10 lists")
+        for entry in sharded.shard_stats():
+            rt = entry['round_trip']
+            print(f"  shard {entry['shard']}: healthy={entry['healthy']} requests={entry['requests']} "
+                  f"p50={rt.get('p50_ms', 0):.3f} ms p95={rt.get('p95_ms', 0):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
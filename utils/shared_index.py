@@ -0,0 +1,223 @@
+"""
+Index shared between worker processes through shared memory.
+
+publish_shared_index() is run once by a loader: it copies the vectors into a
+directory on a tmpfs (/dev/shm by default, i.e. shared memory) and packs the
+metadata into a MetadataStore next to them. SharedIndexRetriever attaches to
+that directory by memory-mapping both, so every worker searches the same
+physical pages: adding workers adds CPU, not copies of embeddings.npy,
+metadata.json and a FAISS index.
+
+Searches run with faiss.knn directly on the mapped array, which avoids the
+private copy a FAISS index would make of the vectors.
+
+A published index is a read-only snapshot. Live updates in the source
+directory's write-ahead log (FaissRetriever.upsert/delete) are folded in when
+publishing, but workers never read the log themselves: republish to make
+later updates visible.
+
+    python -m utils.shared_index data/embeddings/faiss /dev/shm/vector_search
+    VECTOR_SEARCH_SHARED_INDEX=/dev/shm/vector_search streamlit run app.py
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.metadata_store import MetadataStore, write_metadata_store
+from utils.metrics import get_metrics
+from utils.projection import PROJECTION_FILE, load_projection, normalize_rows
+from utils.snippets import SENTENCE_VECTORS_FILE, annotate_best_sentences, load_sentence_vectors
+
+DEFAULT_SHARED_DIR = '/dev/shm/vector_search'
+CONFIG_FILE = 'index_config.json'
+
+
+def publish_shared_index(embeddings_dir: str = 'data/embeddings/faiss',
+                         shared_dir: str = DEFAULT_SHARED_DIR, metric: str = 'cosine') -> str:
+    """
+    Place the vectors and packed metadata of embeddings_dir into shared_dir.
+
+    shared_dir is a symlink to a versioned directory next to it. Each publish
+    writes a new versioned directory and then atomically replaces the symlink
+    with os.replace, so shared_dir always exists and a worker never attaches
+    to a half-written index. The previous version is kept for workers that
+    are attaching to it right now; older ones are removed (workers that still
+    map their files keep them alive until they detach). With the cosine metric
+    the vectors are normalized on the way in. Pending write-ahead log entries
+    of embeddings_dir are applied first, so the snapshot includes them.
+
+    Returns:
+        shared_dir
+    """
+    from utils.faiss_retriever import WAL_FILE
+
+    src = Path(embeddings_dir)
+    if (src / WAL_FILE).exists() and os.path.getsize(src / WAL_FILE):
+        vectors, metadata = _replay_wal(embeddings_dir, metric)
+    else:
+        vectors = np.ascontiguousarray(np.load(src / 'embeddings.npy', mmap_mode='r'), dtype=np.float32)
+        with open(src / 'metadata.json', 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    if metric == 'cosine':
+        vectors = normalize_rows(vectors)
+    shared_dir = os.path.abspath(shared_dir).rstrip(os.sep)
+    parent, name = os.path.split(shared_dir)
+    version_dir = tempfile.mkdtemp(prefix=f"{name}.v-{time.strftime('%Y%m%d-%H%M%S')}-", dir=parent)
+    os.chmod(version_dir, 0o755)
+    version = os.path.basename(version_dir)
+    np.save(os.path.join(version_dir, 'embeddings.npy'), vectors)
+    with open(os.path.join(version_dir, CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'metric': metric}, f)
+    count = write_metadata_store(metadata, version_dir)
+    if count != len(vectors):
+        shutil.rmtree(version_dir)
+        raise ValueError(f"{count} metadata records for {len(vectors)} vectors in {embeddings_dir}")
+    for side_file in (PROJECTION_FILE, SENTENCE_VECTORS_FILE):
+        if (src / side_file).exists():
+            shutil.copy2(src / side_file, version_dir)
+    previous = os.readlink(shared_dir) if os.path.islink(shared_dir) else None
+    if os.path.isdir(shared_dir) and previous is None:
+        # Published by an older version as a plain directory; moved aside once
+        os.rename(shared_dir, os.path.join(parent, f"{name}.v-legacy-{os.getpid()}"))
+    tmp_link = f"{shared_dir}.link-{os.getpid()}"
+    os.symlink(version, tmp_link)
+    os.replace(tmp_link, shared_dir)
+    for entry in os.listdir(parent or '.'):
+        if entry.startswith(f"{name}.v-") and entry not in (version, previous):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+    return shared_dir
+
+
+def _replay_wal(embeddings_dir: str, metric: str):
+    """Live vectors (in the stored, possibly projected space) and metadata of embeddings_dir after its log."""
+    from utils.faiss_retriever import FaissRetriever, chunk_key
+
+    retriever = FaissRetriever(embeddings_dir, metric=metric)
+    try:
+        retriever.compact()
+        # Keep each row's stable key, as checkpoint() does, in case metadata alone doesn't derive it
+        metadata = [{**meta, 'chunk_key': key} if chunk_key(meta) != key else meta
+                    for meta, key in zip(retriever.metadata, retriever._row_keys)]
+        return np.array(retriever.embeddings, dtype=np.float32), metadata
+    finally:
+        retriever.close()
+
+
+class SharedIndexRetriever:
+    """
+    Read-only search over a published snapshot. Upserts and deletes logged in
+    the source directory after publishing are not seen until it is republished.
+    """
+
+    def __init__(self, shared_dir: str = DEFAULT_SHARED_DIR, min_score: Optional[float] = None):
+        """
+        Attach to an index published with publish_shared_index().
+
+        Args:
+            shared_dir: Directory written by publish_shared_index()
+            min_score: Default similarity cutoff for cosine indexes
+        """
+        self.min_score = min_score
+        self.embeddings = None
+        self.metadata = None
+        for attempt in range(3):
+            # Resolve the symlink once so every file comes from the same published version
+            self.shared_dir = Path(os.path.realpath(shared_dir))
+            try:
+                self._load_index()
+                break
+            except FileNotFoundError:
+                # Republished twice while attaching: the resolved version was cleaned up
+                if attempt == 2:
+                    raise
+
+    def _load_index(self):
+        # Memory-mapped read-only: no copy is made, pages are shared with other workers
+        self.embeddings = np.load(self.shared_dir / 'embeddings.npy', mmap_mode='r')
+        self.metadata = MetadataStore(str(self.shared_dir))
+        self.projection = load_projection(self.shared_dir)
+        self.sentence_vectors = load_sentence_vectors(self.shared_dir, self.embeddings.shape[1])
+        try:
+            with open(self.shared_dir / CONFIG_FILE, 'r', encoding='utf-8') as f:
+                self.metric = json.load(f)['metric']
+        except FileNotFoundError:
+            if not self.shared_dir.is_dir():
+                raise
+            self.metric = 'l2'
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 10,
+               min_score: Optional[float] = None) -> List[Dict]:
+        return self.search_batch(query_embedding, top_k, min_score)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10,
+                     min_score: Optional[float] = None) -> List[List[Dict]]:
+        import faiss
+
+        metrics = get_metrics()
+        queries = np.ascontiguousarray(np.atleast_2d(query_embeddings), dtype=np.float32)
+        if self.projection is not None:
+            queries = self.projection.apply(queries)
+        cosine = self.metric == 'cosine'
+        if cosine:
+            queries = normalize_rows(queries)
+        min_score = self.min_score if min_score is None else min_score
+        threshold = min_score if cosine and min_score is not None else None
+        k = min(top_k, len(self.embeddings))
+        if k <= 0:
+            return [[] for _ in queries]
+        with metrics.span('faiss_search'):
+            D, I = faiss.knn(queries, self.embeddings, k,
+                             metric=faiss.METRIC_INNER_PRODUCT if cosine else faiss.METRIC_L2)
+        with metrics.span('metadata'):
+            batch_results = []
+            for query, ids, dists in zip(queries, I, D):
+                results = []
+                for idx, dist in zip(ids, dists):
+                    if idx < 0:
+                        continue
+                    if threshold is not None and dist < threshold:
+                        break
+                    if cosine:
+                        results.append({**self.metadata[int(idx)], 'score': float(dist), 'distance': 1.0 - float(dist)})
+                    else:
+                        results.append({**self.metadata[int(idx)], 'distance': float(dist)})
+                annotate_best_sentences(results, query, self.sentence_vectors)
+                batch_results.append(results)
+        return batch_results
+
+    def close(self):
+        self.metadata.close()
+
+
+def memory_usage() -> Dict[str, int]:
+    """Resident memory of this process split into private and shared parts (KiB, Linux only)."""
+    usage = {}
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'RssAnon', 'RssFile', 'RssShmem'):
+                    usage[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish an index into shared memory for worker processes.")
+    parser.add_argument('embeddings_dir', nargs='?', default='data/embeddings/faiss')
+    parser.add_argument('shared_dir', nargs='?', default=DEFAULT_SHARED_DIR)
+    args = parser.parse_args()
+    publish_shared_index(args.embeddings_dir, args.shared_dir)
+    print(f"Published {args.embeddings_dir} to {args.shared_dir}")
+
+
+if __name__ == "__main__":
+    main()
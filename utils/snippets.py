@@ -0,0 +1,107 @@
+"""
+Query-aware snippets from precomputed sentence offsets.
+
+The chunking pipeline stores each chunk's sentence boundaries in its metadata
+('sentence_offsets': [start, end) character offsets into 'content'), so the
+search path never re-tokenizes a hit. Built with --sentence-embeddings,
+generate_embeddings also stores every sentence's vector as float16 in
+sentence_embeddings.npy next to embeddings.npy, and each chunk's metadata
+points at its rows ('sentence_rows': [start, end)). Retrievers then mark the
+sentence closest to the query in each hit ('best_sentence') with one dot
+product over the hits' sentence vectors.
+
+snippet() turns a result into display text: the best sentence when there is
+one, otherwise the sentence sharing the most words with the query, otherwise
+the start of the chunk.
+"""
+
+import re
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SENTENCE_VECTORS_FILE = 'sentence_embeddings.npy'
+_WORD = re.compile(r'\w+')
+
+
+def load_sentence_vectors(directory, dim: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    The sentence vectors saved with an index directory (memory-mapped), or None.
+
+    Args:
+        directory: Index directory
+        dim: Dimension of the index's stored vectors; sentence vectors of another
+            dimension can't be compared with queries and are ignored with a warning
+    """
+    path = Path(directory) / SENTENCE_VECTORS_FILE
+    if not path.exists():
+        return None
+    vectors = np.load(path, mmap_mode='r')
+    if dim is not None and vectors.shape[1] != dim:
+        print(f"Warning: {path} has {vectors.shape[1]}-dim vectors but the index has {dim}; "
+              f"best sentences are disabled (rebuild with --sentence-embeddings or re-run utils.projection)")
+        return None
+    return vectors
+
+
+def annotate_best_sentences(results: List[Dict], query: np.ndarray, sentence_vectors: Optional[np.ndarray]):
+    """
+    Set 'best_sentence' (an index into 'sentence_offsets') on each result that has sentence vectors.
+
+    Args:
+        results: Search results for one query
+        query: The query vector in the index's space (after any projection)
+        sentence_vectors: Array from load_sentence_vectors()
+    """
+    if sentence_vectors is None or sentence_vectors.shape[1] != query.shape[-1]:
+        return
+    spans = [(r, r['sentence_rows']) for r in results if r.get('sentence_rows')
+             and r['sentence_rows'][1] > r['sentence_rows'][0]]
+    if not spans:
+        return
+    rows = np.concatenate([np.arange(start, end) for _, (start, end) in spans])
+    scores = sentence_vectors[rows].astype(np.float32) @ query.astype(np.float32).ravel()
+    position = 0
+    for result, (start, end) in spans:
+        count = end - start
+        result['best_sentence'] = int(np.argmax(scores[position:position + count]))
+        position += count
+
+
+def _trim(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    last_space = cut.rfind(' ')
+    return (cut[:last_space] if last_space > max_chars * 2 // 3 else cut) + '...'
+
+
+def _lexical_best(content: str, offsets: List[List[int]], query: str) -> Optional[int]:
+    terms = {w.lower() for w in _WORD.findall(query)}
+    if not terms:
+        return None
+    overlaps = [len(terms & {w.lower() for w in _WORD.findall(content[s:e])}) for s, e in offsets]
+    best = max(range(len(offsets)), key=overlaps.__getitem__)
+    return best if overlaps[best] else None
+
+
+def snippet(result: Dict, query: Optional[str] = None, max_chars: int = 180) -> str:
+    """
+    Display text for a result: its best-matching sentence, extended with the
+    following sentences up to max_chars, or the first max_chars of the chunk.
+    """
+    content = result.get('content', '')
+    offsets = result.get('sentence_offsets') or []
+    best = result.get('best_sentence')
+    if best is None and offsets and query:
+        best = _lexical_best(content, offsets, query)
+    if best is None or not 0 <= best < len(offsets):
+        return _trim(content, max_chars)
+    start, end = offsets[best]
+    # Fill short sentences out with what follows, as long as whole sentences fit
+    for _, next_end in offsets[best + 1:]:
+        if next_end - start > max_chars:
+            break
+        end = next_end
+    text = _trim(content[start:end].strip(), max_chars)
+    return ('...' + text) if best > 0 else text
@@ -0,0 +1,100 @@
+"""
+Startup-time report: how long importing each entry point takes, and which
+modules are responsible.
+
+Each target is imported in a fresh interpreter with `python -X importtime`,
+so results are not skewed by modules already loaded in this process:
+
+    python -m utils.startup_profile
+    python -m utils.startup_profile utils.faiss_retriever sentence_transformers --top 15
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from typing import Dict, List
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGETS = [
+    'utils.metrics',
+    'utils.faiss_retriever',
+    'utils.process_to_chunks',
+    'utils.generate_embeddings',
+    'streamlit',
+    'sentence_transformers',
+]
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """Parse `-X importtime` output into records with self/cumulative microseconds."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            records.append({
+                'module': name.strip(),
+                'depth': (len(name) - len(name.lstrip())) // 2,
+                'self_us': int(self_us),
+                'cumulative_us': int(cumulative_us),
+            })
+        except ValueError:
+            continue
+    return records
+
+
+def profile_import(target: str, top: int = 10) -> Dict:
+    """Import target in a fresh interpreter and summarize where the time went."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+                          cwd=BASE_DIR, capture_output=True, text=True)
+    wall_s = time.perf_counter() - start
+    records = parse_importtime(proc.stderr)
+    # Aggregate self time per top-level package (torch, numpy, ...)
+    packages = {}
+    for r in records:
+        package = r['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + r['self_us']
+    top_modules = sorted(records, key=lambda r: r['cumulative_us'], reverse=True)[:top]
+    top_packages = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'target': target,
+        'ok': proc.returncode == 0,
+        'error': proc.stderr.strip().splitlines()[-1] if proc.returncode != 0 and proc.stderr.strip() else None,
+        'wall_s': wall_s,
+        'modules_imported': len(records),
+        'top_modules': [{'module': r['module'], 'cumulative_ms': r['cumulative_us'] / 1000} for r in top_modules],
+        'top_packages': [{'package': name, 'self_ms': us / 1000} for name, us in top_packages],
+    }
+
+
+def print_report(report: Dict):
+    status = 'ok' if report['ok'] else f"FAILED ({report['error']})"
+    print(f"\n{report['target']}: {report['wall_s'] * 1000:.0f} ms wall, "
+          f"{report['modules_imported']} modules, {status}")
+    for item in report['top_packages']:
+        print(f"  {item['package']:<32}{item['self_ms']:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report per-module import time for entry points.")
+    parser.add_argument('targets', nargs='*', default=DEFAULT_TARGETS, help="Modules to import")
+    parser.add_argument('--top', type=int, default=10, help="Number of modules/packages to list")
+    parser.add_argument('--output', default=None, help="Write JSON report to this file")
+    args = parser.parse_args()
+
+    reports = [profile_import(target, args.top) for target in args.targets]
+    for report in reports:
+        print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nReport saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Type-ahead suggestions from an in-memory prefix index.
+
+Completions come from the page titles in an index directory and from popular
+past queries (the labeled eval queries, the JSON-lines trace log written by
+utils.metrics and queries recorded while serving). A searched query is only
+suggested after MIN_QUERY_COUNT searches and only outranks titles once it has
+been searched more often than that; at most MAX_QUERIES queries are counted. They are kept in one sorted
+array of keys, so a prefix lookup is two binary searches plus ranking the
+matches; no embedding model is involved. Every word start of a title is
+indexed, so "diet" completes to "Basics of the Renal Diet: ...".
+
+    python -m utils.suggest "kid"
+    python -m utils.suggest --bench
+"""
+
+import os
+import re
+import json
+import time
+import heapq
+import argparse
+import threading
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_EMBEDDINGS_DIR = os.path.join(BASE_DIR, 'data', 'embeddings', 'faiss')
+DEFAULT_QUERIES_PATH = os.path.join(BASE_DIR, 'data', 'eval', 'queries.json')
+# Titles weigh 1.0; a query searched n times weighs n * QUERY_WEIGHT, so it
+# only outranks titles once it has been searched more than 1 / QUERY_WEIGHT times
+QUERY_WEIGHT = 0.25
+# Searches before a query is suggested at all, so one user's typing isn't shown to everyone
+MIN_QUERY_COUNT = 3
+# Distinct queries counted; past this the least searched half is forgotten
+MAX_QUERIES = 10_000
+# Sorts after every character a normalized key can contain
+_KEY_END = '\uffff'
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase and collapse punctuation and whitespace to single spaces."""
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def _strip_site_suffix(titles: List[str]) -> List[str]:
+    """Drop a " - Site Name" suffix shared by many titles; it would match every prefix of the site name."""
+    suffixes = Counter(t.rsplit(' - ', 1)[1] for t in titles if ' - ' in t)
+    if not suffixes:
+        return titles
+    suffix, count = suffixes.most_common(1)[0]
+    if count < max(2, len(titles) // 10):
+        return titles
+    tail = ' - ' + suffix
+    return [t[:-len(tail)] if t.endswith(tail) and len(t) > len(tail) else t for t in titles]
+
+
+def load_titles(embeddings_dir: str) -> List[str]:
+    """Distinct page titles from metadata.json, or from the packed metadata store."""
+    path = Path(embeddings_dir) / 'metadata.json'
+    if path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    else:
+        from utils.metadata_store import MetadataStore
+        store = MetadataStore(embeddings_dir)
+        records = list(store)
+        store.close()
+    titles = {r.get('title', '').strip() for r in records}
+    return sorted(_strip_site_suffix(sorted(t for t in titles if t)))
+
+
+def load_query_counts(queries_path: Optional[str] = DEFAULT_QUERIES_PATH,
+                      trace_log: Optional[str] = None) -> Counter:
+    """
+    Count past queries.
+
+    Args:
+        queries_path: Labeled query file; each query counts once
+        trace_log: JSON-lines trace log (VECTOR_SEARCH_METRICS_LOG); failed requests are skipped
+    """
+    counts = Counter()
+    if queries_path and os.path.exists(queries_path):
+        with open(queries_path, 'r', encoding='utf-8') as f:
+            counts.update(item['query'] for item in json.load(f))
+    if trace_log and os.path.exists(trace_log):
+        with open(trace_log, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                query = (record.get('query') or '').strip()
+                if query and not record.get('error'):
+                    counts[query] += 1
+    return counts
+
+
+class SuggestIndex:
+    """
+    Sorted-array prefix index over titles and past queries.
+    """
+
+    def __init__(self, titles: Iterable[str] = (), query_counts: Optional[Dict[str, int]] = None,
+                 seed_queries: Iterable[str] = (), min_query_count: int = MIN_QUERY_COUNT,
+                 max_queries: int = MAX_QUERIES, cache_size: int = 4096):
+        """
+        Args:
+            titles: Page titles; indexed at every word start
+            query_counts: Past queries and how often they were searched; indexed at the start
+                only, once searched min_query_count times
+            seed_queries: Curated queries indexed from the start as if searched min_query_count times
+            min_query_count: Searches before a query is suggested
+            max_queries: Distinct queries counted before the least searched are evicted
+            cache_size: Ranked results kept per prefix; cleared when the index changes
+        """
+        self.min_query_count = min_query_count
+        self.max_queries = max_queries
+        self._titles = list(titles)
+        self._seeds = {normalize(q): q.strip() for q in seed_queries if normalize(q)}
+        self._counts = Counter()
+        self._query_texts: Dict[str, str] = {}
+        for query, count in (query_counts or {}).items():
+            key = normalize(query)
+            if key:
+                self._counts[key] += count
+                self._query_texts.setdefault(key, query.strip())
+        self._lock = threading.Lock()
+        self._ranked = lru_cache(maxsize=cache_size)(self._rank)
+        self._evict()
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def _query_weight(self, key: str) -> float:
+        count = self._counts[key]
+        if key in self._seeds:
+            count = max(count, self.min_query_count)
+        return QUERY_WEIGHT * count if count >= self.min_query_count else 0.0
+
+    def _build(self):
+        self._texts: List[str] = []
+        self._lengths: List[int] = []
+        self._weights: List[float] = []
+        self._text_ids: Dict[str, int] = {}
+        self._query_ids = set()
+        entries = []
+        for title in self._titles:
+            text_id = self._add_text(title, 1.0)
+            key = normalize(title)
+            starts = [0] + [m.end() for m in re.finditer(' ', key)]
+            entries.extend((key[start:], text_id) for start in starts)
+        for key in set(self._counts) | set(self._seeds):
+            weight = self._query_weight(key)
+            if weight:
+                text_id = self._add_text(self._seeds.get(key) or self._query_texts[key], weight)
+                self._query_ids.add(text_id)
+                entries.append((key, text_id))
+        entries = sorted(set(entries))
+        self._keys = [key for key, _ in entries]
+        self._ids = [text_id for _, text_id in entries]
+        self._ranked.cache_clear()
+
+    def _evict(self) -> bool:
+        if len(self._counts) <= self.max_queries:
+            return False
+        keep = self._counts.most_common(self.max_queries // 2)
+        self._counts = Counter(dict(keep))
+        self._query_texts = {key: self._query_texts[key] for key, _ in keep}
+        return True
+
+    def _add_text(self, text: str, weight: float) -> int:
+        key = normalize(text)
+        text_id = self._text_ids.get(key)
+        if text_id is None:
+            text_id = len(self._texts)
+            self._text_ids[key] = text_id
+            self._texts.append(text)
+            self._lengths.append(len(key))
+            self._weights.append(weight)
+        else:
+            self._weights[text_id] += weight
+        return text_id
+
+    def _rank(self, prefix: str, limit: int) -> tuple:
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + _KEY_END, lo)
+        # Completions matching at their start beat mid-title matches, then heavier and shorter first
+        best = {}
+        for i in range(lo, hi):
+            text_id = self._ids[i]
+            at_start = len(self._keys[i]) == self._lengths[text_id]
+            best[text_id] = best.get(text_id, False) or at_start
+        top = heapq.nsmallest(limit, best.items(), key=lambda item: (
+            not item[1], -self._weights[item[0]], len(self._texts[item[0]]), item[0]))
+        return tuple(self._texts[text_id] for text_id, _ in top)
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[str]:
+        """Ranked completions for prefix (the text typed so far)."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return self.popular(limit)
+        with self._lock:
+            return [text for text in self._ranked(prefix, limit + 1) if normalize(text) != prefix][:limit]
+
+    def popular(self, limit: int = 8) -> List[str]:
+        """Most searched queries, for an empty search box."""
+        with self._lock:
+            top = heapq.nlargest(limit, self._query_ids, key=lambda i: (self._weights[i], -i))
+            return [self._texts[i] for i in top]
+
+    def record(self, query: str):
+        """
+        Count a query that was just searched. It becomes a suggestion once it
+        has been searched min_query_count times and ranks higher from then on.
+        """
+        key = normalize(query)
+        if not key:
+            return
+        with self._lock:
+            self._counts[key] += 1
+            self._query_texts.setdefault(key, query.strip())
+            if self._evict():
+                self._build()
+                return
+            weight = self._query_weight(key)
+            if not weight:
+                return
+            text_id = self._text_ids.get(key)
+            if text_id in self._query_ids:
+                self._weights[text_id] += QUERY_WEIGHT
+            else:
+                # Just earned: the query (or the title it matches) gets every search counted so far
+                text_id = self._add_text(self._query_texts[key], weight)
+                self._query_ids.add(text_id)
+                position = bisect_left(self._keys, key)
+                if position == len(self._keys) or self._keys[position] != key or self._ids[position] != text_id:
+                    self._keys.insert(position, key)
+                    self._ids.insert(position, text_id)
+            self._ranked.cache_clear()
+
+
+def build_suggest_index(embeddings_dir: str = DEFAULT_EMBEDDINGS_DIR,
+                        queries_path: Optional[str] = DEFAULT_QUERIES_PATH,
+                        trace_log: Optional[str] = None,
+                        extra_queries: Iterable[str] = ()) -> SuggestIndex:
+    """
+    Build the suggestion index for an index directory.
+
+    Args:
+        embeddings_dir: Directory whose metadata supplies page titles
+        queries_path: Labeled query file used as seed popular queries
+        trace_log: Trace log with past queries (default: VECTOR_SEARCH_METRICS_LOG)
+        extra_queries: More seed queries, e.g. the app's suggested searches
+    """
+    counts = load_query_counts(None, trace_log or os.environ.get('VECTOR_SEARCH_METRICS_LOG'))
+    seeds = list(load_query_counts(queries_path)) + list(extra_queries)
+    return SuggestIndex(load_titles(embeddings_dir), counts, seeds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefix suggestions from titles and past queries.")
+    parser.add_argument('prefix', nargs='?', default='')
+    parser.add_argument('--embeddings-dir', default=DEFAULT_EMBEDDINGS_DIR)
+    parser.add_argument('--queries', default=DEFAULT_QUERIES_PATH)
+    parser.add_argument('--trace-log', default=None, help="JSON-lines trace log with past queries")
+    parser.add_argument('--limit', type=int, default=8)
+    parser.add_argument('--bench', action='store_true', help="Time lookups for every prefix of every completion")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = build_suggest_index(args.embeddings_dir, args.queries, args.trace_log)
+    print(f"Indexed {len(index)} completions in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.bench:
+        from utils.benchmark import latency_summary
+        prefixes = sorted({normalize(t)[:n] for t in index._texts for n in range(1, 12)})
+        latencies = []
+        for cached in (False, True):
+            if not cached:
+                index._ranked.cache_clear()
+            timings = []
+            for prefix in prefixes:
+                t0 = time.perf_counter()
+                index.suggest(prefix, args.limit)
+                timings.append((time.perf_counter() - t0) * 1000)
+            latencies.append(latency_summary(timings))
+        for label, summary in zip(('cold', 'cached'), latencies):
+            print(f"{label:>7}: {len(prefixes)} prefixes, p50 {summary['p50_ms']:.4f} ms, "
+                  f"p99 {summary['p99_ms']:.4f} ms")
+        return
+    for text in index.suggest(args.prefix, args.limit):
+        print(text)
+
+
+if __name__ == "__main__":
+    main()